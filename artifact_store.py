@@ -0,0 +1,365 @@
+"""Kho artifact dùng chung theo nội dung (content-addressed) cho mọi lần render trên cùng một máy.
+
+Khóa của artifact = sha256 của mọi đầu vào + tham số tạo ra nó (câu, giọng, tốc độ, nội dung file nền/font,
+màu phụ đề, encoder...), nên GUI, render_server và distributed_render chạy cùng lúc dùng lại kết quả của nhau
+(TTS, clip đã encode) thay vì tính lại, và không còn bị xóa ở đầu mỗi lần render như file tạm tên cố định.
+
+Bố cục: <gốc>/objects/<2 ký tự>/<khóa>/ (các file + meta.json), <gốc>/locks/<2 ký tự>/<khóa>.lock
+  - Ghi nguyên tử: ghi vào thư mục tạm cùng ổ đĩa rồi đổi tên, entry hoặc chưa có hoặc đã đầy đủ.
+  - Khóa file (fcntl.flock / msvcrt.locking) theo từng khóa: ai đang tạo artifact thì giữ khóa, job khác
+    (kể cả process khác) chờ rồi dùng lại kết quả; GC chỉ xóa entry không ai đang giữ khóa.
+  - LRU: mỗi lần dùng cập nhật mtime của meta.json; tổng dung lượng vượt hạn mức thì xóa entry dùng lâu nhất
+    cho tới khi còn GC_LOW_WATERMARK hạn mức.
+
+Cấu hình: RENDER_ARTIFACT_DIR (mặc định <thư mục tạm>/auto_video_artifacts),
+RENDER_ARTIFACT_LIMIT_MB (mặc định 4096; 0 = tắt kho, render như trước).
+
+Dòng lệnh:
+    python artifact_store.py [--gc] [--clear]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_LIMIT_MB = 4096
+GC_LOW_WATERMARK = 0.8        # GC xóa tới khi còn 80% hạn mức để không phải chạy lại ngay
+GC_CHECK_EVERY = 20           # quét lại dung lượng thật sau mỗi N lần ghi (process khác cũng ghi vào kho)
+LOCK_POLL_SECONDS = 0.05
+STALE_TMP_SECONDS = 3600      # thư mục tạm của lần ghi bị ngắt (process chết) quá 1 giờ thì dọn
+DIGEST_FULL_LIMIT = 64 * 1024 * 1024
+DIGEST_SAMPLE = 4 * 1024 * 1024
+META_NAME = "meta.json"
+
+
+def _try_lock(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    except OSError:
+        pass
+
+
+def _dir_size(path):
+    total = 0
+    for name in os.listdir(path):
+        try:
+            total += os.path.getsize(os.path.join(path, name))
+        except OSError:
+            pass
+    return total
+
+
+class ArtifactEntry:
+    """Một artifact đang được giữ khóa (chỉ dùng bên trong ArtifactStore.entry)."""
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.path = store.object_dir(key)
+        self._meta = None
+
+    @property
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, META_NAME))
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            with open(os.path.join(self.path, META_NAME), "r", encoding="utf-8") as f:
+                self._meta = json.load(f)
+        return self._meta
+
+    def touch(self):
+        try:
+            os.utime(os.path.join(self.path, META_NAME))
+        except OSError:
+            pass
+
+    def read_bytes(self, name):
+        with open(os.path.join(self.path, name), "rb") as f:
+            data = f.read()
+        self.touch()
+        return data
+
+    def materialize(self, name, dest):
+        """Copy file của artifact ra dest. Không dùng hard link: ffmpeg -y ghi đè dest sẽ hỏng luôn artifact."""
+        if os.path.exists(dest):
+            os.remove(dest)
+        shutil.copyfile(os.path.join(self.path, name), dest)
+        self.touch()
+        return dest
+
+    def put(self, files, meta=None):
+        """files: {tên: bytes hoặc đường dẫn file nguồn}. Ghi vào thư mục tạm rồi đổi tên (nguyên tử)."""
+        if self.exists:
+            return
+        tmp_dir = os.path.join(self.store.root, "tmp", f"{self.key}.{os.getpid()}.{uuid.uuid4().hex[:8]}")
+        os.makedirs(tmp_dir)
+        try:
+            for name, data in files.items():
+                dest = os.path.join(tmp_dir, name)
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    with open(dest, "wb") as f:
+                        f.write(data)
+                else:
+                    shutil.copyfile(data, dest)
+            meta = dict(meta or {}, created=time.time())
+            meta["size"] = _dir_size(tmp_dir)
+            with open(os.path.join(tmp_dir, META_NAME), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            os.rename(tmp_dir, self.path)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self._meta = meta
+        self.store._added(meta["size"])
+
+
+class ArtifactStore:
+    def __init__(self, root=None, limit_bytes=None):
+        if limit_bytes is None:
+            limit_bytes = int(float(os.environ.get("RENDER_ARTIFACT_LIMIT_MB", DEFAULT_LIMIT_MB)) * 1024 * 1024)
+        self.limit_bytes = limit_bytes
+        self.root = root or os.environ.get("RENDER_ARTIFACT_DIR") or os.path.join(
+            tempfile.gettempdir(), "auto_video_artifacts")
+        for sub in ("objects", "locks", "tmp"):
+            os.makedirs(os.path.join(self.root, sub), exist_ok=True)
+        self._lock = threading.Lock()
+        self._usage = None            # ước lượng dung lượng (None = chưa quét)
+        self._writes = 0
+        self._gc_thread = None
+        self._digests = {}            # (đường dẫn, size, mtime) -> sha256 nội dung
+        self.hits = 0
+        self.misses = 0
+
+    def object_dir(self, key):
+        return os.path.join(self.root, "objects", key[:2], key)
+
+    def lock_path(self, key):
+        return os.path.join(self.root, "locks", key[:2], key + ".lock")
+
+    def key_for(self, kind, *parts):
+        payload = json.dumps([kind] + list(parts), ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def file_digest(self, path):
+        """sha256 nội dung file (nhớ theo kích thước + mtime). File rất lớn (video nền) chỉ băm đầu/giữa/cuối."""
+        if not path:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        cache_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        digest = self._digests.get(cache_key)
+        if digest is not None:
+            return digest
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            if st.st_size <= DIGEST_FULL_LIMIT:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+            else:
+                h.update(str(st.st_size).encode())
+                for offset in (0, st.st_size // 2, st.st_size - DIGEST_SAMPLE):
+                    f.seek(offset)
+                    h.update(f.read(DIGEST_SAMPLE))
+        digest = self._digests[cache_key] = h.hexdigest()
+        return digest
+
+    def _acquire(self, key):
+        """fd đã khóa, hoặc None nếu đang có người khác giữ. Sau khi khóa, kiểm tra file khóa chưa bị GC xóa/tạo lại."""
+        path = self.lock_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if not _try_lock(fd):
+            os.close(fd)
+            return None
+        try:
+            same_file = os.path.samestat(os.fstat(fd), os.stat(path))
+        except OSError:
+            same_file = False
+        if not same_file:
+            _unlock(fd)
+            os.close(fd)
+            return None
+        return fd
+
+    def _release(self, fd):
+        _unlock(fd)
+        os.close(fd)
+
+    @contextlib.asynccontextmanager
+    async def entry(self, key, cancel_token=None):
+        """Giữ khóa của một artifact trong suốt khối with (chờ bằng asyncio, không chiếm thread)."""
+        while True:
+            fd = self._acquire(key)
+            if fd is not None:
+                break
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            await asyncio.sleep(LOCK_POLL_SECONDS)
+        try:
+            entry = ArtifactEntry(self, key)
+            if entry.exists:
+                self.hits += 1
+            else:
+                self.misses += 1
+            yield entry
+        finally:
+            self._release(fd)
+
+    def _added(self, size):
+        with self._lock:
+            self._writes += 1
+            if self._usage is not None:
+                self._usage += size
+            need_gc = self._usage is None or self._usage > self.limit_bytes or self._writes % GC_CHECK_EVERY == 0
+            running = self._gc_thread is not None and self._gc_thread.is_alive()
+            if need_gc and not running:
+                self._gc_thread = threading.Thread(target=self.gc, name="artifact-gc", daemon=True)
+                self._gc_thread.start()
+
+    def entries(self):
+        """[(mtime dùng lần cuối, dung lượng, khóa)] của mọi entry trong kho."""
+        result = []
+        objects = os.path.join(self.root, "objects")
+        for prefix in os.listdir(objects):
+            prefix_dir = os.path.join(objects, prefix)
+            for key in os.listdir(prefix_dir):
+                meta_path = os.path.join(prefix_dir, key, META_NAME)
+                try:
+                    with open(meta_path, "r", encoding="utf-8") as f:
+                        size = json.load(f).get("size", 0)
+                    result.append((os.path.getmtime(meta_path), size, key))
+                except (OSError, ValueError):
+                    continue
+        return result
+
+    def _remove(self, key):
+        """Xóa entry nếu không ai đang giữ khóa; file khóa xóa khi vẫn đang giữ để người chờ thử lại file mới."""
+        fd = self._acquire(key)
+        if fd is None:
+            return False
+        try:
+            trash = os.path.join(self.root, "tmp", f"gc_{key}.{uuid.uuid4().hex[:8]}")
+            try:
+                os.rename(self.object_dir(key), trash)
+            except OSError:
+                return False
+            shutil.rmtree(trash, ignore_errors=True)
+            try:
+                os.remove(self.lock_path(key))
+            except OSError:
+                pass
+            return True
+        finally:
+            self._release(fd)
+
+    def _clean_tmp(self):
+        tmp_root = os.path.join(self.root, "tmp")
+        now = time.time()
+        for name in os.listdir(tmp_root):
+            path = os.path.join(tmp_root, name)
+            try:
+                if now - os.path.getmtime(path) > STALE_TMP_SECONDS:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+
+    def gc(self, limit_bytes=None):
+        """Xóa entry dùng lâu nhất tới khi tổng dung lượng <= GC_LOW_WATERMARK * hạn mức. Trả về số byte đã xóa."""
+        limit = self.limit_bytes if limit_bytes is None else limit_bytes
+        gc_fd = self._acquire("gc")   # một process GC tại một thời điểm
+        if gc_fd is None:
+            return 0
+        freed = 0
+        try:
+            self._clean_tmp()
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            if total > limit:
+                target = limit * GC_LOW_WATERMARK
+                for _, size, key in sorted(entries):
+                    if total <= target:
+                        break
+                    if self._remove(key):
+                        total -= size
+                        freed += size
+                if freed:
+                    print(f"[DEBUG] Artifact GC: xóa {freed / (1024 * 1024):.1f} MB, còn {total / (1024 * 1024):.1f} MB")
+            with self._lock:
+                self._usage = total
+        except OSError as e:
+            print(f"[⚠️] Artifact GC lỗi: {e}")
+        finally:
+            self._release(gc_fd)
+        return freed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store():
+    """Kho dùng chung của process, None nếu đã tắt (RENDER_ARTIFACT_LIMIT_MB=0) hoặc không tạo được thư mục."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            try:
+                store = ArtifactStore()
+            except OSError as e:
+                print(f"[⚠️] Không dùng được kho artifact: {e}")
+                store = False
+            _store = store if store and store.limit_bytes > 0 else False
+        return _store or None
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Thống kê / dọn kho artifact dùng chung")
+    parser.add_argument("--gc", action="store_true", help="Chạy GC theo hạn mức")
+    parser.add_argument("--clear", action="store_true", help="Xóa mọi entry không bị khóa")
+    args = parser.parse_args(argv)
+    store = ArtifactStore()
+    if args.gc or args.clear:
+        freed = store.gc(limit_bytes=0 if args.clear else None)
+        print(f"Đã xóa {freed / (1024 * 1024):.1f} MB")
+    entries = store.entries()
+    print(f"{store.root}: {len(entries)} entry, {sum(s for _, s, _ in entries) / (1024 * 1024):.1f} MB"
+          f" / hạn mức {store.limit_bytes / (1024 * 1024):.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
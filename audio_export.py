@@ -0,0 +1,239 @@
+"""Xuất chỉ audio + phụ đề (SRT/ASS) cho một kịch bản, không render khung hình nào.
+
+Dùng cùng giọng/tốc độ/âm lượng như render video: TTS từng câu (câu trùng chỉ gọi một lần), nối PCM
+theo thứ tự câu rồi encode một lần thành một file audio (volume_factor áp dụng ở bước này).
+Mốc thời gian phụ đề tính từ độ dài PCM thật của từng câu nên khớp từng mẫu với file audio.
+ffmpeg chỉ dùng để giải mã mp3 của edge-tts và encode audio cuối, không có encoder video nào.
+
+Dòng lệnh:
+    python audio_export.py --text script.txt --voice 1 --output narration.m4a [--format ass]
+"""
+import os
+import sys
+import time
+import asyncio
+
+from PIL import ImageFont
+
+from video_worker import (
+    split_sentences, get_ffmpeg_path, normalize_path_for_ffmpeg, run_ffmpeg, decode_pcm_from_bytes,
+    remove_partial_outputs, _tts_bytes_with_duration, _shared_call, _sentence_key, _tts_duration_cache
+)
+from frame_compositor import wav_format, wav_pcm, PCM_SAMPLE_WIDTH, DEFAULT_PCM_RATE, DEFAULT_PCM_CHANNELS
+from subtitle_renderer import subtitle_layout
+from render_progress import report_progress
+
+SUBTITLE_FORMATS = ("srt", "ass")
+# Codec theo phần mở rộng của file audio đầu ra
+AUDIO_CODECS = {
+    ".wav": ['-c:a', 'pcm_s16le'],
+    ".mp3": ['-c:a', 'libmp3lame', '-b:a', '192k'],
+    ".m4a": ['-c:a', 'aac', '-b:a', '192k'],
+    ".aac": ['-c:a', 'aac', '-b:a', '192k'],
+    ".flac": ['-c:a', 'flac'],
+}
+DEFAULT_AUDIO_EXT = ".m4a"
+PCM_CHUNK_SECONDS = 10     # ghi PCM vào stdin ffmpeg theo từng khúc
+
+
+def subtitle_path_for(audio_path, subtitle_format="srt"):
+    return os.path.splitext(audio_path)[0] + "." + subtitle_format
+
+
+def _srt_time(seconds):
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms % 3600000 // 60000:02d}:{ms % 60000 // 1000:02d},{ms % 1000:03d}"
+
+
+def _ass_time(seconds):
+    cs = int(round(seconds * 100))
+    return f"{cs // 360000:d}:{cs % 360000 // 6000:02d}:{cs % 6000 // 100:02d}.{cs % 100:02d}"
+
+
+def _ass_color(hex_color, opacity=255):
+    """#RRGGBB -> &HAABBGGRR của ASS (alpha 00 = đục)."""
+    value = (hex_color or "#FFFFFF").lstrip("#")
+    r, g, b = value[0:2], value[2:4], value[4:6]
+    return f"&H{255 - int(opacity):02X}{b}{g}{r}".upper()
+
+
+def _ass_text(sentence):
+    return sentence.replace("\\", "\\\\").replace("{", "\\{").replace("}", "\\}").replace("\n", "\\N")
+
+
+def build_cues(sentences, durations):
+    """[(bắt đầu, kết thúc, câu)] nối tiếp nhau theo độ dài audio thật của từng câu."""
+    cues = []
+    start = 0.0
+    for sentence, duration in zip(sentences, durations):
+        cues.append((start, start + duration, sentence))
+        start += duration
+    return cues
+
+
+def format_srt(cues):
+    blocks = [f"{n}\n{_srt_time(start)} --> {_srt_time(end)}\n{text}\n" for n, (start, end, text) in enumerate(cues, 1)]
+    return "\n".join(blocks)
+
+
+def format_ass(cues, font_path=None, subtitle_color="#FFFF00", stroke_color="#000000", bg_color="#FFFFFF",
+               bg_opacity=255, stroke_width=1, width=1280, height=720):
+    """ASS với style gần giống phụ đề vẽ trên video (cỡ chữ, màu chữ/viền, lề dưới theo khung hình)."""
+    font_size, max_text_width, scale = subtitle_layout(width, height)
+    font_name = "Arial"
+    if font_path:
+        try:
+            font_name = ImageFont.truetype(font_path, font_size).getname()[0] or font_name
+        except OSError:
+            pass
+    side_margin = max(0, (width - max_text_width) // 2)
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 0",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic,"
+        " Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment,"
+        " MarginL, MarginR, MarginV, Encoding",
+        f"Style: Default,{font_name},{font_size},{_ass_color(subtitle_color)},{_ass_color(subtitle_color)},"
+        f"{_ass_color(stroke_color)},{_ass_color(bg_color, bg_opacity)},0,0,0,0,100,100,0,0,1,{stroke_width},0,2,"
+        f"{side_margin},{side_margin},{int(30 * scale)},1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for start, end, text in cues:
+        lines.append(f"Dialogue: 0,{_ass_time(start)},{_ass_time(end)},Default,,0,0,0,,{_ass_text(text)}")
+    return "\n".join(lines) + "\n"
+
+
+def _to_pcm(audio_bytes, rate, channels):
+    """PCM s16le rate/channels của một câu: WAV cùng định dạng đọc thẳng, còn lại giải mã bằng ffmpeg."""
+    if wav_format(audio_bytes) == (rate, channels):
+        return wav_pcm(audio_bytes)
+    return decode_pcm_from_bytes(audio_bytes, rate, channels)
+
+
+def _pcm_chunks(pcms, chunk_bytes):
+    for pcm in pcms:
+        for start in range(0, len(pcm), chunk_bytes):
+            yield pcm[start:start + chunk_bytes]
+
+
+async def export_audio_subtitles(
+    texts, voice, output_path, volume_percent=100, voice_speed=1.0, voice_source="Voicevox",
+    subtitle_format="srt", font_path=None, subtitle_color="#FFFF00", stroke_color="#000000",
+    bg_color="#FFFFFF", bg_opacity=255, stroke_width=1, width=1280, height=720,
+    workers=None, cancel_token=None, progress_queue=None, **_video_options
+):
+    """TTS toàn bộ texts rồi ghi output_path (audio) + file phụ đề cạnh nó (SRT hoặc ASS).
+    Các tham số chỉ dùng cho video (ảnh nền, hiệu ứng, encoder...) được bỏ qua để gọi chung options với render_shard.
+    Câu TTS lỗi bị bỏ qua (như render video). Trả về dict: audio, subtitles, sentences, skipped, seconds."""
+    if subtitle_format not in SUBTITLE_FORMATS:
+        raise ValueError(f"Định dạng phụ đề không hỗ trợ: {subtitle_format}")
+    sentences = [_sentence_key(s) for s in texts if _sentence_key(s)]
+    if not sentences:
+        raise ValueError("Không có câu nào để xuất.")
+    started = time.monotonic()
+    sem = asyncio.Semaphore(workers or os.cpu_count() or 1)
+    shared_tts = {}
+    report_progress(progress_queue, "planned", len(sentences))
+
+    async def tts_one(index, sentence):
+        async with sem:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            tts = await _shared_call(shared_tts, sentence, lambda: _tts_bytes_with_duration(
+                sentence, voice, voice_speed, voice_source, cancel_token
+            ))
+        if tts is None:
+            print(f"[⚠️] Skipping sentence (audio error): {sentence[:30]}...")
+            report_progress(progress_queue, "clip", index, False, time.monotonic())
+        return tts
+
+    results = await asyncio.gather(*(tts_one(i, s) for i, s in enumerate(sentences)))
+    kept = [(i, s, tts[0]) for i, (s, tts) in enumerate(zip(sentences, results)) if tts is not None]
+    if not kept:
+        raise ValueError("Không tạo được audio cho câu nào (kiểm tra Voicevox/edge-tts).")
+
+    # Định dạng PCM chung: theo WAV đầu tiên (Voicevox), edge-tts (mp3) thì dùng mặc định của Voicevox
+    rate, channels = next((fmt for fmt in (wav_format(a) for _, _, a in kept) if fmt),
+                          (DEFAULT_PCM_RATE, DEFAULT_PCM_CHANNELS))
+    pcm_of = {}
+    pcms, cue_sentences, durations = [], [], []
+    frame_bytes = PCM_SAMPLE_WIDTH * channels
+    for index, sentence, audio_bytes in kept:
+        if sentence not in pcm_of:
+            pcm_of[sentence] = await asyncio.to_thread(_to_pcm, audio_bytes, rate, channels)
+        pcm = pcm_of[sentence]
+        if not pcm:
+            print(f"[⚠️] Skipping sentence (audio decode error): {sentence[:30]}...")
+            report_progress(progress_queue, "clip", index, False, time.monotonic())
+            continue
+        duration = len(pcm) / float(frame_bytes * rate)
+        _tts_duration_cache[(voice_source, voice, voice_speed, sentence)] = duration
+        report_progress(progress_queue, "duration", index, duration)
+        report_progress(progress_queue, "clip", index, True, time.monotonic())
+        pcms.append(pcm)
+        cue_sentences.append(sentence)
+        durations.append(duration)
+    if not pcms:
+        raise ValueError("Không giải mã được audio của câu nào.")
+
+    ext = os.path.splitext(output_path)[1].lower()
+    codec_args = AUDIO_CODECS.get(ext, AUDIO_CODECS[DEFAULT_AUDIO_EXT])
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    cmd = [
+        get_ffmpeg_path(), '-y', '-f', 's16le', '-ar', str(rate), '-ac', str(channels), '-i', 'pipe:0',
+        '-af', f"volume={float(volume_percent) / 100.0}", *codec_args, normalize_path_for_ffmpeg(output_path)
+    ]
+    try:
+        await run_ffmpeg(cmd, stdin_data=_pcm_chunks(pcms, PCM_CHUNK_SECONDS * rate * frame_bytes),
+                         cancel_token=cancel_token)
+    except BaseException:
+        remove_partial_outputs(output_path)
+        raise
+
+    cues = build_cues(cue_sentences, durations)
+    if subtitle_format == "ass":
+        text = format_ass(cues, font_path, subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width,
+                          width, height)
+    else:
+        text = format_srt(cues)
+    subtitle_path = subtitle_path_for(output_path, subtitle_format)
+    with open(subtitle_path, "w", encoding="utf-8-sig" if subtitle_format == "srt" else "utf-8") as f:
+        f.write(text)
+    elapsed = time.monotonic() - started
+    print(f"[DEBUG] Xuất audio + phụ đề: {len(cues)} câu, {sum(durations):.1f}s audio trong {elapsed:.1f}s")
+    return {"audio": output_path, "subtitles": subtitle_path, "sentences": len(cues),
+            "skipped": len(sentences) - len(cues), "seconds": sum(durations)}
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Xuất audio + phụ đề (SRT/ASS) cho kịch bản, không render video")
+    parser.add_argument("--text", required=True, help="File văn bản UTF-8")
+    parser.add_argument("--voice", required=True, help="Speaker id Voicevox hoặc tên giọng edge-tts")
+    parser.add_argument("--voice-source", default="Voicevox", choices=("Voicevox", "edge-tts"))
+    parser.add_argument("--output", required=True, help="File audio (.m4a/.mp3/.wav/.flac)")
+    parser.add_argument("--format", default="srt", choices=SUBTITLE_FORMATS, help="Định dạng phụ đề")
+    parser.add_argument("--volume", type=int, default=100, help="Âm lượng giọng (%%)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Tốc độ giọng")
+    parser.add_argument("--font", default=None, help="Font cho style ASS")
+    args = parser.parse_args(argv)
+    with open(args.text, "r", encoding="utf-8") as f:
+        sentences = split_sentences(f.read())
+    voice = int(args.voice) if args.voice_source == "Voicevox" else args.voice
+    stats = asyncio.run(export_audio_subtitles(
+        sentences, voice, args.output, volume_percent=args.volume, voice_speed=args.speed,
+        voice_source=args.voice_source, subtitle_format=args.format, font_path=args.font
+    ))
+    print(f"✅ {stats['sentences']} câu, {stats['seconds']:.1f}s: {stats['audio']} + {stats['subtitles']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,8 @@ import tempfile
 import threading
 import platform
 import math
+import time
+import functools
 import subprocess
 import sys
 
@@ -71,11 +73,29 @@ if sys.platform == "win32":
 else:
     CREATE_NO_WINDOW = 0
 
-from multiprocessing import Queue
-from video_worker import render_shard, normalize_path_for_ffmpeg
+import queue
+from queue import Empty
+from video_worker import (
+    render_shard, normalize_path_for_ffmpeg, sample_sentences, DRAFT_SETTINGS,
+    parse_renditions, composite_size_for, rendition_path, concat_videos, default_engine,
+    run_ffmpeg, run_cancellable, remove_partial_outputs
+)
+from voicevox_pool import get_voicevox_pool, set_voicevox_endpoints, parse_endpoints
+from progressive_output import ProgressiveOutput
+from scratch_space import ScratchSpace
+from render_cancel import CancelToken, RenderCancelled
+from render_progress import RenderProgress
+from encoder_tuning import AUTO_ENCODER, calibrate_encoders, choose_encoder_setting, resolve_encoder_setting, machine_fingerprint
+from render_history import RunRecorder, get_run_history
+from render_planner import plan_render, format_plan
+from render_profiler import profiling_requested, start_profiling, stop_profiling, profile_stage
+from render_manifest import build_manifest, write_manifest, discard_manifest, manifest_path, splice_edit
+from audio_export import export_audio_subtitles, SUBTITLE_FORMATS, DEFAULT_AUDIO_EXT
+from tts_prefetch import TtsPrefetcher, prefetch_enabled
 import requests
 
 output_temp_dir = tempfile.gettempdir()
+UI_POLL_INTERVAL_MS = 200
 
 # Đường dẫn thư mục hiệu ứng bạn chỉ định
 #EFFECTS_DIR = r"C:\Users\manhdungpc\Documents\app_video_app\effects"
@@ -157,9 +177,23 @@ class AutoVideoCreator:
         self.stroke_color = "#000000"
         self.bg_color = "#FFFFFF"
         self.output_dir = os.getcwd()
+        self.scratch = None
+        self.cancel_token = None
+        self.render_thread = None
+        self.plan_only = False
+        self.edit_video = None
+        self.recorder = None
+        self.profiler = None
+        self.run_output = None
+        self.ui_queue = queue.Queue()
+        self.render_progress = RenderProgress()
+        # TTS đoán trước: chạy nền ngay khi có kịch bản + giọng, render dùng lại kết quả
+        self.tts_prefetch = TtsPrefetcher(on_progress=self._on_prefetch_progress) if prefetch_enabled() else None
 
         self.available_encoders = detect_available_encoders()
-        self.encoder = self.available_encoders[0]
+        # "auto": encoder/preset nhanh nhất đạt ngưỡng chất lượng theo profile hiệu chỉnh của máy này
+        self.encoder = AUTO_ENCODER
+        self.calibration_thread = None
 
         # Thêm lựa chọn nguồn voice
         self.voice_source = tk.StringVar(value="Voicevox")
@@ -179,6 +213,7 @@ class AutoVideoCreator:
         self.image_effect_overlay_option = None
 
         self.init_ui()
+        self.root.after(UI_POLL_INTERVAL_MS, self._poll_ui_queue)
 
     def init_ui(self):
         default_font = ("Segoe UI", 10)
@@ -253,6 +288,7 @@ class AutoVideoCreator:
         ttk.Label(options_frame, text="Giọng (Japanese):").grid(row=0, column=2, sticky="e", padx=5, pady=5)
         self.voice_option = ttk.Combobox(options_frame, state="readonly", width=30)
         self.voice_option.grid(row=0, column=3, sticky="ew", padx=5, pady=5)
+        self.voice_option.bind("<<ComboboxSelected>>", self.start_tts_prefetch)
         self.refresh_voice_list()
 
         # Tốc độ giọng
@@ -261,6 +297,8 @@ class AutoVideoCreator:
         self.voice_speed.insert(0, "1.0")
         self.voice_speed.grid(row=1, column=1, sticky="w", padx=5, pady=5)
         self.voice_speed.bind("<FocusOut>", self.validate_numeric_input)
+        self.voice_speed.bind("<FocusOut>", self.start_tts_prefetch, add="+")
+        self.voice_speed.bind("<Return>", self.start_tts_prefetch)
 
         # Font chữ
         ttk.Label(options_frame, text="Font chữ:").grid(row=1, column=2, sticky="e", padx=5, pady=5)
@@ -292,9 +330,16 @@ class AutoVideoCreator:
         self.bg_opacity.grid(row=2, column=3, sticky="w", padx=5, pady=5)
 
         ttk.Label(options_frame, text="Chọn Encoder:").grid(row=3, column=0, sticky="e", padx=5, pady=5)
-        self.encoder_option = ttk.Combobox(options_frame, values=self.available_encoders, state="readonly", width=30)
+        self.encoder_option = ttk.Combobox(options_frame, values=[AUTO_ENCODER] + self.available_encoders, state="readonly", width=30)
         self.encoder_option.set(self.encoder)
         self.encoder_option.grid(row=3, column=1, columnspan=2, sticky="ew", padx=5, pady=5)
+        ttk.Button(options_frame, text="⚙️ Hiệu chỉnh", command=self.start_calibration).grid(row=3, column=3, sticky="w", padx=5, pady=5)
+
+        # Nhiều Voicevox Engine (cách nhau bởi dấu phẩy) để chia tải TTS
+        ttk.Label(options_frame, text="Voicevox Engine:").grid(row=4, column=0, sticky="e", padx=5, pady=5)
+        self.voicevox_endpoints_entry = ttk.Entry(options_frame, width=40, font=default_font)
+        self.voicevox_endpoints_entry.insert(0, ",".join(ep.url for ep in get_voicevox_pool().endpoints))
+        self.voicevox_endpoints_entry.grid(row=4, column=1, columnspan=3, sticky="ew", padx=5, pady=5)
 
         output_frame = ttk.LabelFrame(main_frame, text="Tùy chọn phụ đề & Đầu ra", padding="15 15 15 15")
         output_frame.grid(row=4, column=0, columnspan=4, sticky="ew", pady=10)
@@ -326,21 +371,76 @@ class AutoVideoCreator:
         self.output_dir_label = ttk.Label(output_frame, text=f"Thư mục: {os.path.basename(self.output_dir)}", font=default_font, foreground="gray")
         self.output_dir_label.grid(row=3, column=2, columnspan=2, sticky="w", padx=5, pady=5)
 
+        # Xuất dần: file .part.ts / .m3u8 lớn dần theo thứ tự câu trong lúc render
+        self.progressive_output = tk.BooleanVar(value=False)
+        ttk.Checkbutton(output_frame, text="Xuất dần (xem trước khi render xong)",
+                        variable=self.progressive_output).grid(row=4, column=0, columnspan=2, sticky="w", padx=5, pady=5)
+
+        # TTS + phụ đề đưa thẳng vào ffmpeg qua pipe, clip tạm ghi lên RAM (/dev/shm) nếu có
+        self.use_pipes = tk.BooleanVar(value=False)
+        ttk.Checkbutton(output_frame, text="Pipe + RAM (/dev/shm)",
+                        variable=self.use_pipes).grid(row=4, column=2, columnspan=2, sticky="w", padx=5, pady=5)
+
+        # Nhiều rendition từ một lần ghép hình, ví dụ: 1080p=1920x1080@6M,720p=1280x720@3M,doc=720x1280@2M
+        ttk.Label(output_frame, text="Renditions:").grid(row=6, column=0, sticky="e", padx=5, pady=5)
+        self.renditions_entry = ttk.Entry(output_frame, width=40, font=default_font)
+        self.renditions_entry.grid(row=6, column=1, columnspan=3, sticky="ew", padx=5, pady=5)
+
+        # Bản nháp: độ phân giải thấp, preset nhanh nhất, chỉ render vài câu mẫu để kiểm tra bố cục
+        self.draft_mode = tk.BooleanVar(value=False)
+        ttk.Checkbutton(output_frame, text="Bản nháp nhanh", variable=self.draft_mode).grid(row=5, column=0, sticky="w", padx=5, pady=5)
+        ttk.Label(output_frame, text="Số câu mẫu:").grid(row=5, column=1, sticky="e", padx=5, pady=5)
+        self.draft_count = ttk.Entry(output_frame, width=6, font=default_font)
+        self.draft_count.insert(0, "5")
+        self.draft_count.grid(row=5, column=2, sticky="w", padx=5, pady=5)
+        self.draft_sampling = ttk.Combobox(output_frame, values=["Câu đầu tiên", "Rải đều"], state="readonly", width=12)
+        self.draft_sampling.set("Câu đầu tiên")
+        self.draft_sampling.grid(row=5, column=3, sticky="w", padx=5, pady=5)
+
+        # Profiling: lấy mẫu Python, tracemalloc theo giai đoạn, ffmpeg -benchmark -> báo cáo .txt trong thư mục lưu
+        self.profiling = tk.BooleanVar(value=profiling_requested())
+        ttk.Checkbutton(output_frame, text="Profiling (báo cáo hiệu năng)",
+                        variable=self.profiling).grid(row=7, column=0, columnspan=2, sticky="w", padx=5, pady=5)
+        self.persistent_encoder = tk.BooleanVar(value=default_engine() == "compositor")
+        ttk.Checkbutton(output_frame, text="Encoder thường trú (ảnh nền)",
+                        variable=self.persistent_encoder).grid(row=7, column=2, columnspan=2, sticky="w", padx=5, pady=5)
+        # Chỉ TTS + canh thời gian: một file audio + phụ đề SRT/ASS, không encode video
+        self.audio_only = tk.BooleanVar(value=False)
+        ttk.Checkbutton(output_frame, text="Chỉ xuất audio + phụ đề",
+                        variable=self.audio_only).grid(row=8, column=0, columnspan=2, sticky="w", padx=5, pady=5)
+        self.subtitle_format = ttk.Combobox(output_frame, values=[f.upper() for f in SUBTITLE_FORMATS], state="readonly", width=6)
+        self.subtitle_format.set("SRT")
+        self.subtitle_format.grid(row=8, column=2, sticky="w", padx=5, pady=5)
+
         style.configure("Green.TButton", background="#4CAF50", foreground="white", font=("Segoe UI", 12, "bold"))
         style.map("Green.TButton", background=[('active', '#388E3C')])
         ttk.Button(main_frame, text="🎬 TẠO VIDEO NGAY! 🎞", style="Green.TButton",
-                  command=lambda: threading.Thread(target=self.safe_run).start()).grid(row=5, column=0, columnspan=4, pady=(20, 10), sticky="ew")
+                  command=self.start_render).grid(row=5, column=0, columnspan=3, pady=(20, 10), sticky="ew")
+
+        style.configure("Red.TButton", background="#e53935", foreground="white", font=("Segoe UI", 12, "bold"))
+        style.map("Red.TButton", background=[('active', '#c62828')])
+        ttk.Button(main_frame, text="⛔ HỦY", style="Red.TButton",
+                  command=self.cancel_render).grid(row=5, column=3, pady=(20, 10), padx=(5, 0), sticky="ew")
 
         style.configure("Gray.TButton", background="#607d8b", foreground="white")
         style.map("Gray.TButton", background=[('active', '#455A64')])
         ttk.Button(main_frame, text="🧹 XÓA FILE TẠM", style="Gray.TButton",
-                  command=self.clean_temp_files).grid(row=6, column=0, columnspan=4, pady=5, sticky="ew")
+                  command=self.clean_temp_files).grid(row=6, column=0, columnspan=2, pady=5, sticky="ew")
+        # Sửa video đã render: chỉ render lại câu mới/đã sửa theo file văn bản hiện tại, phần còn lại giữ nguyên
+        ttk.Button(main_frame, text="✏️ SỬA VIDEO", style="Gray.TButton",
+                  command=self.start_edit).grid(row=6, column=2, pady=5, padx=(5, 0), sticky="ew")
+        # Dự toán: dựng kế hoạch clip + ước lượng thời gian/CPU/RAM/đĩa theo lịch sử render, không render gì
+        ttk.Button(main_frame, text="🧮 DỰ TOÁN", style="Gray.TButton",
+                  command=lambda: self.start_render(plan_only=True)).grid(row=6, column=3, pady=5, padx=(5, 0), sticky="ew")
 
         self.progress_bar = ttk.Progressbar(main_frame, orient="horizontal", length=300, mode="determinate")
         self.progress_bar.grid(row=7, column=0, columnspan=4, pady=(10, 5), sticky="ew")
 
+        self.progress_label = ttk.Label(main_frame, text="", font=("Segoe UI", 9), foreground="#555")
+        self.progress_label.grid(row=8, column=0, columnspan=4)
+
         self.status = ttk.Label(main_frame, text="Sẵn sàng...", font=("Segoe UI", 10, "italic"), foreground="#555")
-        self.status.grid(row=8, column=0, columnspan=4, pady=(5, 0))
+        self.status.grid(row=9, column=0, columnspan=4, pady=(5, 0))
 
         self.update_fonts_by_language()
 
@@ -379,6 +479,7 @@ class AutoVideoCreator:
             self.voice_option.set(voice_list[0])
         else:
             self.voice_option.set("")
+        self.start_tts_prefetch()
 
     def validate_numeric_input(self, event):
         try:
@@ -409,10 +510,13 @@ class AutoVideoCreator:
         messagebox.showinfo("Hoàn tất", f"Đã xóa {count} file tạm khỏi thư mục {output_temp_dir}.")
 
     def load_voicevox_speakers(self):
-        VOICEVOX_API_BASE = "http://127.0.0.1:50021"
+        pool = get_voicevox_pool()
         try:
-            response = requests.get(f"{VOICEVOX_API_BASE}/speakers", timeout=10)
-            response.raise_for_status()
+            def fetch_speakers(api_base):
+                resp = requests.get(f"{api_base}/speakers", timeout=10)
+                resp.raise_for_status()
+                return resp
+            response = pool.call(fetch_speakers)
             speakers_data = response.json()
             self.voicevox_speakers = []
             for speaker in speakers_data:
@@ -424,7 +528,8 @@ class AutoVideoCreator:
                         })
             self.voicevox_speakers.sort(key=lambda x: x["name"])
         except requests.exceptions.ConnectionError:
-            messagebox.showerror("Lỗi kết nối", "Không thể kết nối đến Voicevox Engine. Đảm bảo Voicevox Engine đang chạy tại http://127.0.0.1:50021.")
+            endpoints = ", ".join(ep.url for ep in pool.endpoints)
+            messagebox.showerror("Lỗi kết nối", f"Không thể kết nối đến Voicevox Engine. Đảm bảo Voicevox Engine đang chạy tại {endpoints}.")
             self.voicevox_speakers = []
         except requests.exceptions.Timeout:
             messagebox.showerror("Lỗi kết nối", "Hết thời gian chờ khi kết nối Voicevox Engine. Đảm bảo Voicevox Engine đang chạy và phản hồi.")
@@ -481,6 +586,35 @@ class AutoVideoCreator:
         if path:
             self.text_path = path
             self.text_label.config(text=os.path.basename(path), foreground="black")
+            self.start_tts_prefetch()
+
+    def start_tts_prefetch(self, event=None):
+        """TTS nền cho kịch bản đã chọn với giọng/tốc độ hiện tại; đổi giọng/tốc độ thì lượt cũ bị hủy và chạy lại."""
+        if getattr(self, "tts_prefetch", None) is None or not self.text_path:
+            return
+        speakers = self.voicevox_speakers if self.voice_source.get() == "Voicevox" else self.edge_tts_speakers
+        speaker_id = next((s["id"] for s in speakers if s["name"] == self.voice_option.get()), None)
+        try:
+            speed = float(self.voice_speed.get())
+        except ValueError:
+            return
+        if speaker_id is None or not (0.5 <= speed <= 2.0):
+            return
+        endpoints = parse_endpoints(self.voicevox_endpoints_entry.get())
+        if endpoints and endpoints != [ep.url for ep in get_voicevox_pool().endpoints]:
+            set_voicevox_endpoints(endpoints)
+        try:
+            with open(self.text_path, "r", encoding="utf-8") as f:
+                sentences = split_sentences(f.read())
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"[⚠️] Không đọc được kịch bản để TTS trước: {e}")
+            return
+        self.tts_prefetch.update(sentences, speaker_id, speed, self.voice_source.get())
+
+    def _on_prefetch_progress(self, done, total):
+        rendering = self.render_thread is not None and self.render_thread.is_alive()
+        if not rendering and (done == total or done % 10 == 0):
+            self._set_status(f"🔊 Đã tạo trước giọng đọc {done}/{total} câu", "#555")
 
     def select_images(self):
         paths = filedialog.askopenfilenames(filetypes=[("Images", "*.jpg *.png *.jpeg *.gif")])
@@ -502,23 +636,131 @@ class AutoVideoCreator:
             self.output_dir = path
             self.output_dir_label.config(text=f"Thư mục: {os.path.basename(path)}")
 
-    def safe_run(self):
-        self.status.config(text="🔄 Đang chuẩn bị...", foreground="#555")
+    def start_edit(self):
+        path = filedialog.askopenfilename(title="Chọn video đã render", filetypes=[("Video", "*.mp4")])
+        if not path:
+            return
+        if not os.path.exists(manifest_path(path)):
+            messagebox.showerror("Lỗi", "Video này không có manifest (chỉ sửa được video render bằng phiên bản này).")
+            return
+        self.start_render(edit_video=path)
+
+    def start_render(self, plan_only=False, edit_video=None):
+        if self.render_thread is not None and self.render_thread.is_alive():
+            messagebox.showwarning("Đang render", "Đang có một video được render. Bấm HỦY để dừng trước khi render lại.")
+            return
+        self.render_progress.reset()
         self.progress_bar["value"] = 0
-        self.root.update_idletasks()
+        self.progress_bar["maximum"] = 1
+        self.progress_label.config(text="")
+        self.cancel_token = CancelToken()
+        self.plan_only = plan_only
+        self.edit_video = edit_video
+        self.recorder = None
+        self.run_output = None
+        self.render_thread = threading.Thread(target=self.safe_run, daemon=True)
+        self.render_thread.start()
+
+    def start_calibration(self):
+        """Đo lại tốc độ/chất lượng các encoder + preset trên máy này (chạy nền, ~vài chục giây)."""
+        if self.calibration_thread is not None and self.calibration_thread.is_alive():
+            return
+        if self.render_thread is not None and self.render_thread.is_alive():
+            messagebox.showwarning("Đang render", "Hãy hiệu chỉnh khi không render để kết quả đo chính xác.")
+            return
+
+        def _run():
+            try:
+                profile = calibrate_encoders(
+                    self.available_encoders,
+                    progress_callback=lambda i, n, label: self._set_status(
+                        f"⚙️ Đang hiệu chỉnh encoder ({i}/{n}) {label}", "blue")
+                )
+                encoder, preset = choose_encoder_setting(profile, self.available_encoders)
+                self._set_status(f"✅ Hiệu chỉnh xong: {encoder} {preset or ''}", "green")
+                self._notify("info", "Hiệu chỉnh encoder", f"Cấu hình nhanh nhất đạt chất lượng: {encoder} {preset or ''}")
+            except Exception as e:
+                print(f"❌ Lỗi khi hiệu chỉnh encoder: {e}")
+                self._notify("error", "Lỗi", f"Không hiệu chỉnh được encoder: {e}")
+
+        self.calibration_thread = threading.Thread(target=_run, daemon=True)
+        self.calibration_thread.start()
+
+    def cancel_render(self):
+        """Giết ngay mọi ffmpeg đang chạy, dừng gửi TTS và hủy event loop của lần render hiện tại."""
+        if self.cancel_token is None or self.render_thread is None or not self.render_thread.is_alive():
+            return
+        self.status.config(text="⛔ Đang hủy render...", foreground="red")
+        self.cancel_token.cancel()
+
+    # --- Kênh cập nhật giao diện: thread render chỉ đẩy sự kiện vào ui_queue, main loop Tk tự vẽ ---
+    def _set_status(self, text, color="#555"):
+        self.ui_queue.put(("status", text, color))
+
+    def _notify(self, kind, title, message):
+        self.ui_queue.put(("message", kind, title, message))
+
+    def _poll_ui_queue(self):
+        progress_changed = False
+        try:
+            while True:
+                event = self.ui_queue.get_nowait()
+                if event[0] == "status":
+                    self.status.config(text=event[1], foreground=event[2])
+                elif event[0] == "message":
+                    getattr(messagebox, f"show{event[1]}")(event[2], event[3])
+                elif event[0] in RenderProgress.PROGRESS_EVENTS:
+                    self.render_progress.handle(event)
+                    progress_changed = True
+        except Empty:
+            pass
+        rendering = self.render_thread is not None and self.render_thread.is_alive()
+        if progress_changed or (rendering and self.render_progress.total):
+            # Cập nhật cả khi không có sự kiện mới để tốc độ/ETA phản ánh việc render đang chậm lại
+            snap = self.render_progress.snapshot()
+            self.progress_bar["maximum"] = max(snap["total"], 1)
+            self.progress_bar["value"] = snap["done"]
+            self.progress_label.config(text=self.render_progress.format())
+        self.root.after(UI_POLL_INTERVAL_MS, self._poll_ui_queue)
+
+    def safe_run(self):
+        self._set_status("🔄 Đang chuẩn bị...", "#555")
 
         try:
             asyncio.run(self.create_video())
+        except (RenderCancelled, asyncio.CancelledError):
+            print("[DEBUG] Render đã bị hủy.")
         except Exception as e:
             import traceback
             traceback.print_exc()
             print(f"Lỗi khi render: {e}")
-            messagebox.showerror("Lỗi", f"Render gặp lỗi:\n{e}\nKiểm tra console để biết thêm chi tiết.")
+            self._notify("error", "Lỗi", f"Render gặp lỗi:\n{e}\nKiểm tra console để biết thêm chi tiết.")
         finally:
-            self.status.config(text="Hoàn tất hoặc gặp lỗi.", foreground="#555")
-            self.root.update_idletasks()
+            if self.scratch is not None:
+                self.scratch.cleanup()
+                self.scratch = None
+            if self.recorder is not None:
+                if self.cancel_token is not None and self.cancel_token.cancelled:
+                    run_status = "cancelled"
+                elif self.run_output and os.path.exists(self.run_output) \
+                        and os.path.getmtime(self.run_output) >= self.recorder.started_at:
+                    run_status = "done"
+                else:
+                    run_status = "failed"
+                self.recorder.finish(run_status)
+                self.recorder = None
+            if self.profiler is not None:
+                stop_profiling(self.profiler)
+                self.profiler = None
+            if self.cancel_token is not None and self.cancel_token.cancelled:
+                self._set_status("⛔ Đã hủy render.", "red")
+            else:
+                self._set_status("Hoàn tất hoặc gặp lỗi.", "#555")
 
     async def create_video(self):
+        if self.cancel_token is None:
+            self.cancel_token = CancelToken()
+        self.cancel_token.bind_current_task()
         for f in os.listdir(output_temp_dir):
             if f.startswith(("line_", "subtitle_", "temp_", "shard_", "concat_list")):
                 try:
@@ -528,20 +770,28 @@ class AutoVideoCreator:
 
         use_video = self.input_type.get() == "Video"
         if not self.text_path:
-            messagebox.showerror("Lỗi", "Vui lòng chọn file văn bản.")
-            self.status.config(text="Lỗi: Chưa đủ đầu vào.", foreground="red")
+            self._notify("error", "Lỗi", "Vui lòng chọn file văn bản.")
+            self._set_status("Lỗi: Chưa đủ đầu vào.", "red")
             return
-        if use_video:
+        if self.edit_video:
+            await self.edit_existing_video()
+            return
+        audio_only = self.audio_only.get()  # chỉ audio + phụ đề: không cần ảnh/video nền
+        if use_video and not audio_only:
             if not self.video_paths:
-                messagebox.showerror("Lỗi", "Vui lòng chọn ít nhất một video.")
-                self.status.config(text="Lỗi: Chưa đủ đầu vào.", foreground="red")
+                self._notify("error", "Lỗi", "Vui lòng chọn ít nhất một video.")
+                self._set_status("Lỗi: Chưa đủ đầu vào.", "red")
                 return
-        else:
+        elif not audio_only:
             if not self.image_paths:
-                messagebox.showerror("Lỗi", "Vui lòng chọn ít nhất một ảnh.")
-                self.status.config(text="Lỗi: Chưa đủ đầu vào.", foreground="red")
+                self._notify("error", "Lỗi", "Vui lòng chọn ít nhất một ảnh.")
+                self._set_status("Lỗi: Chưa đủ đầu vào.", "red")
                 return
 
+        endpoints = parse_endpoints(self.voicevox_endpoints_entry.get())
+        if endpoints and endpoints != [ep.url for ep in get_voicevox_pool().endpoints]:
+            set_voicevox_endpoints(endpoints)
+
         # Lấy thông tin nguồn voice và voice id
         selected_voice_source = self.voice_source.get()
         selected_speaker_name = self.voice_option.get()
@@ -556,22 +806,22 @@ class AutoVideoCreator:
                 break
 
         if speaker_id is None:
-            messagebox.showerror("Lỗi", "Không tìm thấy ID giọng nói hợp lệ. Vui lòng chọn lại.")
-            self.status.config(text="Lỗi: Speaker không hợp lệ.", foreground="red")
+            self._notify("error", "Lỗi", "Không tìm thấy ID giọng nói hợp lệ. Vui lòng chọn lại.")
+            self._set_status("Lỗi: Speaker không hợp lệ.", "red")
             return
 
         font_name = self.font_option.get()
         font_path = os.path.join(os.environ['WINDIR'], 'Fonts', font_name)
         if not os.path.exists(font_path):
-            messagebox.showwarning("Cảnh báo Font", f"Không tìm thấy font '{font_name}'. Sử dụng font mặc định.")
+            self._notify("warning", "Cảnh báo Font", f"Không tìm thấy font '{font_name}'. Sử dụng font mặc định.")
             font_path = "arial.ttf"
 
         with open(self.text_path, "r", encoding="utf-8") as f:
             sentences = split_sentences(f.read())
 
         if not sentences:
-            messagebox.showwarning("Cảnh báo", "File văn bản không chứa câu nào hợp lệ.")
-            self.status.config(text="Hoàn tất: Không có câu để xử lý.", foreground="orange")
+            self._notify("warning", "Cảnh báo", "File văn bản không chứa câu nào hợp lệ.")
+            self._set_status("Hoàn tất: Không có câu để xử lý.", "orange")
             return
 
         try:
@@ -579,7 +829,7 @@ class AutoVideoCreator:
             if not (0 <= volume <= 200):
                 raise ValueError("Âm lượng phải trong khoảng 0-200.")
         except ValueError as e:
-            messagebox.showerror("Lỗi nhập liệu", f"Âm lượng giọng không hợp lệ: {e}. Đặt lại 100.")
+            self._notify("error", "Lỗi nhập liệu", f"Âm lượng giọng không hợp lệ: {e}. Đặt lại 100.")
             self.volume_entry.set("100")
             volume = 100
 
@@ -588,7 +838,7 @@ class AutoVideoCreator:
             if not (0.5 <= speed <= 2.0):
                 raise ValueError("Tốc độ phải trong khoảng 0.5-2.0.")
         except ValueError as e:
-            messagebox.showerror("Lỗi nhập liệu", f"Tốc độ giọng không hợp lệ: {e}. Đặt lại 1.0.")
+            self._notify("error", "Lỗi nhập liệu", f"Tốc độ giọng không hợp lệ: {e}. Đặt lại 1.0.")
             self.voice_speed.set("1.0")
             speed = 1.0
 
@@ -597,17 +847,23 @@ class AutoVideoCreator:
             if not (0 <= stroke_size <= 10):
                 raise ValueError("Kích thước viền phải trong khoảng 0-10.")
         except ValueError as e:
-            messagebox.showerror("Lỗi nhập liệu", f"Kích thước viền không hợp lệ: {e}. Đặt lại 2.")
+            self._notify("error", "Lỗi nhập liệu", f"Kích thước viền không hợp lệ: {e}. Đặt lại 2.")
             self.stroke_size.set("2")
             stroke_size = 2
 
         bg_opacity = self.bg_opacity.get()
+        if audio_only:
+            await self.export_audio_only(sentences, speaker_id, selected_voice_source, volume, speed, font_path,
+                                         bg_opacity, stroke_size)
+            return
         selected_encoder = self.encoder_option.get()
 
         # --------- TỰ ĐỘNG CHỌN LIBX264 CHO ẢNH + EDGE-TTS ----------
+        auto_encoders = self.available_encoders
         if (not use_video) and (selected_voice_source.lower() == "edge-tts"):
-            if selected_encoder != "libx264":
-                messagebox.showwarning(
+            auto_encoders = ["libx264"]
+            if selected_encoder not in ("libx264", AUTO_ENCODER):
+                self._notify("warning", 
                     "Cảnh báo",
                     "Đầu vào là ảnh và voice là edge-tts. Để đảm bảo không lỗi, hệ thống sẽ tự động chuyển sang encoder 'libx264'."
                 )
@@ -615,84 +871,199 @@ class AutoVideoCreator:
                 self.encoder_option.set("libx264")
         # ------------------------------------------------------------
 
-        num_shards = os.cpu_count()
-        shard_size = math.ceil(len(sentences) / num_shards)
-        shard_paths = []
-        progress_queue = Queue()
-        sem = asyncio.Semaphore(os.cpu_count())
+        try:
+            renditions = parse_renditions(self.renditions_entry.get())
+        except ValueError as e:
+            self._notify("error", "Lỗi nhập liệu", str(e))
+            self._set_status("Lỗi: Renditions không hợp lệ.", "red")
+            return
+        render_settings = {}
+        if renditions:
+            width, height = composite_size_for(renditions)
+            render_settings = {"width": width, "height": height, "renditions": renditions}
+
+        preset = None
+        if selected_encoder == AUTO_ENCODER:
+            # Lần đầu trên máy này: hiệu chỉnh trước (chỉ một lần, profile lưu lại cho các lần sau)
+            self._set_status("⚙️ Đang chọn encoder cho máy này...", "blue")
+            selected_encoder, preset = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(
+                    resolve_encoder_setting, auto_encoders,
+                    progress_callback=lambda i, n, label: self._set_status(
+                        f"⚙️ Lần đầu: hiệu chỉnh encoder ({i}/{n}) {label}", "blue")
+                )
+            )
+            print(f"[DEBUG] Encoder tự động: {selected_encoder} {preset or ''}")
+            if preset:
+                render_settings["preset"] = preset
+
+        # Bản nháp: lấy mẫu câu, giữ chỉ số gốc để ảnh/video nền giống bản đầy đủ
+        global_indices = list(range(len(sentences)))
+        output_name = self.output_name.get()
+        if self.draft_mode.get():
+            try:
+                draft_count = max(1, int(self.draft_count.get()))
+            except ValueError:
+                draft_count = 5
+            every_k = 1
+            if self.draft_sampling.get() == "Rải đều":
+                every_k = max(1, math.ceil(len(sentences) / draft_count))
+            sampled = sample_sentences(sentences, first_n=draft_count, every_k=every_k)
+            global_indices = [i for i, _ in sampled]
+            sentences = [s for _, s in sampled]
+            render_settings = dict(DRAFT_SETTINGS)
+            renditions = []
+            base, ext = os.path.splitext(output_name)
+            output_name = f"{base}_draft{ext or '.mp4'}"
+
+        num_workers = os.cpu_count()
+        final_output = os.path.join(self.output_dir, output_name)
+        # Encoder thường trú: mỗi worker một ffmpeg, frame ghép bằng Python (chỉ áp dụng cho ảnh nền)
+        render_settings["engine"] = "compositor" if self.persistent_encoder.get() and not use_video else "ffmpeg"
+
+        plan_settings = {k: v for k, v in render_settings.items() if k in ("width", "height", "fps", "preset", "renditions", "engine")}
+        plan = await asyncio.to_thread(
+            plan_render, sentences, speaker_id, self.video_paths if use_video else self.image_paths,
+            effect=(self.video_effect_option.get() if self.video_effect_option else "none") if use_video else self.effect_option.get(),
+            voice_speed=speed, voice_source=selected_voice_source, is_video_input=use_video,
+            overlay_effect="none" if use_video else (self.image_effect_overlay_option.get() if self.image_effect_overlay_option else "none"),
+            encoder=selected_encoder, workers=num_workers, use_pipes=self.use_pipes.get(),
+            global_indices=global_indices, **plan_settings
+        )
+        plan_text = format_plan(plan)
+        print(f"[DEBUG] Dự toán render:\n{plan_text}")
+        if self.plan_only:
+            self._set_status(f"🧮 Dự kiến {plan_text.splitlines()[1].split(': ', 1)[1]}", "blue")
+            self._notify("info", "Dự toán render", plan_text)
+            return
+        # Ghi số liệu lần render này vào lịch sử (safe_run chốt khi xong) để các lần dự toán sau chính xác hơn
+        self.run_output = final_output
+        self.recorder = RunRecorder(plan["settings_key"], workers=num_workers, history=get_run_history(),
+                                    machine=machine_fingerprint()).start()
+        if self.profiling.get():
+            self.profiler = start_profiling(output_name, report_dir=self.output_dir)
+        # render_shard báo tiến độ từng clip vào đây; main loop Tk đọc bằng _poll_ui_queue
+        progress_queue = self.ui_queue
+        sem = asyncio.Semaphore(num_workers)
 
         total_sentences = len(sentences)
-        self.status.config(text=f"🔄 Đang xử lý {total_sentences} câu... (0%)", foreground="blue")
-        self.progress_bar["maximum"] = total_sentences
-        self.progress_bar["value"] = 0
-        self.root.update_idletasks()
-
-        # Tính offset cho từng shard
-        sentence_offsets = []
-        offset = 0
-        for i in range(num_shards):
-            part_texts = sentences[i * shard_size:(i + 1) * shard_size]
-            if part_texts:
-                sentence_offsets.append(offset)
-                offset += len(part_texts)
-
-        tasks = []
-        for i in range(num_shards):
-            part_texts = sentences[i * shard_size:(i + 1) * shard_size]
-            if not part_texts:
-                continue
-            offset_in_all = sentence_offsets[i]
-            out_path = os.path.join(output_temp_dir, f"shard_{i}.mp4")
-            shard_paths.append(out_path)
-            if use_video:
-                video_speed = self.video_speed_scale.get()
-                video_effect = self.video_effect_option.get() if self.video_effect_option else "none"
-                tasks.append(
-                    render_shard(
-                        i, part_texts, speaker_id, self.video_paths, font_path,
-                        self.subtitle_color, self.stroke_color, self.bg_color,
-                        video_effect,  # truyền xuống worker
-                        out_path, selected_encoder, progress_queue, volume,
-                        bg_opacity, speed, stroke_size, sem, video_speed=video_speed, is_video_input=True,
-                        offset_in_all=offset_in_all, voice_source=selected_voice_source,
-                        #effects_dir=EFFECTS_DIR
-                    )
-                )
-            else:
-                # Lấy hiệu ứng overlay cho ảnh (snow/sakura/none)
-                image_overlay_effect = self.image_effect_overlay_option.get() if self.image_effect_overlay_option else "none"
-                tasks.append(
-                    render_shard(
-                        i, part_texts, speaker_id, self.image_paths, font_path,
-                        self.subtitle_color, self.stroke_color, self.bg_color,
-                        self.effect_option.get(), out_path, selected_encoder,
-                        progress_queue, volume, bg_opacity, speed, stroke_size, sem,
-                        video_speed=1.0, is_video_input=False,
-                        offset_in_all=offset_in_all, voice_source=selected_voice_source,
-                        #effects_dir=EFFECTS_DIR,
-                        overlay_effect=image_overlay_effect
+        self._set_status(f"🔄 Đang xử lý {total_sentences} câu...", "blue")
+
+        if self.use_pipes.get():
+            # Một ScratchSpace dùng chung cho mọi clip; safe_run dọn dẹp khi xong
+            self.scratch = ScratchSpace()
+            render_settings = dict(render_settings, use_pipes=True, scratch=self.scratch)
+        progressive = None
+        on_clip_done = None
+        if self.progressive_output.get():
+            progressive = ProgressiveOutput(final_output, global_indices, cancel_token=self.cancel_token)
+            on_clip_done = progressive.add
+            self._set_status(f"🔄 Đang xử lý {total_sentences} câu... Xem trước: {os.path.basename(progressive.stream_path)}", "blue")
+
+        # Một hàng đợi clip chung cho cả video: worker rảnh lấy câu dài nhất còn lại (xuất dần thì lấy theo
+        # thứ tự câu), clip trả về luôn theo thứ tự câu nên ghép cuối không phụ thuộc worker nào render.
+        clip_order = "index" if progressive is not None else "longest_first"
+        # Manifest (tham số + danh sách clip) ghi cạnh video để sau này sửa kịch bản chỉ render lại câu thay đổi
+        clip_records = []
+        manifest_options = None if self.draft_mode.get() else dict(
+            voice=speaker_id, image_or_video_paths=self.video_paths if use_video else self.image_paths,
+            font_path=font_path, subtitle_color=self.subtitle_color, stroke_color=self.stroke_color,
+            bg_color=self.bg_color, encoder=selected_encoder, volume_percent=volume, bg_opacity=bg_opacity,
+            voice_speed=speed, stroke_width=stroke_size, is_video_input=use_video, voice_source=selected_voice_source,
+            effect=(self.video_effect_option.get() if self.video_effect_option else "none") if use_video else self.effect_option.get(),
+            video_speed=self.video_speed_scale.get() if use_video else 1.0,
+            overlay_effect="none" if use_video else (self.image_effect_overlay_option.get() if self.image_effect_overlay_option else "none"),
+            **{k: v for k, v in render_settings.items() if k != "scratch"}
+        )
+        if use_video:
+            video_speed = self.video_speed_scale.get()
+            video_effect = self.video_effect_option.get() if self.video_effect_option else "none"
+            render_task = render_shard(
+                0, sentences, speaker_id, self.video_paths, font_path,
+                self.subtitle_color, self.stroke_color, self.bg_color,
+                video_effect,  # truyền xuống worker
+                None, selected_encoder, progress_queue, volume,
+                bg_opacity, speed, stroke_size, sem, video_speed=video_speed, is_video_input=True,
+                offset_in_all=0, voice_source=selected_voice_source,
+                #effects_dir=EFFECTS_DIR
+                on_clip_done=on_clip_done,
+                global_indices=global_indices,
+                cancel_token=self.cancel_token,
+                order=clip_order, workers=num_workers,
+                recorder=self.recorder, clip_records=clip_records,
+                **render_settings
+            )
+        else:
+            # Lấy hiệu ứng overlay cho ảnh (snow/sakura/none)
+            image_overlay_effect = self.image_effect_overlay_option.get() if self.image_effect_overlay_option else "none"
+            render_task = render_shard(
+                0, sentences, speaker_id, self.image_paths, font_path,
+                self.subtitle_color, self.stroke_color, self.bg_color,
+                self.effect_option.get(), None, selected_encoder,
+                progress_queue, volume, bg_opacity, speed, stroke_size, sem,
+                video_speed=1.0, is_video_input=False,
+                offset_in_all=0, voice_source=selected_voice_source,
+                #effects_dir=EFFECTS_DIR,
+                overlay_effect=image_overlay_effect,
+                on_clip_done=on_clip_done,
+                global_indices=global_indices,
+                cancel_token=self.cancel_token,
+                order=clip_order, workers=num_workers,
+                recorder=self.recorder, clip_records=clip_records,
+                **render_settings
+            )
+
+        try:
+            clips = await render_task
+        except (RenderCancelled, asyncio.CancelledError):
+            if progressive is not None:
+                progressive.discard()
+            raise
+
+        if progressive is not None:
+            self._set_status("🔗 Đang hoàn tất video (remux)...", "green")
+            if progressive.appended_clips == 0:
+                self._notify("error", "Lỗi", "Không có phần video nào được tạo. Vui lòng kiểm tra lại quá trình xử lý.")
+                self._set_status("Lỗi: Không có video để ghép.", "red")
+                return
+            try:
+                concat_started = time.monotonic()
+                await progressive.finalize()
+                # Xuất dần chỉ áp dụng cho rendition chính, các rendition khác ghép từ clip như thường
+                for r in renditions[1:]:
+                    await run_cancellable(
+                        concat_videos, [rendition_path(c, r["name"], renditions) for c in clips],
+                        rendition_path(final_output, r["name"], renditions),
+                        rendition_path(os.path.join(output_temp_dir, "concat_list.txt"), r["name"], renditions),
+                        cancel_token=self.cancel_token
                     )
-                )
+                self.recorder.add_stage("concat", time.monotonic() - concat_started)
+                profile_stage("final concat")
+                self._write_manifest(final_output, manifest_options, clip_records)
+            except (RenderCancelled, asyncio.CancelledError):
+                progressive.discard()
+                remove_partial_outputs(final_output, renditions[1:])
+                raise
+            except subprocess.CalledProcessError as e:
+                self._notify("error", "Lỗi ghép video", f"Lỗi khi hoàn tất video:\n{e.stderr}")
+                self._set_status("Lỗi ghép video.", "red")
+                return
+            final_output_display = final_output.replace(os.sep, '/')
+            self._set_status(f"✅ Xong! Video đã lưu tại: {final_output_display}", "darkgreen")
+            self._notify("info", "Hoàn tất", f"Đã tạo video thành công:\n{final_output_display}")
+            return
 
-        await asyncio.gather(*tasks)
-        self.status.config(text="🔗 Đang ghép video cuối cùng...", foreground="green")
-        self.root.update()
+        self._set_status("🔗 Đang ghép video cuối cùng...", "green")
 
-        existing_shard_paths = [p for p in shard_paths if os.path.exists(p)]
-        if not existing_shard_paths:
-            messagebox.showerror("Lỗi", "Không có phần video nào được tạo để ghép. Vui lòng kiểm tra lại quá trình xử lý.")
-            self.status.config(text="Lỗi: Không có video để ghép.", foreground="red")
+        existing_clip_paths = [p for p in clips if os.path.exists(p)]
+        if not existing_clip_paths:
+            self._notify("error", "Lỗi", "Không có phần video nào được tạo để ghép. Vui lòng kiểm tra lại quá trình xử lý.")
+            self._set_status("Lỗi: Không có video để ghép.", "red")
             return
 
-        concat_list_file_path = os.path.join(output_temp_dir, "concat_list.txt")
-        with open(concat_list_file_path, "w", encoding="utf-8") as f:
-            for p in existing_shard_paths:
-                f.write(f"file '{normalize_path_for_ffmpeg(p)}'\n")
-
-        final_output = os.path.join(self.output_dir, self.output_name.get())
         ffmpeg_path = get_ffmpeg_path()
         if ffmpeg_path is None:
-            self.status.config(text="Lỗi: FFmpeg không tìm thấy.", foreground="red")
+            self._set_status("Lỗi: FFmpeg không tìm thấy.", "red")
             return
 
         si = None
@@ -702,24 +1073,102 @@ class AutoVideoCreator:
             si.wShowWindow = subprocess.SW_HIDE
 
         try:
-            concat_cmd = [
-                ffmpeg_path, '-y', '-f', 'concat', '-safe', '0',
-                '-i', normalize_path_for_ffmpeg(concat_list_file_path),
-                '-c', 'copy', normalize_path_for_ffmpeg(final_output)
-            ]
-            concat_cmd = [arg.strip() for arg in concat_cmd if arg.strip()]
-            subprocess.run(concat_cmd, check=True, stderr=subprocess.PIPE, startupinfo=si)
-            final_output_display = final_output.replace(os.sep, '/')
-            self.status.config(text=f"✅ Xong! Video đã lưu tại: {final_output_display}", foreground="darkgreen")
-            messagebox.showinfo("Hoàn tất", f"Đã tạo video thành công:\n{final_output_display}")
+            # Mỗi rendition được ghép riêng từ các clip cùng rendition, theo thứ tự câu
+            concat_started = time.monotonic()
+            outputs = []
+            for r in renditions or [None]:
+                name = r["name"] if r else None
+                concat_list_file_path = rendition_path(os.path.join(output_temp_dir, "concat_list.txt"), name, renditions)
+                with open(concat_list_file_path, "w", encoding="utf-8") as f:
+                    for p in existing_clip_paths:
+                        f.write(f"file '{normalize_path_for_ffmpeg(rendition_path(p, name, renditions))}'\n")
+                rendition_output = rendition_path(final_output, name, renditions)
+                concat_cmd = [
+                    ffmpeg_path, '-y', '-f', 'concat', '-safe', '0',
+                    '-i', normalize_path_for_ffmpeg(concat_list_file_path),
+                    '-c', 'copy', normalize_path_for_ffmpeg(rendition_output)
+                ]
+                concat_cmd = [arg.strip() for arg in concat_cmd if arg.strip()]
+                try:
+                    await run_ffmpeg(concat_cmd, si, cancel_token=self.cancel_token)
+                except (RenderCancelled, asyncio.CancelledError):
+                    remove_partial_outputs(rendition_output)
+                    raise
+                outputs.append(rendition_output.replace(os.sep, '/'))
+            self.recorder.add_stage("concat", time.monotonic() - concat_started)
+            profile_stage("final concat")
+            self._write_manifest(final_output, manifest_options, clip_records)
+            final_output_display = "\n".join(outputs)
+            self._set_status(f"✅ Xong! Video đã lưu tại: {outputs[0]}", "darkgreen")
+            self._notify("info", "Hoàn tất", f"Đã tạo video thành công:\n{final_output_display}")
         except subprocess.CalledProcessError as e:
-            error_message = f"Lỗi khi ghép video:\n{e.stderr.decode() if e.stderr else 'Unknown FFmpeg error.'}"
+            error_message = f"Lỗi khi ghép video:\n{e.stderr or 'Unknown FFmpeg error.'}"
             print(error_message)
-            messagebox.showerror("Lỗi ghép video", error_message)
-            self.status.config(text="Lỗi ghép video.", foreground="red")
+            self._notify("error", "Lỗi ghép video", error_message)
+            self._set_status("Lỗi ghép video.", "red")
+        except RenderCancelled:
+            raise
         except Exception as e:
-            messagebox.showerror("Lỗi", f"Lỗi không xác định khi ghép video: {e}")
-            self.status.config(text="Lỗi ghép video không xác định.", foreground="red")
+            self._notify("error", "Lỗi", f"Lỗi không xác định khi ghép video: {e}")
+            self._set_status("Lỗi ghép video không xác định.", "red")
+
+    def _write_manifest(self, final_output, manifest_options, clip_records):
+        if manifest_options is None:
+            return
+        try:
+            write_manifest(final_output, build_manifest(manifest_options, clip_records))
+        except (OSError, ValueError) as e:
+            discard_manifest(final_output)
+            print(f"[⚠️] Không ghi được manifest: {e}")
+
+    async def export_audio_only(self, sentences, speaker_id, voice_source, volume, speed, font_path,
+                                bg_opacity, stroke_size):
+        base = os.path.splitext(self.output_name.get())[0] or "output"
+        output_path = os.path.join(self.output_dir, base + DEFAULT_AUDIO_EXT)
+        self.run_output = output_path
+        self._set_status(f"🔊 Đang tạo audio + phụ đề cho {len(sentences)} câu...", "blue")
+        try:
+            stats = await export_audio_subtitles(
+                sentences, speaker_id, output_path, volume_percent=volume, voice_speed=speed,
+                voice_source=voice_source, subtitle_format=self.subtitle_format.get().lower(), font_path=font_path,
+                subtitle_color=self.subtitle_color, stroke_color=self.stroke_color, bg_color=self.bg_color,
+                bg_opacity=bg_opacity, stroke_width=stroke_size, workers=os.cpu_count(),
+                cancel_token=self.cancel_token, progress_queue=self.ui_queue
+            )
+        except (ValueError, subprocess.CalledProcessError) as e:
+            print(f"❌ Lỗi khi xuất audio: {e}")
+            self._notify("error", "Lỗi xuất audio", f"Không xuất được audio:\n{getattr(e, 'stderr', None) or e}")
+            self._set_status("Lỗi xuất audio.", "red")
+            return
+        outputs = f"{stats['audio']}\n{stats['subtitles']}".replace(os.sep, '/')
+        self._set_status(f"✅ Xong! Audio {stats['seconds']:.0f}s, {stats['sentences']} câu", "darkgreen")
+        self._notify("info", "Hoàn tất", f"Đã xuất audio + phụ đề:\n{outputs}")
+
+    async def edit_existing_video(self):
+        """Sửa self.edit_video theo file văn bản đang chọn (tham số render lấy từ manifest của video)."""
+        endpoints = parse_endpoints(self.voicevox_endpoints_entry.get())
+        if endpoints and endpoints != [ep.url for ep in get_voicevox_pool().endpoints]:
+            set_voicevox_endpoints(endpoints)
+        with open(self.text_path, "r", encoding="utf-8") as f:
+            sentences = split_sentences(f.read())
+        if not sentences:
+            self._notify("warning", "Cảnh báo", "File văn bản không chứa câu nào hợp lệ.")
+            self._set_status("Hoàn tất: Không có câu để xử lý.", "orange")
+            return
+        self.run_output = self.edit_video
+        self._set_status(f"✏️ Đang sửa {os.path.basename(self.edit_video)}...", "blue")
+        try:
+            stats = await splice_edit(self.edit_video, sentences, cancel_token=self.cancel_token,
+                                      progress_queue=self.ui_queue, workers=os.cpu_count())
+        except (ValueError, subprocess.CalledProcessError) as e:
+            print(f"❌ Lỗi khi sửa video: {e}")
+            self._notify("error", "Lỗi sửa video", f"Không sửa được video:\n{getattr(e, 'stderr', None) or e}")
+            self._set_status("Lỗi sửa video.", "red")
+            return
+        output_display = stats["output"].replace(os.sep, '/')
+        self._set_status(f"✅ Đã sửa: giữ {stats['kept']} clip, render lại {stats['rendered']} câu", "darkgreen")
+        self._notify("info", "Hoàn tất", f"Đã sửa video (giữ {stats['kept']} clip, render lại {stats['rendered']} câu,"
+                                         f" bỏ {stats['removed']} câu):\n{output_display}")
 
 if __name__ == "__main__":
     import multiprocessing
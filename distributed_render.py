@@ -0,0 +1,400 @@
+"""Render phân tán: coordinator chia câu thành các shard job, worker (nhiều process/máy)
+nhận job qua một thư mục chia sẻ (local disk, NFS, SMB...) và chạy render_shard.
+
+Cấu trúc thư mục queue (mỗi lần chạy coordinator xóa pending/claimed/done/output của lần trước
+và gắn run_id mới vào job/kết quả; kết quả mang run_id khác do worker chậm của lần trước ghi thì bị bỏ qua):
+    pending/   job JSON chờ xử lý
+    claimed/   job đã được worker nhận (tên file: <worker_id>__<job>.json)
+    done/      kết quả job (JSON)
+    output/    file shard_XXXX.mp4 do worker tạo ra
+    workers/   heartbeat của từng worker
+    STOP       coordinator tạo file này khi xong để worker thoát
+
+Chạy thử trên một máy Linux:
+    python distributed_render.py worker --queue-dir /tmp/q &   (chạy nhiều lần)
+    python distributed_render.py coordinator --queue-dir /tmp/q --text script.txt \\
+        --options options.json --output out.mp4
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import asyncio
+import argparse
+import threading
+
+from video_worker import render_shard, split_sentences, split_into_shards, concat_videos, rendition_path
+from encoder_tuning import AUTO_ENCODER, resolve_encoder_setting
+
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 15.0
+NO_WORKER_TIMEOUT_FACTOR = 4    # không có worker sống nào trong N×timeout thì coordinator bỏ cuộc
+MAX_ATTEMPTS = 3
+
+QUEUE_SUBDIRS = ("pending", "claimed", "done", "output", "workers")
+
+
+def _job_name(shard_id):
+    return f"shard_{shard_id:04d}"
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def init_queue_dir(queue_dir):
+    for sub in QUEUE_SUBDIRS:
+        os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+    stop_file = os.path.join(queue_dir, "STOP")
+    if os.path.exists(stop_file):
+        os.remove(stop_file)
+
+
+def _purge_queue(queue_dir):
+    """Xóa job/kết quả/shard của lần chạy trước (giữ heartbeat của worker đang chạy)."""
+    for sub in ("pending", "claimed", "done", "output"):
+        sub_dir = os.path.join(queue_dir, sub)
+        for fname in os.listdir(sub_dir):
+            try:
+                os.remove(os.path.join(sub_dir, fname))
+            except OSError:
+                pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _worker_is_dead(queue_dir, worker_id, timeout):
+    beat = _read_json(os.path.join(queue_dir, "workers", f"{worker_id}.json"))
+    if beat is None:
+        return True
+    if beat.get("stopped"):
+        return True
+    # Cùng máy thì kiểm tra PID luôn, không cần chờ hết timeout
+    if beat.get("host") == socket.gethostname() and sys.platform != "win32":
+        if not _pid_alive(beat.get("pid", -1)):
+            return True
+    return time.time() - beat.get("time", 0) > timeout
+
+
+def _live_workers(queue_dir, timeout):
+    workers_dir = os.path.join(queue_dir, "workers")
+    return [
+        fname[:-len(".json")] for fname in os.listdir(workers_dir)
+        if fname.endswith(".json") and not _worker_is_dead(queue_dir, fname[:-len(".json")], timeout)
+    ]
+
+
+# ----------------------------- Coordinator -----------------------------
+
+def submit_jobs(queue_dir, sentences, options, num_shards, run_id=None):
+    """Tạo job JSON cho từng shard (xóa job/kết quả cũ trong queue trước). Trả về danh sách tên job theo thứ tự ghép."""
+    init_queue_dir(queue_dir)
+    _purge_queue(queue_dir)
+    job_names = []
+    for shard_id, offset_in_all, part_texts in split_into_shards(sentences, num_shards):
+        name = _job_name(shard_id)
+        job = {
+            "job": name,
+            "shard_id": shard_id,
+            "offset_in_all": offset_in_all,
+            "texts": part_texts,
+            "options": options,
+            "attempt": 1,
+            "run_id": run_id,
+        }
+        _write_json_atomic(os.path.join(queue_dir, "pending", f"{name}.json"), job)
+        job_names.append(name)
+    return job_names
+
+
+def _requeue_dead_claims(queue_dir, timeout, run_id=None):
+    claimed_dir = os.path.join(queue_dir, "claimed")
+    for fname in os.listdir(claimed_dir):
+        if "__" not in fname or not fname.endswith(".json"):
+            continue
+        worker_id, job_file = fname.split("__", 1)
+        if not _worker_is_dead(queue_dir, worker_id, timeout):
+            continue
+        claimed_path = os.path.join(claimed_dir, fname)
+        job = _read_json(claimed_path)
+        if job is None:
+            continue
+        if job.get("run_id") != run_id:
+            # Job của lần chạy trước: không giao lại
+            os.remove(claimed_path)
+            continue
+        if job.get("attempt", 1) >= MAX_ATTEMPTS:
+            raise RuntimeError(f"Job {job['job']} mất worker sau {MAX_ATTEMPTS} lần (worker cuối: {worker_id})")
+        job["attempt"] = job.get("attempt", 1) + 1
+        print(f"[⚠️] Worker {worker_id} không phản hồi, giao lại {job['job']} (lần {job['attempt']})")
+        _write_json_atomic(os.path.join(queue_dir, "pending", job_file), job)
+        try:
+            os.remove(claimed_path)
+        except FileNotFoundError:
+            pass
+
+
+def wait_for_jobs(queue_dir, job_names, timeout=HEARTBEAT_TIMEOUT, poll_interval=1.0, progress_callback=None,
+                  deadline=None, run_id=None):
+    """Chờ tất cả job xong, giao lại job của worker chết. Trả về {job: shard_path}.
+
+    Ném RuntimeError khi không có worker nào sống trong NO_WORKER_TIMEOUT_FACTOR×timeout giây
+    (chưa có worker nào chạy, hoặc tất cả đã chết), và TimeoutError khi quá deadline giây (None = không giới hạn).
+    """
+    results = {}
+    started_at = last_live = time.time()
+    no_worker_timeout = timeout * NO_WORKER_TIMEOUT_FACTOR
+    while len(results) < len(job_names):
+        for name in job_names:
+            if name in results:
+                continue
+            done_path = os.path.join(queue_dir, "done", f"{name}.json")
+            result = _read_json(done_path)
+            if result is None:
+                continue
+            if result.get("run_id") != run_id:
+                # Worker chậm của lần chạy trước vừa ghi xong: không phải kết quả của lần này
+                os.remove(done_path)
+                continue
+            if result.get("ok"):
+                results[name] = result.get("output")
+                if progress_callback:
+                    progress_callback(len(results), len(job_names))
+                continue
+            # Job lỗi: thử lại trên worker khác nếu còn lượt
+            os.remove(done_path)
+            job = result.get("job_data") or {}
+            if job.get("attempt", 1) >= MAX_ATTEMPTS:
+                raise RuntimeError(f"Job {name} lỗi sau {MAX_ATTEMPTS} lần: {result.get('error')}")
+            job["attempt"] = job.get("attempt", 1) + 1
+            print(f"[⚠️] Job {name} lỗi ({result.get('error')}), thử lại lần {job['attempt']}")
+            _write_json_atomic(os.path.join(queue_dir, "pending", f"{name}.json"), job)
+        _requeue_dead_claims(queue_dir, timeout, run_id)
+        if len(results) >= len(job_names):
+            break
+        now = time.time()
+        if _live_workers(queue_dir, timeout):
+            last_live = now
+        elif now - last_live > no_worker_timeout:
+            raise RuntimeError(
+                f"Không có worker nào hoạt động trong {no_worker_timeout:.0f}s "
+                f"({len(results)}/{len(job_names)} job xong). Hãy chạy: python distributed_render.py worker --queue-dir {queue_dir}"
+            )
+        if deadline is not None and now - started_at > deadline:
+            raise TimeoutError(f"Quá {deadline:.0f}s mà mới xong {len(results)}/{len(job_names)} job")
+        time.sleep(poll_interval)
+    return results
+
+
+def run_coordinator(sentences, queue_dir, final_output, options, num_shards=None,
+                    timeout=HEARTBEAT_TIMEOUT, poll_interval=1.0, progress_callback=None, deadline=None):
+    """Chia job, chờ worker render xong rồi ghép video cuối cùng theo thứ tự shard."""
+    num_shards = num_shards or os.cpu_count()
+    run_id = uuid.uuid4().hex[:12]
+    job_names = submit_jobs(queue_dir, sentences, options, num_shards, run_id)
+    print(f"[DEBUG] Đã tạo {len(job_names)} job trong {queue_dir} (run {run_id})")
+    try:
+        results = wait_for_jobs(queue_dir, job_names, timeout, poll_interval, progress_callback, deadline, run_id)
+    finally:
+        open(os.path.join(queue_dir, "STOP"), "w").close()
+
+    shard_paths = [results[name] for name in job_names if results.get(name) and os.path.exists(results[name])]
+    if not shard_paths:
+        raise RuntimeError("Không có shard nào được tạo để ghép.")
+    renditions = options.get("renditions")
+    for r in renditions or [None]:
+        name = r["name"] if r else None
+        concat_videos(
+            [rendition_path(p, name, renditions) for p in shard_paths],
+            rendition_path(final_output, name, renditions),
+            rendition_path(os.path.join(queue_dir, "concat_list.txt"), name, renditions)
+        )
+    return final_output
+
+
+# ------------------------------- Worker --------------------------------
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, queue_dir, worker_id):
+        super().__init__(daemon=True)
+        self.path = os.path.join(queue_dir, "workers", f"{worker_id}.json")
+        self.worker_id = worker_id
+        self.current_job = None
+        self.stop_event = threading.Event()
+
+    def beat(self, stopped=False):
+        _write_json_atomic(self.path, {
+            "worker_id": self.worker_id,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "time": time.time(),
+            "job": self.current_job,
+            "stopped": stopped,
+        })
+
+    def run(self):
+        while not self.stop_event.wait(HEARTBEAT_INTERVAL):
+            self.beat()
+
+    def stop(self):
+        self.stop_event.set()
+        self.beat(stopped=True)
+
+
+def _claim_next_job(queue_dir, worker_id):
+    pending_dir = os.path.join(queue_dir, "pending")
+    for fname in sorted(os.listdir(pending_dir)):
+        if not fname.endswith(".json"):
+            continue
+        claimed_path = os.path.join(queue_dir, "claimed", f"{worker_id}__{fname}")
+        try:
+            # rename là nguyên tử: chỉ một worker nhận được job
+            os.rename(os.path.join(pending_dir, fname), claimed_path)
+        except (FileNotFoundError, PermissionError):
+            continue
+        job = _read_json(claimed_path)
+        if job is None:
+            continue
+        return job, claimed_path
+    return None, None
+
+
+async def _run_shard_job(job, output_path):
+    options = dict(job["options"])
+    sem = asyncio.Semaphore(options.pop("concurrency", None) or os.cpu_count())
+    if options.get("encoder") == AUTO_ENCODER:
+        # Mỗi máy trong cụm tự chọn encoder/preset theo profile hiệu chỉnh của chính nó
+        encoder, preset = resolve_encoder_setting(options.pop("auto_encoders", None) or ["libx264"])
+        options["encoder"] = encoder
+        if preset and "preset" not in options:
+            options["preset"] = preset
+    await render_shard(
+        job["shard_id"], job["texts"], options.pop("voice"), options.pop("image_or_video_paths"),
+        options.pop("font_path"), options.pop("subtitle_color"), options.pop("stroke_color"),
+        options.pop("bg_color"), options.pop("effect", "none"), output_path,
+        options.pop("encoder", "libx264"), None,
+        sem=sem, offset_in_all=job["offset_in_all"], **options
+    )
+
+
+def _stop_requested(queue_dir, started_at):
+    # Bỏ qua file STOP còn sót lại từ lần chạy trước khi worker khởi động
+    try:
+        return os.path.getmtime(os.path.join(queue_dir, "STOP")) >= started_at
+    except OSError:
+        return False
+
+
+def run_worker(queue_dir, worker_id=None, poll_interval=1.0):
+    """Nhận job từ thư mục queue cho tới khi coordinator tạo file STOP."""
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    for sub in QUEUE_SUBDIRS:
+        os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+    started_at = time.time()
+    heartbeat = _Heartbeat(queue_dir, worker_id)
+    heartbeat.beat()
+    heartbeat.start()
+    print(f"[DEBUG] Worker {worker_id} bắt đầu, queue: {queue_dir}")
+    try:
+        while not _stop_requested(queue_dir, started_at):
+            job, claimed_path = _claim_next_job(queue_dir, worker_id)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            heartbeat.current_job = job["job"]
+            heartbeat.beat()
+            name = job["job"]
+            run_id = job.get("run_id")
+            # run_id trong tên file: worker chậm của lần trước không ghi đè shard của lần này
+            output_path = os.path.join(queue_dir, "output", f"{name}.{run_id}.mp4" if run_id else f"{name}.mp4")
+            part_path = os.path.join(queue_dir, "output", f"{name}.{worker_id}.part.mp4")
+            print(f"[DEBUG] Worker {worker_id} nhận {name} ({len(job['texts'])} câu)")
+            result = {"job": name, "worker_id": worker_id, "run_id": run_id, "ok": False}
+            try:
+                asyncio.run(_run_shard_job(job, part_path))
+                if not os.path.exists(part_path):
+                    raise RuntimeError("render_shard không tạo ra file shard")
+                renditions = job["options"].get("renditions")
+                for r in renditions or [None]:
+                    r_name = r["name"] if r else None
+                    os.replace(rendition_path(part_path, r_name, renditions), rendition_path(output_path, r_name, renditions))
+                result.update(ok=True, output=output_path)
+            except Exception as e:
+                print(f"❌ Worker {worker_id} lỗi khi render {name}: {e}")
+                result.update(error=str(e), job_data=job)
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            _write_json_atomic(os.path.join(queue_dir, "done", f"{name}.json"), result)
+            try:
+                os.remove(claimed_path)
+            except FileNotFoundError:
+                pass
+            heartbeat.current_job = None
+    finally:
+        heartbeat.stop()
+    print(f"[DEBUG] Worker {worker_id} dừng.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render video phân tán qua thư mục queue chia sẻ")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p_worker = sub.add_parser("worker", help="Chạy một worker render")
+    p_worker.add_argument("--queue-dir", required=True)
+    p_worker.add_argument("--id", default=None, help="ID worker (mặc định: host-pid)")
+
+    p_coord = sub.add_parser("coordinator", help="Chia job và ghép video cuối cùng")
+    p_coord.add_argument("--queue-dir", required=True)
+    p_coord.add_argument("--text", required=True, help="File văn bản UTF-8")
+    p_coord.add_argument("--options", required=True,
+                         help="File JSON chứa tham số render_shard (voice, image_or_video_paths, font_path, ...)")
+    p_coord.add_argument("--output", required=True)
+    p_coord.add_argument("--shards", type=int, default=None)
+    p_coord.add_argument("--timeout", type=float, default=HEARTBEAT_TIMEOUT)
+    p_coord.add_argument("--deadline", type=float, default=None, help="Giới hạn tổng thời gian chờ (giây)")
+
+    args = parser.parse_args(argv)
+    if args.mode == "worker":
+        run_worker(args.queue_dir, args.id)
+        return 0
+
+    with open(args.text, "r", encoding="utf-8") as f:
+        sentences = split_sentences(f.read())
+    with open(args.options, "r", encoding="utf-8") as f:
+        options = json.load(f)
+    try:
+        run_coordinator(
+            sentences, args.queue_dir, args.output, options, args.shards, args.timeout,
+            progress_callback=lambda done, total: print(f"[DEBUG] {done}/{total} shard xong"),
+            deadline=args.deadline
+        )
+    except (RuntimeError, TimeoutError) as e:
+        print(f"❌ {e}")
+        return 1
+    print(f"✅ Xong! Video đã lưu tại: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""Hiệu chỉnh encoder/preset theo từng máy.
+
+Mã hóa một clip tổng hợp (testsrc2 + nhiễu nhẹ, giống ảnh nền có chi tiết và chữ) bằng từng encoder/preset
+khả dụng, đo tốc độ (fps), dung lượng và chất lượng (SSIM/PSNR so với bản gốc lossless),
+rồi lưu profile vào ~/.auto_video_app_encoder_profile.json theo "dấu vân tay" của máy
+(hostname + CPU + số core + phiên bản ffmpeg) nên một thư mục home dùng chung vẫn giữ profile riêng từng máy.
+
+Khi render với encoder "auto": chọn cấu hình nhanh nhất có SSIM >= ngưỡng và dung lượng không vượt quá
+max_size_ratio lần so với libx264 -preset fast (mặc định cũ). Ngưỡng lấy từ RENDER_MIN_SSIM / RENDER_MAX_SIZE_RATIO.
+Render phân tán: options {"encoder": "auto", "auto_encoders": [...]} -> mỗi worker tự chọn theo profile của máy nó.
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import platform
+import functools
+import tempfile
+import threading
+import subprocess
+
+from video_worker import get_ffmpeg_path
+
+PROFILE_PATH = os.path.expanduser("~/.auto_video_app_encoder_profile.json")
+PROFILE_VERSION = 1
+AUTO_ENCODER = "auto"
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium")
+HARDWARE_ENCODERS = ("h264_nvenc", "h264_amf", "h264_qsv")
+BASELINE = ("libx264", "fast")
+DEFAULT_MIN_SSIM = 0.94
+DEFAULT_MAX_SIZE_RATIO = 1.6
+CALIBRATION_SIZE = (1280, 720)
+CALIBRATION_FPS = 25
+CALIBRATION_SECONDS = 3
+
+_profile_lock = threading.Lock()
+
+
+def _startupinfo():
+    if sys.platform != "win32":
+        return None
+    si = subprocess.STARTUPINFO()
+    si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    si.wShowWindow = subprocess.SW_HIDE
+    return si
+
+
+def _cpu_model():
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/cpuinfo", "r") as f:
+                for line in f:
+                    if line.startswith("model name"):
+                        return line.split(":", 1)[1].strip()
+        except OSError:
+            pass
+    return platform.processor() or platform.machine()
+
+
+def _ffmpeg_version(ffmpeg):
+    try:
+        out = subprocess.run([ffmpeg, '-version'], capture_output=True, text=True, startupinfo=_startupinfo()).stdout
+        return out.splitlines()[0] if out else ""
+    except OSError:
+        return ""
+
+
+@functools.lru_cache(maxsize=4)
+def machine_fingerprint(ffmpeg=None):
+    ffmpeg = ffmpeg or get_ffmpeg_path()
+    return "|".join([socket.gethostname(), _cpu_model(), str(os.cpu_count()), _ffmpeg_version(ffmpeg)])
+
+
+def _read_profiles(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == PROFILE_VERSION:
+            return data
+    except (OSError, ValueError):
+        pass
+    return {"version": PROFILE_VERSION, "machines": {}}
+
+
+def load_profile(path=PROFILE_PATH, fingerprint=None):
+    """Profile của máy hiện tại, hoặc None nếu chưa hiệu chỉnh (hoặc CPU/ffmpeg đã đổi)."""
+    fingerprint = fingerprint or machine_fingerprint()
+    with _profile_lock:
+        return _read_profiles(path)["machines"].get(fingerprint)
+
+
+def save_profile(profile, path=PROFILE_PATH):
+    with _profile_lock:
+        data = _read_profiles(path)
+        data["machines"][profile["fingerprint"]] = profile
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def _candidate_settings(encoders, presets):
+    settings = []
+    for encoder in encoders:
+        if encoder == "libx264":
+            settings.extend(("libx264", p) for p in presets)
+        elif encoder in HARDWARE_ENCODERS:
+            # render_sentence không truyền -preset cho encoder phần cứng -> đo cấu hình mặc định
+            settings.append((encoder, None))
+    return settings
+
+
+def _measure_quality(ffmpeg, encoded, reference, si):
+    cmd = [ffmpeg, '-i', encoded, '-i', reference, '-lavfi',
+           "[0:v]split[a][b];[1:v]split[c][d];[a][c]ssim;[b][d]psnr", '-f', 'null', '-']
+    result = subprocess.run(cmd, capture_output=True, text=True, startupinfo=si)
+    ssim = re.search(r"SSIM .*All:([\d.]+)", result.stderr)
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", result.stderr)
+    return (float(ssim.group(1)) if ssim else None,
+            float(psnr.group(1)) if psnr and psnr.group(1) != "inf" else None)
+
+
+def calibrate_encoders(encoders, width=CALIBRATION_SIZE[0], height=CALIBRATION_SIZE[1], fps=CALIBRATION_FPS,
+                       seconds=CALIBRATION_SECONDS, presets=X264_PRESETS, path=PROFILE_PATH,
+                       progress_callback=None):
+    """Đo từng encoder/preset trên clip tổng hợp, lưu và trả về profile của máy này."""
+    ffmpeg = get_ffmpeg_path()
+    si = _startupinfo()
+    threads = str(os.cpu_count())
+    num_frames = int(fps * seconds)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="auto_video_calib_") as tmp:
+        reference = os.path.join(tmp, "reference.mkv")
+        source = f"testsrc2=s={width}x{height}:r={fps}:d={seconds},noise=alls=3:allf=t"
+        subprocess.run([ffmpeg, '-y', '-f', 'lavfi', '-i', source, '-c:v', 'ffv1', reference],
+                       capture_output=True, check=True, startupinfo=si)
+        settings = _candidate_settings(encoders, presets)
+        for i, (encoder, preset) in enumerate(settings):
+            label = f"{encoder} {preset}" if preset else encoder
+            if progress_callback:
+                progress_callback(i, len(settings), label)
+            out_path = os.path.join(tmp, f"out_{i}.mp4")
+            cmd = [ffmpeg, '-y', '-i', reference, '-c:v', encoder]
+            if preset:
+                cmd += ['-preset', preset]
+            cmd += ['-threads', threads, '-pix_fmt', 'yuv420p', '-an', out_path]
+            started = time.monotonic()
+            result = subprocess.run(cmd, capture_output=True, text=True, startupinfo=si)
+            elapsed = time.monotonic() - started
+            if result.returncode != 0 or not os.path.exists(out_path):
+                print(f"[⚠️] Hiệu chỉnh: {label} lỗi: {result.stderr[-300:]}")
+                continue
+            ssim, psnr = _measure_quality(ffmpeg, out_path, reference, si)
+            entry = {
+                "encoder": encoder, "preset": preset,
+                "fps": round(num_frames / max(elapsed, 1e-6), 2),
+                "size_bytes": os.path.getsize(out_path),
+                "ssim": ssim, "psnr": psnr,
+            }
+            print(f"[DEBUG] Hiệu chỉnh {label}: {entry['fps']} fps, {entry['size_bytes'] // 1024} KB, "
+                  f"SSIM {ssim}, PSNR {psnr}")
+            results.append(entry)
+    if progress_callback:
+        progress_callback(len(settings), len(settings), "")
+    profile = {
+        "fingerprint": machine_fingerprint(ffmpeg),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "width": width, "height": height, "fps": fps, "seconds": seconds,
+        "results": results,
+    }
+    save_profile(profile, path)
+    return profile
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"[⚠️] {name} không hợp lệ: {value}")
+        return default
+
+
+def choose_encoder_setting(profile, encoders=None, min_ssim=None, max_size_ratio=None):
+    """(encoder, preset) nhanh nhất đạt ngưỡng chất lượng; preset None với encoder phần cứng.
+    Không có kết quả nào đạt thì trả về cấu hình mặc định cũ (libx264 fast)."""
+    min_ssim = _env_float("RENDER_MIN_SSIM", DEFAULT_MIN_SSIM) if min_ssim is None else min_ssim
+    max_size_ratio = _env_float("RENDER_MAX_SIZE_RATIO", DEFAULT_MAX_SIZE_RATIO) if max_size_ratio is None else max_size_ratio
+    results = [r for r in (profile or {}).get("results", [])
+               if encoders is None or r["encoder"] in encoders]
+    baseline = next((r for r in results if (r["encoder"], r["preset"]) == BASELINE), None)
+    eligible = []
+    for r in results:
+        if r["ssim"] is None or r["ssim"] < min_ssim:
+            continue
+        if baseline and max_size_ratio and r["size_bytes"] > baseline["size_bytes"] * max_size_ratio:
+            continue
+        eligible.append(r)
+    if not eligible:
+        return BASELINE
+    best = max(eligible, key=lambda r: r["fps"])
+    return best["encoder"], best["preset"]
+
+
+def resolve_encoder_setting(encoders, calibrate_if_missing=True, progress_callback=None, path=PROFILE_PATH):
+    """Encoder/preset cho encoder "auto" trên máy này; hiệu chỉnh lần đầu nếu chưa có profile."""
+    profile = load_profile(path)
+    if profile is None and calibrate_if_missing:
+        profile = calibrate_encoders(encoders, path=path, progress_callback=progress_callback)
+    return choose_encoder_setting(profile, encoders)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Hiệu chỉnh encoder/preset cho máy này")
+    parser.add_argument("--encoders", default="libx264",
+                        help="Danh sách encoder, phân tách bằng dấu phẩy (mặc định: libx264)")
+    parser.add_argument("--seconds", type=float, default=CALIBRATION_SECONDS)
+    args = parser.parse_args(argv)
+    encoders = [e.strip() for e in args.encoders.split(",") if e.strip()]
+    profile = calibrate_encoders(encoders, seconds=args.seconds)
+    encoder, preset = choose_encoder_setting(profile, encoders)
+    print(f"✅ Đã lưu profile: {PROFILE_PATH}\n   Chọn: {encoder} {preset or ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
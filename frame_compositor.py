@@ -0,0 +1,110 @@
+"""Ghép khung hình bằng Python cho engine "compositor" (một ffmpeg thường trú mỗi worker).
+
+Thay vì mỗi câu một lần khởi động ffmpeg (dựng filter graph, dò input, khởi tạo encoder), mỗi worker
+giữ một ffmpeg duy nhất nhận frame RGB24 đã ghép sẵn (nền/Ken Burns + phụ đề) qua stdin và PCM qua pipe riêng.
+Ranh giới clip là keyframe ép buộc + muxer segment nên mỗi câu vẫn ra một file clip riêng như engine cũ.
+
+Module này chỉ phụ thuộc Pillow (như ken_burns): ảnh tĩnh được ghép một lần rồi lặp lại cùng một bytes
+cho mọi frame của clip; ảnh có chuyển động dùng lại khung cắt của ken_burns.
+"""
+import io
+import wave
+from PIL import Image
+
+from ken_burns import MOTION_EFFECTS, prepare_source, crop_rects
+
+PCM_SAMPLE_WIDTH = 2        # s16le
+DEFAULT_PCM_RATE = 24000    # tần số mặc định của Voicevox
+DEFAULT_PCM_CHANNELS = 1
+KEYFRAME_EPSILON = 0.25     # lùi mốc cắt 1/4 frame để làm tròn số thực không đẩy keyframe sang frame sau
+
+
+def clip_frame_count(duration, fps):
+    return max(1, int(round(duration * fps)))
+
+
+def load_background(path, effect, width, height):
+    """("motion", ảnh nguồn đã scale sẵn) nếu có hiệu ứng chuyển động và ảnh lớn hơn khung hình,
+    ngược lại ("still", ảnh width x height đã cắt giữa) — cùng điều kiện với engine ffmpeg."""
+    with Image.open(path) as img:
+        src_w, src_h = img.size
+    if effect in MOTION_EFFECTS and src_w > width and src_h > height:
+        return "motion", prepare_source(path, width, height)
+    return "still", prepare_source(path, width, height, oversample=1.0)
+
+
+def subtitle_position(subtitle, width, height, margin):
+    return (width - subtitle.size[0]) // 2, height - subtitle.size[1] - margin
+
+
+def clip_frames(background, effect, width, height, num_frames, duration, subtitle=None, margin=0):
+    """Generator bytes RGB24 của từng frame. Nền tĩnh: ghép một lần, trả về cùng một bytes num_frames lần."""
+    kind, src = background
+    position = subtitle_position(subtitle, width, height, margin) if subtitle is not None else None
+    if kind == "still":
+        frame = src.copy()
+        if subtitle is not None:
+            frame.paste(subtitle, position, subtitle)
+        data = frame.tobytes()
+        for _ in range(num_frames):
+            yield data
+        return
+    for rect in crop_rects(effect, src.size, (width, height), num_frames, duration):
+        frame = src.resize((width, height), Image.BILINEAR, box=rect)
+        if subtitle is not None:
+            frame.paste(subtitle, position, subtitle)
+        yield frame.tobytes()
+
+
+def subtitle_image(raw):
+    """(rộng, cao, bytes RGBA) từ process pool phụ đề -> ảnh RGBA dùng làm mask khi paste."""
+    sub_w, sub_h, data = raw
+    return Image.frombytes("RGBA", (sub_w, sub_h), data)
+
+
+def wav_format(data):
+    """(tần số, số kênh) nếu data là WAV PCM 16 bit, ngược lại None."""
+    try:
+        with wave.open(io.BytesIO(data), "rb") as w:
+            if w.getsampwidth() == PCM_SAMPLE_WIDTH:
+                return w.getframerate(), w.getnchannels()
+    except (wave.Error, EOFError):
+        pass
+    return None
+
+
+def wav_pcm(data):
+    with wave.open(io.BytesIO(data), "rb") as w:
+        return w.readframes(w.getnframes())
+
+
+def fit_pcm(pcm, num_frames, fps, rate, channels):
+    """Cắt/đệm im lặng để audio của clip dài đúng num_frames / fps (audio và video không lệch dần qua các clip)."""
+    frame_bytes = PCM_SAMPLE_WIDTH * channels
+    target = int(round(num_frames * rate / fps)) * frame_bytes
+    if len(pcm) >= target:
+        return pcm[:target]
+    return pcm + b"\x00" * (target - len(pcm))
+
+
+def segment_times(frame_counts, fps):
+    """Mốc (giây) bắt đầu của từng clip sau clip đầu, dùng cho -force_key_frames và -segment_times."""
+    times = []
+    total = 0
+    for count in frame_counts[:-1]:
+        total += count
+        times.append(f"{(total - KEYFRAME_EPSILON) / fps:.4f}")
+    return ",".join(times)
+
+
+def assign_to_workers(items, workers, weight):
+    """Chia items cho tối đa `workers` worker, cân bằng tổng weight (dài nhất trước, vào worker nhẹ nhất).
+    Mỗi worker giữ thứ tự ban đầu của items."""
+    buckets = [[] for _ in range(max(1, min(workers, len(items))))]
+    loads = [0.0] * len(buckets)
+    order = {item: i for i, item in enumerate(items)}
+    for item in sorted(items, key=weight, reverse=True):
+        k = loads.index(min(loads))
+        buckets[k].append(item)
+        loads[k] += weight(item)
+    return [sorted(bucket, key=order.get) for bucket in buckets if bucket]
@@ -0,0 +1,75 @@
+"""Hiệu ứng chuyển động (Ken Burns) cho ảnh tĩnh, thay cho zoompan của ffmpeg.
+
+Ảnh được scale sẵn một lần về khung hình đầu ra nhân hệ số oversample có giới hạn,
+khung cắt của từng frame được tính trước (có easing, không trôi ra ngoài ảnh),
+rồi mỗi frame chỉ là một lần resize(box=...) của Pillow -> bytes RGB24 đưa vào ffmpeg qua pipe.
+"""
+import math
+from PIL import Image
+
+MOTION_EFFECTS = ("zoom", "pan", "zoom+pan")
+KB_OVERSAMPLE = 1.5
+ZOOM_PER_SECOND = 0.0175   # tương đương zoom+0.0007 mỗi frame ở 25 fps của zoompan cũ
+MAX_ZOOM = 1.3
+PAN_ZOOM = 1.15
+PAN_PX_PER_SECOND = 25.0   # tốc độ pan (pixel đầu ra ở 720p mỗi giây)
+
+
+def ease_in_out(t):
+    t = min(max(t, 0.0), 1.0)
+    return t * t * (3 - 2 * t)
+
+
+def prepare_source(path, width, height, oversample=KB_OVERSAMPLE):
+    """Cắt ảnh theo tỉ lệ khung hình đầu ra và scale một lần về tối đa width*oversample x height*oversample."""
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+        src_w, src_h = img.size
+        factor = min(oversample, max(src_w / width, src_h / height, 1.0))
+        target_w = max(width, int(math.ceil(width * factor)))
+        target_h = max(height, int(math.ceil(height * factor)))
+        # Cắt giữa theo tỉ lệ đích (giống scale=...:force_original_aspect_ratio=increase,crop)
+        cover = max(target_w / src_w, target_h / src_h)
+        box_w, box_h = target_w / cover, target_h / cover
+        left, top = (src_w - box_w) / 2, (src_h - box_h) / 2
+        return img.resize((target_w, target_h), Image.LANCZOS, box=(left, top, left + box_w, top + box_h))
+
+
+def crop_rects(effect, src_size, out_size, num_frames, duration):
+    """Danh sách khung cắt (x0, y0, x1, y1) trong tọa độ ảnh nguồn cho từng frame."""
+    src_w, src_h = src_size
+    out_w, out_h = out_size
+    zoom_end = min(1.0 + ZOOM_PER_SECOND * duration, MAX_ZOOM)
+    rects = []
+    for i in range(num_frames):
+        t = ease_in_out(i / (num_frames - 1)) if num_frames > 1 else 0.0
+        if effect == "zoom":
+            z = 1.0 + (zoom_end - 1.0) * t
+            ux = uy = 0.5
+        elif effect == "pan":
+            z = PAN_ZOOM
+            view_w = src_w / z
+            slack_x = src_w - view_w
+            # Quãng đi bị chặn trong phần dư của ảnh: không bao giờ trôi ra ngoài dù clip dài
+            travel = PAN_PX_PER_SECOND * (out_h / 720.0) * duration * view_w / out_w
+            r = min(1.0, travel / slack_x) if slack_x > 0 else 0.0
+            ux = uy = (1.0 - r) / 2 + r * t
+        elif effect == "zoom+pan":
+            z = 1.0 + (zoom_end - 1.0) * t
+            ux = uy = 0.5 + 0.3 * t
+        else:
+            z = 1.0
+            ux = uy = 0.5
+        view_w, view_h = src_w / z, src_h / z
+        x0 = (src_w - view_w) * ux
+        y0 = (src_h - view_h) * uy
+        rects.append((x0, y0, x0 + view_w, y0 + view_h))
+    return rects
+
+
+def ken_burns_frames(path, effect, width, height, num_frames, duration, oversample=KB_OVERSAMPLE):
+    """Generator trả về từng frame RGB24 (bytes) kích thước width x height.
+    Chạy lười: ảnh chỉ được mở khi frame đầu tiên được lấy (trong thread ghi pipe)."""
+    src = prepare_source(path, width, height, oversample)
+    for rect in crop_rects(effect, src.size, (width, height), num_frames, duration):
+        yield src.resize((width, height), Image.BILINEAR, box=rect).tobytes()
@@ -0,0 +1,218 @@
+"""Giới hạn bộ nhớ cho các ffmpeg chạy song song (admission control).
+
+Mỗi clip ước lượng trước lượng RAM cần (theo độ phân giải nguồn/đầu ra, hiệu ứng, overlay),
+trong lúc chạy thì đo RSS thật của process ffmpeg; clip mới chỉ được khởi chạy khi
+tổng (max(ước lượng, RSS thật)) của các clip đang chạy + ước lượng mới còn nằm trong ngân sách.
+Luôn cho phép ít nhất một clip chạy để không bao giờ treo.
+
+Ngân sách đọc từ biến môi trường RENDER_MEMORY_BUDGET_MB; mặc định 70% RAM còn trống lúc bắt đầu.
+psutil là tùy chọn: không có thì đọc /proc (Linux); trên Windows không có psutil thì chỉ dùng ước lượng.
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+
+MB = 1024 * 1024
+DEFAULT_BUDGET_FRACTION = 0.7
+FFMPEG_BASE_BYTES = 60 * MB
+POLL_INTERVAL = 0.25
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def available_memory_bytes():
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def process_rss_bytes(pid):
+    """RSS hiện tại của process (bytes) hoặc None nếu không đo được / process đã thoát."""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return None
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def estimate_clip_memory(width, height, src_size=None, motion=False, overlay=False,
+                         video_input=False, renditions=None, threads=None):
+    """Ước lượng RAM (bytes) cho một lần ffmpeg render clip.
+    Hệ số lấy từ đo thực tế libx264 (-preset fast): 720p ~330 MB với 4 thread, ~510 MB với 16 thread."""
+    threads = threads or os.cpu_count() or 1
+    out_px = width * height
+    src_w, src_h = src_size or (width, height)
+    src_px = src_w * src_h
+    total = FFMPEG_BASE_BYTES
+    # Giải mã nguồn + format=rgba (4 byte/pixel), vài frame trong hàng đợi filter
+    total += src_px * 4 * (6 if video_input else 2)
+    # Khung hình ghép RGBA + mỗi rendition một nhánh scale/crop
+    total += out_px * 4 * (4 + 2 * len(renditions or []))
+    # Bộ mã hóa: lookahead / reference frames (YUV420) + buffer riêng của mỗi thread
+    total += int(out_px * 1.5 * (120 + 12 * threads)) * max(1, len(renditions or []))
+    if overlay:
+        # MOV có alpha được giải mã song song ở độ phân giải đầy đủ
+        total += out_px * 4 * 16
+    if motion:
+        # Ảnh nguồn đã scale sẵn (oversample 1.5) + frame RGB trong pipe, nằm ở process Python
+        total += int(out_px * 2.25 * 3) + out_px * 3 * 4
+    return total
+
+
+class MemorySlot:
+    def __init__(self, estimate):
+        self.estimate = estimate
+        self.pids = []
+
+    def attach(self, proc):
+        """Gắn process ffmpeg vào slot để đo RSS thật (dùng làm on_spawn cho run_ffmpeg)."""
+        self.pids.append(proc.pid)
+
+    def usage(self):
+        rss = 0
+        for pid in self.pids:
+            rss += process_rss_bytes(pid) or 0
+        return max(self.estimate, rss)
+
+
+class PeakTracker:
+    """Đỉnh RAM (ước lượng/RSS của các ffmpeg) trong khoảng thời gian một lần render đang theo dõi."""
+    def __init__(self):
+        self.peak = 0
+
+
+class MemoryBudget:
+    def __init__(self, budget_bytes, poll_interval=POLL_INTERVAL):
+        self.budget_bytes = budget_bytes
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._running = set()
+        self._waiting = deque()
+        self._trackers = set()
+        self.peak_usage = 0
+        self.throttled_seconds = 0.0
+
+    def track_peak(self):
+        tracker = PeakTracker()
+        with self._lock:
+            self._trackers.add(tracker)
+        return tracker
+
+    def untrack(self, tracker):
+        with self._lock:
+            self._trackers.discard(tracker)
+
+    def _update_peak(self, usage):
+        with self._lock:
+            self.peak_usage = max(self.peak_usage, usage)
+            for tracker in self._trackers:
+                tracker.peak = max(tracker.peak, usage)
+
+    def usage(self):
+        with self._lock:
+            running = list(self._running)
+        return sum(slot.usage() for slot in running)
+
+    def _try_admit(self, slot):
+        with self._lock:
+            # FIFO: clip lớn đang chờ không bị các clip nhỏ chen lên trước mãi
+            if not self._waiting or self._waiting[0] is not slot:
+                return False
+            running = list(self._running)
+        usage = sum(s.usage() for s in running)
+        if running and usage + slot.estimate > self.budget_bytes:
+            return False
+        with self._lock:
+            self._waiting.popleft()
+            self._running.add(slot)
+        self._update_peak(usage + slot.estimate)
+        return True
+
+    async def acquire(self, estimate):
+        slot = MemorySlot(estimate)
+        if self.budget_bytes is None:
+            # Không giới hạn: vẫn theo dõi clip đang chạy để đo đỉnh RAM
+            usage = self.usage()
+            with self._lock:
+                self._running.add(slot)
+            self._update_peak(usage + estimate)
+            return slot
+        with self._lock:
+            self._waiting.append(slot)
+        started = time.monotonic()
+        warned = False
+        try:
+            while not self._try_admit(slot):
+                if not warned:
+                    print(f"[DEBUG] Chờ RAM: cần ~{estimate // MB} MB, đang dùng ~{self.usage() // MB}"
+                          f"/{self.budget_bytes // MB} MB")
+                    warned = True
+                await asyncio.sleep(self.poll_interval)
+        except BaseException:
+            with self._lock:
+                if slot in self._waiting:
+                    self._waiting.remove(slot)
+            raise
+        if warned:
+            self.throttled_seconds += time.monotonic() - started
+        return slot
+
+    def release(self, slot):
+        with self._lock:
+            self._running.discard(slot)
+
+
+_default_budget = None
+_default_budget_lock = threading.Lock()
+
+
+def _budget_from_env():
+    value = os.environ.get("RENDER_MEMORY_BUDGET_MB")
+    if value:
+        try:
+            mb = float(value)
+            return int(mb * MB) if mb > 0 else None
+        except ValueError:
+            print(f"[⚠️] RENDER_MEMORY_BUDGET_MB không hợp lệ: {value}")
+    available = available_memory_bytes()
+    if available is None:
+        return None
+    return int(available * DEFAULT_BUDGET_FRACTION)
+
+
+def get_memory_budget():
+    """Ngân sách dùng chung cho cả process (tạo lần đầu khi render)."""
+    global _default_budget
+    with _default_budget_lock:
+        if _default_budget is None:
+            _default_budget = MemoryBudget(_budget_from_env())
+        return _default_budget
+
+
+def set_memory_budget(budget_mb=None):
+    """Đặt lại ngân sách (MB); None = đọc lại từ môi trường / RAM còn trống."""
+    global _default_budget
+    with _default_budget_lock:
+        budget = int(budget_mb * MB) if budget_mb else _budget_from_env()
+        _default_budget = MemoryBudget(budget)
+        return _default_budget
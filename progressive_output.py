@@ -0,0 +1,186 @@
+"""Xuất video dần dần theo thứ tự câu: mỗi clip xong sẽ được remux (-c copy) thành
+segment MPEG-TS và nối vào file .ts đang lớn dần ngay khi mọi clip phía trước đã xong.
+Song song đó cập nhật playlist HLS (EVENT) để có thể mở xem trong lúc đang render.
+
+Bước cuối chỉ là một lần remux .ts -> .mp4 (hoặc giữ nguyên nếu đầu ra là .ts),
+thay cho hai lần concat shard + concat cuối cùng.
+"""
+import os
+import sys
+import asyncio
+import shutil
+import subprocess
+
+from video_worker import (
+    get_ffmpeg_path, get_audio_duration, normalize_path_for_ffmpeg,
+    run_ffmpeg_blocking, run_cancellable
+)
+
+
+def _startupinfo():
+    si = None
+    if sys.platform == "win32":
+        si = subprocess.STARTUPINFO()
+        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        si.wShowWindow = subprocess.SW_HIDE
+    return si
+
+
+class ProgressiveOutput:
+    def __init__(self, final_output, clip_order, segment_dir=None, cancel_token=None):
+        """clip_order: số clip (0..n-1) hoặc danh sách chỉ số câu theo thứ tự xuất.
+        cancel_token: hủy thì dừng remux đang chạy (xem discard() để xóa file dở dang)."""
+        self.final_output = final_output
+        self.cancel_token = cancel_token
+        if isinstance(clip_order, int):
+            clip_order = range(clip_order)
+        self.clip_order = list(clip_order)
+        self.total_clips = len(self.clip_order)
+        base, _ = os.path.splitext(final_output)
+        self.stream_path = base + ".part.ts"
+        self.playlist_path = base + ".m3u8"
+        self.segment_dir = segment_dir or (base + "_segments")
+        os.makedirs(self.segment_dir, exist_ok=True)
+
+        self._ready = {}
+        self._next_start = 0     # vị trí (theo clip_order) tiếp theo cần biết offset để bắt đầu remux
+        self._offset = 0.0       # tổng độ dài các clip trước _next_start = -output_ts_offset của nó
+        self._remuxed = {}       # vị trí -> (tên segment, độ dài) hoặc None nếu bỏ qua/lỗi
+        self._next_pos = 0       # vị trí tiếp theo cần nối vào .part.ts
+        self._segments = []
+        self._lock = asyncio.Lock()
+        self._tasks = []
+        self.appended_clips = 0
+        self._finalizing = False
+
+        # Xóa file cũ của lần render trước
+        for p in (self.stream_path, self.playlist_path):
+            if os.path.exists(p):
+                os.remove(p)
+        self._write_playlist(ended=False)
+
+    async def add(self, index, clip_path):
+        """Báo clip thứ index đã xong (clip_path=None nếu câu đó bị bỏ qua).
+
+        Remux sang TS cần offset = tổng độ dài các clip phía trước, nên clip được remux ngay khi mọi clip
+        phía trước đã xong (chưa cần remux xong); nhiều clip remux song song, khóa chỉ giữ lúc nối
+        segment vào .part.ts/playlist theo đúng thứ tự."""
+        duration = None
+        if clip_path and os.path.exists(clip_path):
+            duration = await asyncio.to_thread(get_audio_duration, clip_path)
+        self._ready[index] = (clip_path, duration)
+        started = []
+        # Không có await trong vòng lặp: cập nhật _next_start/_offset là nguyên tử trên event loop
+        while self._next_start < self.total_clips and self.clip_order[self._next_start] in self._ready:
+            pos = self._next_start
+            clip_index = self.clip_order[pos]
+            path, clip_duration = self._ready.pop(clip_index)
+            if clip_duration is None:
+                self._remuxed[pos] = None
+            else:
+                started.append(asyncio.ensure_future(self._remux(pos, clip_index, path, self._offset, clip_duration)))
+                self._offset += clip_duration
+            self._next_start += 1
+        self._tasks.extend(started)
+        if started:
+            await asyncio.gather(*started)
+        else:
+            await self._append_ready()
+
+    async def _remux(self, pos, index, clip_path, offset, duration):
+        segment_name = await run_cancellable(self._remux_clip, index, clip_path, offset,
+                                             cancel_token=self.cancel_token)
+        self._remuxed[pos] = (segment_name, duration) if segment_name else None
+        await self._append_ready()
+
+    def _remux_clip(self, index, clip_path, offset, cancel_token=None):
+        segment_name = f"seg_{index:05d}.ts"
+        segment_path = os.path.join(self.segment_dir, segment_name)
+        cmd = [
+            get_ffmpeg_path(), '-y', '-i', normalize_path_for_ffmpeg(clip_path),
+            '-c', 'copy', '-bsf:v', 'h264_mp4toannexb',
+            '-output_ts_offset', f"{offset:.3f}", '-muxdelay', '0',
+            '-f', 'mpegts', normalize_path_for_ffmpeg(segment_path)
+        ]
+        try:
+            run_ffmpeg_blocking(cmd, _startupinfo(), cancel_token=cancel_token)
+        except subprocess.CalledProcessError as e:
+            print(f"❌ FFmpeg error remuxing clip {index} to TS:\nSTDERR:\n{e.stderr}")
+            return None
+        return segment_name
+
+    async def _append_ready(self):
+        """Nối các segment đã remux xong vào .part.ts theo thứ tự (giữ khóa chỉ trong lúc nối)."""
+        async with self._lock:
+            while self._next_pos < self.total_clips and self._next_pos in self._remuxed:
+                segment = self._remuxed.pop(self._next_pos)
+                if segment is not None:
+                    await asyncio.to_thread(self._append_segment, *segment)
+                self._next_pos += 1
+
+    def _append_segment(self, segment_name, duration):
+        # MPEG-TS nối được bằng cách ghép byte liên tiếp
+        with open(os.path.join(self.segment_dir, segment_name), "rb") as src, open(self.stream_path, "ab") as dst:
+            while True:
+                chunk = src.read(1024 * 1024)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        self._segments.append((segment_name, duration))
+        self.appended_clips += 1
+        self._write_playlist(ended=False)
+
+    def _write_playlist(self, ended):
+        target = max([int(d) + 1 for _, d in self._segments] or [1])
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{target}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        rel_dir = os.path.relpath(self.segment_dir, os.path.dirname(self.playlist_path) or ".")
+        for name, duration in self._segments:
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(f"{rel_dir}/{name}".replace(os.sep, "/"))
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        tmp_path = self.playlist_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.playlist_path)
+
+    async def finalize(self):
+        """Đóng playlist và remux file .ts thành file đầu ra cuối cùng. Trả về đường dẫn đầu ra."""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        async with self._lock:
+            if self._ready:
+                print(f"[⚠️] Còn {len(self._ready)} clip chưa nối được do thiếu clip phía trước.")
+            self._write_playlist(ended=True)
+            if not os.path.exists(self.stream_path):
+                return None
+            if self.final_output.lower().endswith(".ts"):
+                os.replace(self.stream_path, self.final_output)
+                return self.final_output
+            cmd = [
+                get_ffmpeg_path(), '-y', '-i', normalize_path_for_ffmpeg(self.stream_path),
+                '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-movflags', '+faststart',
+                normalize_path_for_ffmpeg(self.final_output)
+            ]
+            self._finalizing = True
+            await run_cancellable(run_ffmpeg_blocking, cmd, _startupinfo(), cancel_token=self.cancel_token)
+            self._finalizing = False
+            return self.final_output
+
+    def discard(self):
+        """Xóa file .part.ts, playlist, segment và đầu ra dở dang (khi render bị hủy)."""
+        paths = [self.stream_path, self.playlist_path]
+        if self._finalizing:
+            paths.append(self.final_output)
+        for p in paths:
+            try:
+                if os.path.exists(p):
+                    os.remove(p)
+            except OSError:
+                pass
+        shutil.rmtree(self.segment_dir, ignore_errors=True)
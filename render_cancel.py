@@ -0,0 +1,135 @@
+"""Hủy render: CancelToken giữ danh sách process ffmpeg đang chạy và giết cả nhóm process
+(process group trên POSIX, cây process trên Windows) ngay khi cancel() được gọi.
+
+Token có thể tạo token con (child) cho từng lệnh: hủy token cha sẽ hủy mọi token con,
+còn hủy token con (ví dụ khi một asyncio task bị cancel) chỉ giết process của lệnh đó.
+"""
+import os
+import sys
+import signal
+import asyncio
+import threading
+import subprocess
+
+
+class RenderCancelled(Exception):
+    """Render bị hủy bởi CancelToken.cancel()."""
+
+
+def process_group_kwargs():
+    """Tham số Popen để ffmpeg chạy trong nhóm process riêng (giết được cả nhóm)."""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def kill_process_tree(proc):
+    if proc.poll() is not None:
+        return
+    try:
+        if sys.platform == "win32":
+            si = subprocess.STARTUPINFO()
+            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            si.wShowWindow = subprocess.SW_HIDE
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                           capture_output=True, startupinfo=si)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except (OSError, subprocess.SubprocessError):
+        pass
+    try:
+        proc.kill()
+    except OSError:
+        pass
+
+
+class CancelToken:
+    def __init__(self, parent=None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._procs = set()
+        self._children = set()
+        self._callbacks = []
+        self._parent = parent
+        if parent is not None:
+            parent._add_child(self)
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RenderCancelled()
+
+    def child(self):
+        return CancelToken(parent=self)
+
+    def close(self):
+        """Tách token con khỏi token cha khi lệnh đã xong."""
+        if self._parent is not None:
+            with self._parent._lock:
+                self._parent._children.discard(self)
+            self._parent = None
+
+    def _add_child(self, child):
+        with self._lock:
+            if not self._event.is_set():
+                self._children.add(child)
+                return
+        child.cancel()
+
+    def register(self, proc):
+        """Theo dõi process; nếu token đã bị hủy thì giết ngay và trả về False."""
+        with self._lock:
+            if not self._event.is_set():
+                self._procs.add(proc)
+                return True
+        kill_process_tree(proc)
+        return False
+
+    def unregister(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def add_callback(self, fn):
+        """fn() được gọi (từ thread gọi cancel) khi token bị hủy; gọi ngay nếu đã hủy rồi."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn()
+
+    def bind_current_task(self):
+        """Hủy asyncio task hiện tại (an toàn từ thread khác, ví dụ nút Hủy trên GUI)."""
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+
+        def _cancel_task():
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                pass  # event loop đã đóng
+
+        self.add_callback(_cancel_task)
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            procs = list(self._procs)
+            children = list(self._children)
+            callbacks = list(self._callbacks)
+            self._procs.clear()
+            self._children.clear()
+            self._callbacks.clear()
+        for proc in procs:
+            kill_process_tree(proc)
+        for child in children:
+            child.cancel()
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as e:
+                print(f"[⚠️] Lỗi khi hủy render: {e}")
@@ -0,0 +1,260 @@
+"""Lịch sử render trên máy này (SQLite) làm dữ liệu cho dự toán (render_planner).
+
+Mỗi lần render ghi một dòng vào runs (thời gian thực, CPU-giây, đỉnh RAM, dung lượng clip tạm, số giây video)
+cùng tổng thời gian từng giai đoạn (tts, subtitle, memory_wait, encode, concat) và độ dài TTS của từng câu
+(để lần sau dự toán được đúng độ dài mà không phải gọi TTS).
+
+CPU-giây (os.times) và đỉnh RAM (ngân sách bộ nhớ) là số liệu của cả process/máy, nên lần render chạy chồng
+thời gian với lần khác (render_server chạy song song, GUI + server cùng lúc) bị đánh dấu overlapped
+và không dùng cho dự toán.
+
+File mặc định: ~/.auto_video_app_history.sqlite (đổi bằng biến môi trường RENDER_HISTORY_DB).
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from memory_budget import get_memory_budget, process_rss_bytes
+
+HISTORY_PATH = os.environ.get("RENDER_HISTORY_DB") or os.path.expanduser("~/.auto_video_app_history.sqlite")
+STAGES = ("tts", "subtitle", "memory_wait", "encode", "concat")
+# Cột thêm sau lần tạo schema đầu tiên: file lịch sử cũ được ALTER TABLE khi mở
+_ADDED_COLUMNS = {
+    "overlapped": "INTEGER NOT NULL DEFAULT 0",
+    "cached_clips": "INTEGER NOT NULL DEFAULT 0",
+    "cached_seconds": "REAL NOT NULL DEFAULT 0",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    machine TEXT NOT NULL,
+    settings_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    workers INTEGER,
+    clips INTEGER,
+    video_seconds REAL,
+    wall_seconds REAL,
+    cpu_seconds REAL,
+    peak_memory_bytes INTEGER,
+    scratch_bytes INTEGER,
+    overlapped INTEGER NOT NULL DEFAULT 0,
+    cached_clips INTEGER NOT NULL DEFAULT 0,
+    cached_seconds REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_lookup ON runs (machine, settings_key, status, created);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tts_durations (
+    voice_source TEXT NOT NULL,
+    voice TEXT NOT NULL,
+    voice_speed REAL NOT NULL,
+    sentence TEXT NOT NULL,
+    duration REAL NOT NULL,
+    PRIMARY KEY (voice_source, voice, voice_speed, sentence)
+);
+"""
+
+
+def settings_key(width=1280, height=720, fps=25, encoder="libx264", preset="fast", effect="none",
+                 is_video_input=False, overlay_effect="none", renditions=None, use_pipes=False, engine="ffmpeg"):
+    """Khóa cấu hình: các lần render cùng khóa có tốc độ tương đương nhau trên cùng một máy."""
+    if is_video_input:
+        kind = "video"
+    elif effect in ("zoom", "pan", "zoom+pan"):
+        kind = "motion"
+    else:
+        kind = "still"
+    key = {
+        "size": f"{width}x{height}", "fps": fps, "encoder": encoder,
+        "preset": None if encoder in ("h264_nvenc", "h264_amf", "h264_qsv") else preset,
+        "input": kind, "overlay": bool(overlay_effect and overlay_effect != "none"),
+        "renditions": len(renditions or []), "pipes": bool(use_pipes),
+    }
+    if engine and engine != "ffmpeg" and kind != "video":
+        # Chỉ thêm khi khác mặc định để lịch sử cũ (engine ffmpeg) vẫn khớp khóa
+        key["engine"] = engine
+    return json.dumps(key, sort_keys=True)
+
+
+def _cpu_seconds():
+    # Gồm cả process con đã kết thúc (ffmpeg); Windows không có số liệu của process con
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class RunHistory:
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+            for name, decl in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE runs ADD COLUMN {name} {decl}")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def record_run(self, machine, key, status, summary, stages, durations, started_at=None):
+        """Ghi một lần render. started_at (time.time() lúc bắt đầu): mọi lần render khác trên máy này kết thúc
+        sau thời điểm đó đã chạy chồng với lần này, cả hai cùng bị đánh dấu overlapped."""
+        with self._lock, self._connect() as conn:
+            overlapped = False
+            if started_at is not None:
+                overlapped = conn.execute(
+                    "UPDATE runs SET overlapped = 1 WHERE machine = ? AND created > ?", (machine, started_at)
+                ).rowcount > 0
+            cur = conn.execute(
+                "INSERT INTO runs (created, machine, settings_key, status, workers, clips, video_seconds,"
+                " wall_seconds, cpu_seconds, peak_memory_bytes, scratch_bytes, overlapped, cached_clips, cached_seconds)"
+                " VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (time.time(), machine, key, status, summary["workers"], summary["clips"], summary["video_seconds"],
+                 summary["wall_seconds"], summary["cpu_seconds"], summary["peak_memory_bytes"],
+                 summary["scratch_bytes"], int(overlapped), summary["cached_clips"], summary["cached_seconds"])
+            )
+            conn.executemany(
+                "INSERT INTO stages (run_id, stage, count, seconds) VALUES (?,?,?,?)",
+                [(cur.lastrowid, stage, count, seconds) for stage, (count, seconds) in stages.items()]
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO tts_durations VALUES (?,?,?,?,?)",
+                [(src, str(voice), float(speed or 1.0), sentence, d)
+                 for (src, voice, speed, sentence), d in durations.items()]
+            )
+            return cur.lastrowid
+
+    def recent_runs(self, machine, key=None, limit=10):
+        """Các lần render thành công gần nhất trên máy này (cùng cấu hình nếu có key), kèm thời gian từng giai đoạn.
+        Bỏ qua lần render chạy chồng với lần khác (số liệu CPU/RAM lẫn của nhau)."""
+        query = "SELECT * FROM runs WHERE machine = ? AND status = 'done' AND video_seconds > 0 AND overlapped = 0"
+        args = [machine]
+        if key is not None:
+            query += " AND settings_key = ?"
+            args.append(key)
+        query += " ORDER BY created DESC LIMIT ?"
+        args.append(limit)
+        with self._lock, self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            runs = [dict(row) for row in conn.execute(query, args)]
+            for run in runs:
+                run["stages"] = {
+                    row["stage"]: (row["count"], row["seconds"])
+                    for row in conn.execute("SELECT stage, count, seconds FROM stages WHERE run_id = ?", (run["id"],))
+                }
+        return runs
+
+    def tts_durations(self, keys):
+        """{(voice_source, voice, voice_speed, câu): giây} cho các câu đã từng đọc."""
+        found = {}
+        with self._lock, self._connect() as conn:
+            for key in keys:
+                src, voice, speed, sentence = key
+                row = conn.execute(
+                    "SELECT duration FROM tts_durations WHERE voice_source = ? AND voice = ? AND voice_speed = ?"
+                    " AND sentence = ?", (src, str(voice), float(speed or 1.0), sentence)
+                ).fetchone()
+                if row:
+                    found[key] = row[0]
+        return found
+
+
+_default_history = None
+_default_history_lock = threading.Lock()
+
+
+def get_run_history():
+    global _default_history
+    with _default_history_lock:
+        if _default_history is None:
+            _default_history = RunHistory()
+        return _default_history
+
+
+class RunRecorder:
+    """Gom số liệu của một lần render; render_shard/render_sentence gọi add_stage/add_clip (thread-safe).
+    Clip lấy từ kho artifact (add_clip(..., cached=True)) đếm riêng: không tính vào clips/video_seconds,
+    để tốc độ theo giây video mà dự toán học được chỉ gồm clip thật sự render."""
+
+    def __init__(self, key, workers=None, history=None, machine=None):
+        self.key = key
+        self.workers = workers or os.cpu_count() or 1
+        self.history = history
+        self.machine = machine
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.durations = {}
+        self.clips = 0
+        self.video_seconds = 0.0
+        self.scratch_bytes = 0
+        self.cached_clips = 0
+        self.cached_seconds = 0.0
+        self._python_rss_peak = 0
+        self._tracker = None
+        self._started = None
+        self._cpu_started = None
+        self.started_at = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self._cpu_started = _cpu_seconds()
+        self._tracker = get_memory_budget().track_peak()
+        self._sample_rss()
+        return self
+
+    def _sample_rss(self):
+        rss = process_rss_bytes(os.getpid()) or 0
+        self._python_rss_peak = max(self._python_rss_peak, rss)
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            count, total = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (count + 1, total + seconds)
+
+    def add_clip(self, duration, nbytes, tts_key=None, cached=False):
+        with self._lock:
+            if cached:
+                self.cached_clips += 1
+                self.cached_seconds += duration
+            else:
+                self.clips += 1
+                self.video_seconds += duration
+            self.scratch_bytes += nbytes
+            if tts_key is not None:
+                self.durations[tts_key] = duration
+        self._sample_rss()
+
+    def finish(self, status="done"):
+        """Chốt số liệu, ghi vào lịch sử (nếu có) và trả về bản tóm tắt."""
+        budget = get_memory_budget()
+        ffmpeg_peak = 0
+        if self._tracker is not None:
+            ffmpeg_peak = self._tracker.peak
+            budget.untrack(self._tracker)
+            self._tracker = None
+        self._sample_rss()
+        summary = {
+            "status": status, "workers": self.workers, "clips": self.clips,
+            "video_seconds": self.video_seconds,
+            "wall_seconds": time.monotonic() - self._started if self._started else 0.0,
+            "cpu_seconds": _cpu_seconds() - self._cpu_started if self._cpu_started is not None else 0.0,
+            "peak_memory_bytes": ffmpeg_peak + self._python_rss_peak,
+            "scratch_bytes": self.scratch_bytes,
+            "cached_clips": self.cached_clips, "cached_seconds": self.cached_seconds,
+        }
+        if self.history is not None and self.machine:
+            try:
+                self.history.record_run(self.machine, self.key, status, summary, dict(self.stages), dict(self.durations),
+                                        started_at=self.started_at)
+            except sqlite3.Error as e:
+                print(f"[⚠️] Không ghi được lịch sử render: {e}")
+        return summary
@@ -0,0 +1,272 @@
+"""Manifest render + sửa video đã xong (splice edit) khi kịch bản thay đổi.
+
+Mỗi lần render xong, <video>.manifest.json ghi lại tham số render_shard (giọng, font, màu, hiệu ứng,
+encoder...) và danh sách clip theo thứ tự trong video (câu, ảnh/video nền, độ dài).
+Mỗi clip được encode riêng nên luôn bắt đầu bằng keyframe, và ghép -c copy giữ nguyên keyframe đó.
+
+Sửa video: so kịch bản mới với danh sách câu trong manifest (difflib), chỉ render các câu mới/đã sửa,
+các đoạn không đổi được lấy thẳng từ video cũ bằng concat demuxer (inpoint/outpoint đúng keyframe, -c copy).
+Đoạn giữ lại giữ nguyên nền cũ; câu mới dùng nền theo vị trí mới của nó trong kịch bản.
+
+Dòng lệnh:
+    python render_manifest.py --video out.mp4 --text script_moi.txt [--output out_moi.mp4]
+"""
+import os
+import re
+import sys
+import json
+import time
+import bisect
+import shutil
+import asyncio
+import difflib
+import tempfile
+
+from video_worker import (
+    render_shard, split_sentences, get_ffmpeg_path, normalize_path_for_ffmpeg, rendition_path,
+    run_ffmpeg, remove_partial_outputs, probe_duration, _sentence_key, _tts_duration_cache
+)
+from scratch_space import ScratchSpace
+
+MANIFEST_VERSION = 1
+# Tham số render_shard được lưu lại để clip render lại trông giống hệt clip cũ
+MANIFEST_OPTIONS = (
+    "voice", "image_or_video_paths", "font_path", "subtitle_color", "stroke_color", "bg_color", "effect",
+    "encoder", "volume_percent", "bg_opacity", "voice_speed", "stroke_width", "video_speed", "is_video_input",
+    "voice_source", "effects_dir", "overlay_effect", "width", "height", "fps", "preset", "renditions",
+    "use_pipes", "engine",
+)
+BOUNDARY_TOLERANCE = 0.5   # giây: keyframe ranh giới clip phải nằm gần vị trí dự kiến theo manifest
+
+_PTS_TIME_RE = re.compile(r"pts_time:\s*([\d.]+)")
+
+
+def manifest_path(video_path):
+    return video_path + ".manifest.json"
+
+
+def discard_manifest(video_path):
+    """Xóa manifest cũ (nếu có) khi không ghi được manifest mới: manifest cũ không còn khớp video."""
+    try:
+        os.remove(manifest_path(video_path))
+    except OSError:
+        pass
+
+
+def _clip_duration(voice_key, sentence, clip_path):
+    """Độ dài clip: từ cache độ dài TTS, không có thì đo file clip. ValueError nếu không biết được."""
+    duration = _tts_duration_cache.get(voice_key + (sentence,))
+    if duration is None and clip_path and os.path.exists(clip_path):
+        duration = probe_duration(clip_path)
+    if duration is None:
+        raise ValueError(f"Không biết độ dài clip của câu: {sentence[:30]}...")
+    return duration
+
+
+def build_manifest(options, clip_records):
+    """options: tham số render_shard; clip_records: [(chỉ số câu, câu, nền, clip), ...] của render_shard.
+    Chỉ các câu có clip mới nằm trong video (câu lỗi bị bỏ qua khi ghép).
+    ValueError nếu không biết độ dài một clip: manifest thiếu độ dài thì không sửa video được."""
+    voice_key = (options.get("voice_source", "Voicevox"), options.get("voice"), options.get("voice_speed", 1.0))
+    clips = []
+    for global_idx, sentence, background, clip_path in clip_records:
+        if clip_path is None:
+            continue
+        sentence = _sentence_key(sentence)
+        clips.append({
+            "index": global_idx, "sentence": sentence, "background": background,
+            "duration": _clip_duration(voice_key, sentence, clip_path),
+        })
+    return {
+        "version": MANIFEST_VERSION,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "options": {k: options[k] for k in MANIFEST_OPTIONS if k in options},
+        "clips": clips,
+    }
+
+
+def write_manifest(video_path, manifest):
+    path = manifest_path(video_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_manifest(video_path):
+    try:
+        with open(manifest_path(video_path), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Không đọc được manifest của {os.path.basename(video_path)}: {e}")
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Manifest không đúng phiên bản: {manifest.get('version')}")
+    return manifest
+
+
+def diff_script(old_sentences, new_sentences):
+    """Opcodes difflib (tag, i1, i2, j1, j2) giữa danh sách câu cũ (trong video) và kịch bản mới."""
+    matcher = difflib.SequenceMatcher(None, [_sentence_key(s) for s in old_sentences],
+                                      [_sentence_key(s) for s in new_sentences], autojunk=False)
+    return matcher.get_opcodes()
+
+
+async def keyframe_times(video_path, cancel_token=None):
+    """Thời điểm (giây) các keyframe video; chỉ giải mã keyframe nên nhanh hơn nhiều so với xem cả video."""
+    cmd = [get_ffmpeg_path(), '-hide_banner', '-skip_frame', 'nokey', '-i', normalize_path_for_ffmpeg(video_path),
+           '-map', '0:v:0', '-vf', 'showinfo', '-f', 'null', '-']
+    result = await run_ffmpeg(cmd, cancel_token=cancel_token)
+    return sorted(float(t) for t in _PTS_TIME_RE.findall(result.stderr))
+
+
+def resolve_clip_starts(keyframes, durations):
+    """Thời điểm bắt đầu của từng clip trong video cũ: keyframe gần vị trí dự kiến nhất (clip trước + độ dài),
+    neo lại ở mỗi ranh giới nên sai số độ dài không cộng dồn. ValueError nếu video không khớp manifest."""
+    if not keyframes:
+        raise ValueError("Video không có keyframe nào.")
+    starts = [keyframes[0]]
+    for i, duration in enumerate(durations[:-1]):
+        if duration is None:
+            raise ValueError(f"Manifest thiếu độ dài clip {i + 1}, hãy render lại video.")
+        expected = starts[-1] + duration
+        lo = bisect.bisect_right(keyframes, starts[-1] + 1e-3)
+        hi = bisect.bisect_left(keyframes, expected, lo)
+        candidates = keyframes[max(lo, hi - 1):hi + 1]
+        best = min(candidates, key=lambda k: abs(k - expected)) if candidates else None
+        if best is None or abs(best - expected) > BOUNDARY_TOLERANCE + 0.1 * duration:
+            raise ValueError(f"Video không khớp manifest ở clip {i + 1} (dự kiến {expected:.2f}s).")
+        starts.append(best)
+    return starts
+
+
+def _write_splice_list(list_path, pieces):
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path, inpoint, outpoint in pieces:
+            f.write(f"file '{normalize_path_for_ffmpeg(path)}'\n")
+            if inpoint is not None:
+                f.write(f"inpoint {inpoint:.6f}\n")
+            if outpoint is not None:
+                f.write(f"outpoint {outpoint:.6f}\n")
+
+
+async def splice_edit(video_path, new_sentences, output_path=None, cancel_token=None, progress_queue=None,
+                      recorder=None, workers=None):
+    """Cập nhật video đã render theo kịch bản mới: chỉ render câu mới/đã sửa, phần còn lại copy từ video cũ.
+    output_path mặc định ghi đè video_path (ghi ra file tạm rồi đổi tên). Trả về dict thống kê."""
+    manifest = load_manifest(video_path)
+    options = dict(manifest["options"])
+    old_clips = manifest["clips"]
+    new_sentences = [_sentence_key(s) for s in new_sentences if _sentence_key(s)]
+    output_path = output_path or video_path
+    renditions = options.get("renditions") or None
+    opcodes = diff_script([c["sentence"] for c in old_clips], new_sentences)
+    changed = [j for tag, _, _, j1, j2 in opcodes if tag in ("replace", "insert") for j in range(j1, j2)]
+    kept = sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == "equal")
+    stats = {"kept": kept, "rendered": len(changed), "removed": len(old_clips) - kept, "output": output_path}
+    if not changed and kept == len(old_clips) and output_path == video_path:
+        print("[DEBUG] Kịch bản không đổi, giữ nguyên video.")
+        return stats
+
+    # Thời điểm bắt đầu clip trong từng file rendition của video cũ (mỗi file encode từ cùng các clip)
+    starts_of = {}
+    for r in renditions or [None]:
+        name = r["name"] if r else None
+        old_file = rendition_path(video_path, name, renditions)
+        if not os.path.exists(old_file):
+            raise ValueError(f"Không tìm thấy video cũ: {old_file}")
+        keyframes = await keyframe_times(old_file, cancel_token)
+        starts_of[name] = resolve_clip_starts(keyframes, [c["duration"] for c in old_clips])
+
+    # Pipe + scratch riêng (như render_server): file tạm của lần sửa không lẫn với lần render khác
+    edit_dir = tempfile.mkdtemp(prefix="auto_video_edit_")
+    scratch = ScratchSpace(disk_dir=edit_dir)
+    tmp_output = output_path + ".edit.tmp" + os.path.splitext(output_path)[1]
+    try:
+        clip_records = []
+        if changed:
+            options.pop("renditions", None)
+            options.pop("use_pipes", None)
+            await render_shard(
+                "edit", [new_sentences[j] for j in changed], options.pop("voice"),
+                options.pop("image_or_video_paths", []), options.pop("font_path"),
+                options.pop("subtitle_color", "#FFFF00"), options.pop("stroke_color", "#000000"),
+                options.pop("bg_color", "#FFFFFF"), options.pop("effect", "none"), None, options.pop("encoder"),
+                progress_queue, global_indices=changed, cancel_token=cancel_token, renditions=renditions,
+                use_pipes=True, scratch=scratch, workers=workers, recorder=recorder, clip_records=clip_records,
+                **options
+            )
+        new_clip_of = {global_idx: (background, clip) for global_idx, _, background, clip in clip_records}
+
+        voice_key = (manifest["options"].get("voice_source", "Voicevox"), manifest["options"].get("voice"),
+                     manifest["options"].get("voice_speed", 1.0))
+        new_manifest = dict(manifest, created=time.strftime("%Y-%m-%d %H:%M:%S"), clips=[])
+        main_starts = starts_of[renditions[0]["name"] if renditions else None]
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal":
+                for i, j in zip(range(i1, i2), range(j1, j2)):
+                    # Độ dài đo theo keyframe của video cũ (chính xác hơn độ dài TTS) cho lần sửa sau
+                    duration = main_starts[i + 1] - main_starts[i] if i + 1 < len(main_starts) else old_clips[i]["duration"]
+                    new_manifest["clips"].append(dict(old_clips[i], index=j, duration=duration))
+            elif tag in ("replace", "insert"):
+                for j in range(j1, j2):
+                    background, clip = new_clip_of.get(j, (None, None))
+                    if clip is None:
+                        print(f"[⚠️] Câu {j + 1} không render được, bỏ khỏi video: {new_sentences[j][:30]}...")
+                        continue
+                    new_manifest["clips"].append({
+                        "index": j, "sentence": new_sentences[j], "background": background,
+                        "duration": _clip_duration(voice_key, new_sentences[j], clip),
+                    })
+        if not new_manifest["clips"]:
+            raise ValueError("Kịch bản mới không còn câu nào render được.")
+
+        for r in renditions or [None]:
+            name = r["name"] if r else None
+            old_file = rendition_path(video_path, name, renditions)
+            starts = starts_of[name]
+            pieces = []
+            for tag, i1, i2, j1, j2 in opcodes:
+                if tag == "equal":
+                    pieces.append((old_file, starts[i1] if i1 > 0 else None, starts[i2] if i2 < len(starts) else None))
+                elif tag in ("replace", "insert"):
+                    for j in range(j1, j2):
+                        clip = new_clip_of.get(j, (None, None))[1]
+                        if clip is not None:
+                            pieces.append((rendition_path(clip, name, renditions), None, None))
+            list_path = os.path.join(edit_dir, f"edit_concat_{name or 'main'}.txt")
+            _write_splice_list(list_path, pieces)
+            cmd = [get_ffmpeg_path(), '-y', '-f', 'concat', '-safe', '0', '-i', normalize_path_for_ffmpeg(list_path),
+                   '-map', '0', '-c', 'copy', normalize_path_for_ffmpeg(rendition_path(tmp_output, name, renditions))]
+            await run_ffmpeg(cmd, cancel_token=cancel_token)
+    except BaseException:
+        remove_partial_outputs(tmp_output, renditions)
+        raise
+    finally:
+        scratch.cleanup()
+        shutil.rmtree(edit_dir, ignore_errors=True)
+    # Chỉ thay file cũ khi mọi rendition đã ghép xong
+    for r in renditions or [None]:
+        name = r["name"] if r else None
+        os.replace(rendition_path(tmp_output, name, renditions), rendition_path(output_path, name, renditions))
+    write_manifest(output_path, new_manifest)
+    print(f"[DEBUG] Sửa video: giữ {kept} clip, render {len(changed)} câu, bỏ {stats['removed']} câu -> {output_path}")
+    return stats
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Sửa video đã render theo kịch bản mới (chỉ render câu thay đổi)")
+    parser.add_argument("--video", required=True, help="Video đã render (có <video>.manifest.json)")
+    parser.add_argument("--text", required=True, help="Kịch bản mới (UTF-8)")
+    parser.add_argument("--output", default=None, help="File đầu ra (mặc định ghi đè --video)")
+    args = parser.parse_args(argv)
+    with open(args.text, "r", encoding="utf-8") as f:
+        sentences = split_sentences(f.read())
+    stats = asyncio.run(splice_edit(args.video, sentences, args.output))
+    print(f"✅ Giữ {stats['kept']} clip, render {stats['rendered']} câu, bỏ {stats['removed']} câu: {stats['output']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""Dự toán render (dry-run): dựng toàn bộ kế hoạch clip mà không chạy TTS/ffmpeg nào,
+rồi ước lượng thời gian thực, CPU-giây, đỉnh RAM và dung lượng đĩa tạm.
+
+Kế hoạch dùng đúng build_clip_specs/find_reused_clips của render_shard (cùng câu, cùng nền, cùng clip dùng lại).
+Độ dài clip lấy theo thứ tự: cache TTS trong phiên -> độ dài đã lưu trong lịch sử -> ước lượng theo số ký tự.
+Số liệu tốc độ lấy từ lịch sử render cùng cấu hình trên máy này (render_history); chưa có lịch sử thì
+ước lượng từ profile encoder (encoder_tuning) và mô hình RAM (memory_budget).
+
+Dòng lệnh (options giống distributed_render):
+    python render_planner.py --text script.txt --options options.json [--json]
+"""
+import os
+import sys
+import json
+import statistics
+
+from PIL import Image
+
+from video_worker import (
+    build_clip_specs, find_reused_clips, split_sentences, parse_renditions, _sentence_key, _tts_duration_cache,
+    CHARS_PER_SECOND, default_engine
+)
+from memory_budget import get_memory_budget, estimate_clip_memory, MB
+from render_history import get_run_history, settings_key
+from encoder_tuning import AUTO_ENCODER, load_profile, machine_fingerprint, resolve_encoder_setting
+
+HISTORY_RUNS = 10
+DEFAULT_ENCODE_FPS_720P = 20.0     # khi chưa hiệu chỉnh encoder: tốc độ libx264 fast trên một máy tầm trung
+TTS_SECONDS_PER_CLIP = 0.6
+MOTION_SECONDS_PER_FRAME = 0.004   # Pillow resize cho Ken Burns ở 720p
+CONCAT_SECONDS_PER_CLIP = 0.05
+PYTHON_BASE_BYTES = 150 * MB
+DEFAULT_BITRATE = 2500000          # bit/s của clip 720p libx264 CRF mặc định
+
+
+def _median(values):
+    values = [v for v in values if v is not None]
+    return statistics.median(values) if values else 0.0
+
+
+def _clip_durations(unique_specs, voice, voice_speed, voice_source, history):
+    """{vị trí clip: (giây, nguồn)} với nguồn là "cache" / "history" / "estimate"."""
+    keys = {i: (voice_source, voice, voice_speed, _sentence_key(spec[1])) for i, spec in unique_specs}
+    stored = {}
+    if history is not None:
+        missing = [k for k in keys.values() if k not in _tts_duration_cache]
+        stored = history.tts_durations(missing) if missing else {}
+    durations = {}
+    for i, key in keys.items():
+        if key in _tts_duration_cache:
+            durations[i] = (_tts_duration_cache[key], "cache")
+        elif key in stored:
+            durations[i] = (stored[key], "history")
+        else:
+            durations[i] = (len(key[3]) / (CHARS_PER_SECOND * (voice_speed or 1.0)), "estimate")
+    return durations
+
+
+def _source_size(path, is_video_input, width, height):
+    if is_video_input:
+        return None
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except OSError:
+        return (width, height)
+
+
+def _estimate_from_history(runs, render_seconds, video_seconds):
+    def per_second(field):
+        return _median([r[field] / r["video_seconds"] for r in runs])
+
+    # Clip lấy từ kho artifact cũng nằm trong thư mục tạm: dung lượng chia cho cả số giây video của chúng
+    clip_bytes_per_second = _median([
+        r["scratch_bytes"] / (r["video_seconds"] + (r.get("cached_seconds") or 0.0)) for r in runs
+    ])
+    stages = {}
+    for stage in {s for r in runs for s in r["stages"]}:
+        stages[stage] = _median([r["stages"].get(stage, (0, 0.0))[1] / r["video_seconds"] for r in runs]) * render_seconds
+    return {
+        "wall_seconds": per_second("wall_seconds") * render_seconds,
+        "cpu_seconds": per_second("cpu_seconds") * render_seconds,
+        "peak_memory_bytes": max(r["peak_memory_bytes"] or 0 for r in runs),
+        # clip tạm còn nằm trên đĩa trong lúc ghép ra file cuối (ghép -c copy: cùng dung lượng)
+        "scratch_bytes": int(clip_bytes_per_second * (render_seconds + video_seconds)),
+        "stages": stages,
+    }
+
+
+def _estimate_heuristic(plan_clips, unique_positions, render_seconds, video_seconds, workers, clip_memory,
+                        width, height, fps, encoder, preset, renditions, motion):
+    encode_fps = DEFAULT_ENCODE_FPS_720P
+    profile = load_profile()
+    for r in (profile or {}).get("results", []):
+        if r["encoder"] == encoder and (r["preset"] == preset or r["preset"] is None):
+            encode_fps = r["fps"]
+    pixel_ratio = (width * height) / (1280 * 720)
+    frames = render_seconds * fps
+    # Profile đo với -threads = số core: một clip chiếm gần hết CPU, nên thời gian encode cộng dồn
+    encode_seconds = frames / max(encode_fps / pixel_ratio, 1e-6) * max(1, len(renditions or []))
+    motion_seconds = frames * MOTION_SECONDS_PER_FRAME * pixel_ratio if motion else 0.0
+    tts_seconds = len(unique_positions) * TTS_SECONDS_PER_CLIP
+    concat_seconds = len(plan_clips) * CONCAT_SECONDS_PER_CLIP
+    cores = os.cpu_count() or 1
+    budget = get_memory_budget().budget_bytes
+    peak = sum(sorted(clip_memory, reverse=True)[:workers])
+    if budget:
+        peak = min(peak, max(budget, max(clip_memory or [0])))
+    bitrate = sum(r.get("bitrate") or DEFAULT_BITRATE for r in renditions) if renditions else DEFAULT_BITRATE * pixel_ratio
+    return {
+        "wall_seconds": encode_seconds + motion_seconds + tts_seconds / max(workers, 1) + concat_seconds,
+        "cpu_seconds": (encode_seconds + motion_seconds) * cores + tts_seconds * 0.1,
+        "peak_memory_bytes": int(peak + PYTHON_BASE_BYTES),
+        "scratch_bytes": int(bitrate / 8 * (render_seconds + video_seconds)),
+        "stages": {"tts": tts_seconds, "encode": encode_seconds + motion_seconds, "concat": concat_seconds},
+    }
+
+
+def plan_render(texts, voice, image_or_video_paths, effect="none", voice_speed=1.0, voice_source="Voicevox",
+                is_video_input=False, overlay_effect="none", width=1280, height=720, fps=25,
+                encoder="libx264", preset="fast", renditions=None, workers=None, use_pipes=False,
+                offset_in_all=0, global_indices=None, history=None, machine=None, engine=None, **render_options):
+    """Kế hoạch + dự toán cho một lần render_shard với cùng tham số (tham số khác của render_shard được bỏ qua).
+    Trả về dict: clips (từng câu), summary, estimate, basis."""
+    history = history if history is not None else get_run_history()
+    machine = machine or machine_fingerprint()
+    workers = workers or os.cpu_count() or 1
+    paths = list(image_or_video_paths) or ["(nền đen)"]
+    specs = build_clip_specs(0, texts, paths, offset_in_all, global_indices)
+    reused_at = find_reused_clips(specs)
+    representative = {j: i for i, dups in reused_at.items() for j in dups}
+    unique_positions = sorted(reused_at)
+    durations = _clip_durations([(i, specs[i]) for i in unique_positions], voice, voice_speed, voice_source, history)
+
+    kind = "video" if is_video_input else effect
+    clips = []
+    for pos, (_, sentence, background, global_idx) in enumerate(specs):
+        rep = representative.get(pos, pos)
+        duration, source = durations[rep]
+        clips.append({
+            "index": global_idx, "sentence": sentence, "background": background,
+            "effect": kind, "overlay": overlay_effect, "duration": round(duration, 3),
+            "duration_source": source,
+            "reuses": specs[rep][3] if rep != pos else None,
+        })
+
+    render_seconds = sum(durations[i][0] for i in unique_positions)
+    video_seconds = sum(c["duration"] for c in clips)
+    sources = [durations[i][1] for i in unique_positions]
+    summary = {
+        "sentences": len(clips), "unique_clips": len(unique_positions),
+        "reused_clips": len(clips) - len(unique_positions),
+        "video_seconds": video_seconds, "render_seconds": render_seconds, "workers": workers,
+        "durations_from": {src: sources.count(src) for src in ("cache", "history", "estimate")},
+    }
+
+    key = settings_key(width, height, fps, encoder, preset, effect, is_video_input, overlay_effect,
+                       renditions, use_pipes, engine or default_engine())
+    runs = history.recent_runs(machine, key, HISTORY_RUNS) if history is not None else []
+    if runs:
+        estimate = _estimate_from_history(runs, render_seconds, video_seconds)
+        basis = f"history:{len(runs)}"
+    else:
+        size_of = {}
+        clip_memory = []
+        for i in unique_positions:
+            background = specs[i][2]
+            if background not in size_of:
+                size_of[background] = _source_size(background, is_video_input, width, height)
+            clip_memory.append(estimate_clip_memory(
+                width, height, src_size=size_of[background], motion=effect in ("zoom", "pan", "zoom+pan"),
+                overlay=bool(overlay_effect and overlay_effect != "none"), video_input=is_video_input,
+                renditions=renditions
+            ))
+        estimate = _estimate_heuristic(
+            clips, unique_positions, render_seconds, video_seconds, workers, clip_memory,
+            width, height, fps, encoder, preset, renditions,
+            motion=not is_video_input and effect in ("zoom", "pan", "zoom+pan")
+        )
+        basis = "heuristic"
+    return {"clips": clips, "summary": summary, "estimate": estimate, "basis": basis, "settings_key": key}
+
+
+def _format_seconds(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def format_plan(plan):
+    summary, est = plan["summary"], plan["estimate"]
+    src = summary["durations_from"]
+    if plan["basis"].startswith("history:"):
+        basis = f"lịch sử {plan['basis'].split(':')[1]} lần render cùng cấu hình trên máy này"
+    else:
+        basis = "ước lượng (chưa có lịch sử cùng cấu hình)"
+    lines = [
+        f"{summary['sentences']} câu, {summary['unique_clips']} clip cần render"
+        f" ({summary['reused_clips']} clip dùng lại), ~{_format_seconds(summary['video_seconds'])} video",
+        f"Thời gian dự kiến: {_format_seconds(est['wall_seconds'])} ({summary['workers']} clip song song)",
+        f"CPU: ~{est['cpu_seconds'] / 3600:.2f} giờ-CPU · RAM đỉnh: ~{est['peak_memory_bytes'] // MB} MB"
+        f" · Đĩa tạm: ~{est['scratch_bytes'] // MB} MB",
+        f"Độ dài TTS: {src['cache']} từ cache, {src['history']} từ lịch sử, {src['estimate']} ước lượng theo số ký tự",
+        f"Cơ sở: {basis}",
+    ]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Dự toán thời gian/tài nguyên render (không render)")
+    parser.add_argument("--text", required=True, help="File văn bản UTF-8")
+    parser.add_argument("--options", required=True, help="File JSON tham số render_shard (như distributed_render)")
+    parser.add_argument("--json", action="store_true", help="In toàn bộ kế hoạch dạng JSON")
+    args = parser.parse_args(argv)
+    with open(args.text, "r", encoding="utf-8") as f:
+        sentences = split_sentences(f.read())
+    with open(args.options, "r", encoding="utf-8") as f:
+        options = json.load(f)
+    if isinstance(options.get("renditions"), str):
+        options["renditions"] = parse_renditions(options["renditions"])
+    if options.get("encoder") == AUTO_ENCODER:
+        options["encoder"], preset = resolve_encoder_setting(
+            options.pop("auto_encoders", None) or ["libx264"], calibrate_if_missing=False
+        )
+        if preset:
+            options.setdefault("preset", preset)
+    plan = plan_render(sentences, options.pop("voice"), options.pop("image_or_video_paths", []), **options)
+    if args.json:
+        print(json.dumps(plan, ensure_ascii=False, indent=2))
+    else:
+        print(format_plan(plan))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
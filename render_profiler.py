@@ -0,0 +1,262 @@
+"""Chế độ profiling (tùy chọn) cho một lần render, xuất ra một file báo cáo duy nhất.
+
+Bật bằng biến môi trường RENDER_PROFILE=1 (hoặc RENDER_PROFILE=<thư mục báo cáo>), ô "Profiling" trên GUI
+hoặc cờ --profile của render_server. Khi bật:
+  - Sampling profiler (thread riêng, sys._current_frames mỗi RENDER_PROFILE_INTERVAL_MS, mặc định 5 ms) lấy mẫu
+    mọi thread của process: event loop, thread gọi HTTP Voicevox, thread ghi pipe/Ken Burns...
+  - Phụ đề vẽ trong process pool được chạy dưới cProfile trong process con, số liệu gửi về cùng kết quả.
+  - tracemalloc chụp snapshot ở ranh giới các giai đoạn (plan/clips/concat...) và so sánh với snapshot trước.
+  - Mọi ffmpeg chạy với -benchmark; utime/stime/rtime/maxrss của từng lệnh được gom lại (clip chậm nhất).
+Chỉ một phiên profiling chạy tại một thời điểm (sampler và tracemalloc là toàn cục của process).
+"""
+import os
+import re
+import sys
+import time
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from collections import Counter
+
+PROFILE_ENV = "RENDER_PROFILE"
+DEFAULT_INTERVAL_MS = 5.0
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 10
+TOP_CLIPS = 10
+TRACEMALLOC_FRAMES = 10
+# Lá của stack nằm trong các module này = thread đang chờ (select/queue/lock), không tính là bận
+IDLE_MODULES = ("threading.py", "selectors.py", "queue.py", "thread.py", "subprocess.py")
+IDLE_FUNCTIONS = ("select", "poll", "wait", "_worker", "get", "communicate", "_communicate", "acquire")
+
+_BENCH_RE = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s rtime=([\d.]+)s")
+_MAXRSS_RE = re.compile(r"bench: maxrss=(\d+)KiB")
+
+
+def profiling_requested():
+    value = os.environ.get(PROFILE_ENV, "").strip()
+    return bool(value) and value.lower() not in ("0", "false", "no", "off")
+
+
+def default_report_dir():
+    value = os.environ.get(PROFILE_ENV, "").strip()
+    if value and value.lower() not in ("1", "true", "yes", "on") and not value.isdigit():
+        return value
+    return os.path.join(os.getcwd(), "render_profiles")
+
+
+def _func_label(key):
+    filename, lineno, name = key
+    return f"{name} ({os.path.basename(filename)}:{lineno})"
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name="render-profiler", daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.thread_counts = Counter()
+        self.idle_counts = Counter()
+        self.samples = 0
+        self.overhead = 0
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                name = names.get(thread_id, str(thread_id))
+                code = frame.f_code
+                self.samples += 1
+                self.thread_counts[name] += 1
+                if os.path.basename(code.co_filename) in IDLE_MODULES or code.co_name in IDLE_FUNCTIONS:
+                    self.idle_counts[name] += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                if any(key[0] == __file__ for key in stack):
+                    # snapshot tracemalloc của chính profiler: tách riêng, không lẫn vào top hàm
+                    self.overhead += 1
+                    continue
+                self.self_counts[stack[0]] += 1
+                for key in set(stack):
+                    self.total_counts[key] += 1
+
+
+class RenderProfiler:
+    def __init__(self, label="render", report_dir=None, interval_ms=None):
+        self.label = label
+        self.report_dir = report_dir or default_report_dir()
+        interval_ms = interval_ms or float(os.environ.get("RENDER_PROFILE_INTERVAL_MS", DEFAULT_INTERVAL_MS))
+        self._sampler = _Sampler(interval_ms / 1000.0)
+        self._lock = threading.Lock()
+        self._started = None
+        self._own_tracemalloc = False
+        self._last_snapshot = None
+        self.stages = []          # (nhãn, giây từ lúc bắt đầu, bộ nhớ hiện tại, đỉnh, top cấp phát)
+        self.ffmpeg_runs = []     # dict: label, utime, stime, rtime, maxrss_kb, ok
+        self.subtitle_stats = {}  # key hàm -> [số lần gọi, tottime, cumtime] (gộp từ process con)
+        self.subtitle_calls = 0
+
+    def start(self):
+        self._started = time.monotonic()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._own_tracemalloc = True
+        self._last_snapshot = tracemalloc.take_snapshot()
+        self._sampler.start()
+        return self
+
+    def stage(self, label):
+        """Chụp tracemalloc ở ranh giới giai đoạn, ghi các dòng cấp phát tăng nhiều nhất so với lần trước."""
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            previous, self._last_snapshot = self._last_snapshot, snapshot
+            diffs = snapshot.compare_to(previous, "lineno") if previous is not None else []
+            # Bỏ cấp phát của chính profiler và của việc import module
+            top = [stat for stat in diffs
+                   if stat.traceback[0].filename not in (__file__, tracemalloc.__file__)
+                   and not stat.traceback[0].filename.startswith("<frozen")][:TOP_ALLOCATIONS]
+            self.stages.append((label, time.monotonic() - self._started, current, peak, [
+                (str(stat.traceback[0]), stat.size_diff, stat.count_diff) for stat in top
+            ]))
+
+    def record_ffmpeg(self, cmd, stderr, ok=True):
+        bench = _BENCH_RE.search(stderr or "")
+        if bench is None:
+            return
+        maxrss = _MAXRSS_RE.search(stderr)
+        label = os.path.basename(str(cmd[-1])) if cmd else "?"
+        with self._lock:
+            self.ffmpeg_runs.append({
+                "label": label, "utime": float(bench.group(1)), "stime": float(bench.group(2)),
+                "rtime": float(bench.group(3)), "maxrss_kb": int(maxrss.group(1)) if maxrss else None, "ok": ok,
+            })
+
+    def record_subtitle_stats(self, stats):
+        with self._lock:
+            self.subtitle_calls += 1
+            for key, (ncalls, tottime, cumtime) in stats.items():
+                entry = self.subtitle_stats.setdefault(key, [0, 0.0, 0.0])
+                entry[0] += ncalls
+                entry[1] += tottime
+                entry[2] += cumtime
+
+    def stop(self):
+        self._sampler.stop_event.set()
+        self._sampler.join()
+        self.stage("end")
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+        return self.report()
+
+    def report(self):
+        elapsed = time.monotonic() - self._started
+        s = self._sampler
+        busy = max(s.samples - sum(s.idle_counts.values()) - s.overhead, 1)
+        lines = [
+            f"=== Profile render: {self.label} ===",
+            f"Thời gian: {elapsed:.1f}s · {s.samples} mẫu · chu kỳ {s.interval * 1000:.1f} ms"
+            f" · {s.overhead} mẫu là snapshot của profiler",
+            "",
+            "--- Thread (số mẫu, % chờ) ---",
+        ]
+        for name, count in s.thread_counts.most_common():
+            lines.append(f"{count:8d}  {100.0 * s.idle_counts[name] / count:5.1f}% chờ  {name}")
+        lines += ["", f"--- Top {TOP_FUNCTIONS} hàm theo thời gian tự thân (mẫu bận) ---"]
+        for key, count in s.self_counts.most_common(TOP_FUNCTIONS):
+            lines.append(f"{100.0 * count / busy:6.1f}%  {count:7d}  {_func_label(key)}")
+        lines += ["", f"--- Top {TOP_FUNCTIONS} hàm theo thời gian gộp (kể cả hàm con) ---"]
+        for key, count in s.total_counts.most_common(TOP_FUNCTIONS):
+            lines.append(f"{100.0 * count / busy:6.1f}%  {count:7d}  {_func_label(key)}")
+
+        lines += ["", f"--- Vẽ phụ đề trong process pool ({self.subtitle_calls} lần, cProfile) ---"]
+        for key, (ncalls, tottime, cumtime) in sorted(self.subtitle_stats.items(), key=lambda kv: -kv[1][1])[:TOP_FUNCTIONS]:
+            lines.append(f"{tottime:8.3f}s tự thân  {cumtime:8.3f}s gộp  {ncalls:7d} lần  {_func_label(key)}")
+
+        lines += ["", "--- tracemalloc theo giai đoạn ---"]
+        for label, at, current, peak, top in self.stages:
+            lines.append(f"[{label}] t={at:.1f}s hiện tại {current / 1048576:.1f} MB, đỉnh {peak / 1048576:.1f} MB")
+            for where, size_diff, count_diff in top:
+                lines.append(f"    {size_diff / 1024:+10.1f} KB  {count_diff:+7d} khối  {where}")
+
+        runs = self.ffmpeg_runs
+        lines += ["", f"--- ffmpeg -benchmark ({len(runs)} lệnh) ---"]
+        if runs:
+            lines.append(
+                f"Tổng: utime {sum(r['utime'] for r in runs):.1f}s · stime {sum(r['stime'] for r in runs):.1f}s"
+                f" · rtime {sum(r['rtime'] for r in runs):.1f}s"
+                f" · maxrss lớn nhất {max(r['maxrss_kb'] or 0 for r in runs) / 1024:.0f} MB"
+            )
+            lines.append(f"Top {TOP_CLIPS} lệnh chậm nhất:")
+            for r in sorted(runs, key=lambda r: -r["rtime"])[:TOP_CLIPS]:
+                cpu = r["utime"] + r["stime"]
+                lines.append(
+                    f"    rtime {r['rtime']:7.2f}s  cpu {cpu:7.2f}s ({cpu / max(r['rtime'], 1e-6):4.1f} core)"
+                    f"  maxrss {(r['maxrss_kb'] or 0) / 1024:6.0f} MB  {'' if r['ok'] else '[lỗi] '}{r['label']}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, text):
+        os.makedirs(self.report_dir, exist_ok=True)
+        safe_label = re.sub(r"[^\w.-]+", "_", self.label)[:60]
+        path = os.path.join(self.report_dir, f"profile_{time.strftime('%Y%m%d_%H%M%S')}_{safe_label}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def get_active_profiler():
+    return _active
+
+
+def start_profiling(label="render", report_dir=None):
+    """Bắt đầu phiên profiling; trả về None nếu đã có phiên khác đang chạy."""
+    global _active
+    with _active_lock:
+        if _active is not None:
+            return None
+        _active = RenderProfiler(label, report_dir).start()
+        return _active
+
+
+def stop_profiling(profiler):
+    """Kết thúc phiên, ghi báo cáo và trả về đường dẫn file."""
+    global _active
+    with _active_lock:
+        if _active is profiler:
+            _active = None
+    if profiler is None:
+        return None
+    path = profiler.write_report(profiler.stop())
+    print(f"[DEBUG] Báo cáo profiling: {path}")
+    return path
+
+
+def profile_stage(label):
+    profiler = _active
+    if profiler is not None:
+        profiler.stage(label)
+
+
+def profile_call(fn, *args):
+    """Chạy fn(*args) dưới cProfile (trong process con của pool phụ đề).
+    Trả về (kết quả, {hàm: (số lần gọi, tottime, cumtime)})."""
+    prof = cProfile.Profile()
+    result = prof.runcall(fn, *args)
+    stats = pstats.Stats(prof).stats
+    return result, {key: (nc, tt, ct) for key, (cc, nc, tt, ct, callers) in stats.items()}
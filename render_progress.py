@@ -0,0 +1,91 @@
+"""Theo dõi tiến độ render từ các sự kiện trong progress_queue (thread-safe, queue.Queue).
+
+Pipeline render đẩy các tuple vào queue:
+    ("planned", số_clip)        - render_shard đã tách xong câu của một shard
+    ("duration", key, giây)     - đã có TTS của một clip (độ dài video của clip đó)
+    ("clip", key, ok, t)        - một clip đã render xong (ok=False nếu bị bỏ qua/lỗi), t = time.monotonic()
+GUI đọc queue trong main loop (root.after) và gọi RenderProgress.handle() cho từng sự kiện.
+"""
+import time
+from collections import deque
+
+RATE_WINDOW_SECONDS = 20.0
+
+
+def report_progress(progress_queue, *event):
+    """Đẩy một sự kiện tiến độ; bỏ qua nếu không có queue."""
+    if progress_queue is None:
+        return
+    try:
+        progress_queue.put_nowait(event)
+    except Exception as e:
+        print(f"[⚠️] Không gửi được tiến độ: {e}")
+
+
+class RenderProgress:
+    PROGRESS_EVENTS = ("planned", "duration", "clip")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.monotonic()
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.video_seconds = 0.0
+        self._durations = {}
+        self._recent = deque()  # (thời điểm xong, giây video)
+
+    def handle(self, event):
+        kind = event[0]
+        if kind == "planned":
+            self.total += event[1]
+        elif kind == "duration":
+            self._durations[event[1]] = float(event[2])
+        elif kind == "clip":
+            key, ok = event[1], event[2]
+            now = event[3] if len(event) > 3 else time.monotonic()
+            if ok:
+                self.completed += 1
+                seconds = self._durations.pop(key, 0.0)
+                self.video_seconds += seconds
+                self._recent.append((now, seconds))
+            else:
+                self.failed += 1
+                self._durations.pop(key, None)
+                self._recent.append((now, 0.0))
+
+    def snapshot(self):
+        """Trả về dict: done, total, clips_per_sec, video_speed (giây video / giây thực), eta (giây hoặc None)."""
+        now = time.monotonic()
+        while self._recent and now - self._recent[0][0] > RATE_WINDOW_SECONDS:
+            self._recent.popleft()
+        elapsed = max(now - self.started_at, 1e-6)
+        done = self.completed + self.failed
+        # Tốc độ hiện tại: số clip xong trong RATE_WINDOW_SECONDS gần nhất (hoặc từ lúc bắt đầu nếu chưa đủ)
+        window = min(elapsed, RATE_WINDOW_SECONDS)
+        clips_per_sec = len(self._recent) / window
+        video_speed = sum(s for _, s in self._recent) / window
+        remaining = max(self.total - done, 0)
+        eta = remaining / clips_per_sec if clips_per_sec > 0 else None
+        return {
+            "done": done, "total": self.total, "failed": self.failed, "elapsed": elapsed,
+            "clips_per_sec": clips_per_sec, "video_speed": video_speed,
+            "video_seconds": self.video_seconds, "eta": eta,
+        }
+
+    def format(self):
+        snap = self.snapshot()
+        eta = snap["eta"]
+        if eta is None:
+            eta_text = "--:--"
+        else:
+            eta_text = f"{int(eta) // 60:02d}:{int(eta) % 60:02d}"
+        text = (
+            f"{snap['done']}/{snap['total']} clip · {snap['clips_per_sec']:.2f} câu/s · "
+            f"{snap['video_speed']:.2f}s video/s · ETA {eta_text}"
+        )
+        if snap["failed"]:
+            text += f" · lỗi {snap['failed']}"
+        return text
@@ -0,0 +1,432 @@
+"""Dịch vụ render chạy nền: nhận job qua HTTP (chỉ localhost), xếp hàng theo độ ưu tiên,
+chạy song song một số job và dùng chung cache (process vẽ phụ đề, font, Voicevox pool,
+cache độ dài TTS, profile encoder) giữa các job vì process luôn thường trú.
+
+API (JSON):
+    POST   /jobs          tạo job: {"text": "..."} hoặc {"sentences": [...]}, "output": "out.mp4",
+                          "priority": 0 (lớn hơn chạy trước), "options": {tham số render_shard như distributed_render}
+    GET    /jobs          danh sách job
+    GET    /jobs/<id>     trạng thái + tiến độ của một job
+    DELETE /jobs/<id>     hủy job (đang chờ hoặc đang chạy)
+    POST   /plan          dự toán cho một job (cùng JSON như POST /jobs), không render
+    GET    /metrics       thông lượng (câu/s, giây video/s), số job theo trạng thái, RAM
+    GET    /health
+
+Chạy:
+    python render_server.py --port 8765 --jobs 2 [--profile]
+    (--profile hoặc RENDER_PROFILE=1: mỗi lần một job được profiling, đường dẫn báo cáo nằm ở "profile_report")
+    curl -X POST localhost:8765/jobs -d @job.json
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import itertools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from video_worker import (
+    render_shard, split_sentences, parse_renditions, composite_size_for, default_engine, remove_partial_outputs, ENGINES
+)
+from scratch_space import ScratchSpace
+from render_manifest import build_manifest, write_manifest, discard_manifest
+from render_cancel import CancelToken, RenderCancelled
+from render_progress import RenderProgress
+from memory_budget import get_memory_budget, MB
+from encoder_tuning import AUTO_ENCODER, resolve_encoder_setting, machine_fingerprint
+from render_history import RunRecorder, get_run_history, settings_key
+from render_planner import plan_render
+from render_profiler import profiling_requested, start_profiling, stop_profiling
+from voicevox_pool import get_voicevox_pool, set_voicevox_endpoints, parse_endpoints
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_CONCURRENT_JOBS = 2
+MAX_FINISHED_JOBS = 200
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+REQUIRED_OPTIONS = ("voice", "font_path")
+
+
+class _JobProgressQueue:
+    """Thay cho progress_queue: render_shard gọi put_nowait(event) trên event loop,
+    sự kiện được cộng vào tiến độ của job và tiến độ chung của server (có khóa vì HTTP đọc từ thread khác)."""
+
+    def __init__(self, job, server):
+        self.job = job
+        self.server = server
+
+    def put_nowait(self, event):
+        with self.server._lock:
+            self.job.progress.handle(event)
+            kind = event[0]
+            if kind in ("duration", "clip"):
+                # Khóa của từng clip chỉ duy nhất trong một job -> ghép thêm id job cho tiến độ chung
+                event = (kind, (self.job.id, event[1])) + tuple(event[2:])
+            self.server.totals.handle(event)
+
+
+class RenderJob:
+    def __init__(self, number, spec, priority):
+        self.number = number
+        self.id = f"job-{number:05d}"
+        self.spec = spec
+        self.priority = priority
+        self.status = "queued"
+        self.error = None
+        self.output = spec["output"]
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = RenderProgress()
+        self.cancel_token = CancelToken()
+        self.profile_report = None
+
+    def to_dict(self):
+        info = {
+            "id": self.id, "status": self.status, "priority": self.priority, "output": self.output,
+            "submitted_at": self.submitted_at, "started_at": self.started_at, "finished_at": self.finished_at,
+            "sentences": len(self.spec["sentences"]), "error": self.error,
+        }
+        if self.profile_report:
+            info["profile_report"] = self.profile_report
+        if self.started_at is not None:
+            snap = self.progress.snapshot()
+            if self.finished_at is not None:
+                snap["elapsed"] = self.finished_at - self.started_at
+                snap["eta"] = 0 if self.status == "done" else None
+            info["progress"] = snap
+        return info
+
+
+def _parse_job_spec(data):
+    """Kiểm tra JSON của job, trả về spec đã chuẩn hóa (ValueError nếu thiếu/ sai)."""
+    if not isinstance(data, dict):
+        raise ValueError("Job phải là một object JSON.")
+    sentences = data.get("sentences")
+    if sentences is None:
+        sentences = split_sentences(data.get("text") or "")
+    if not isinstance(sentences, list) or not sentences:
+        raise ValueError("Cần 'text' hoặc 'sentences' không rỗng.")
+    output = data.get("output")
+    if not output:
+        raise ValueError("Thiếu 'output'.")
+    options = dict(data.get("options") or {})
+    missing = [k for k in REQUIRED_OPTIONS if k not in options]
+    if missing:
+        raise ValueError(f"Thiếu tham số trong 'options': {', '.join(missing)}")
+    if isinstance(options.get("renditions"), str):
+        renditions = parse_renditions(options["renditions"])
+        options["renditions"] = renditions
+        if renditions:
+            options.setdefault("width", composite_size_for(renditions)[0])
+            options.setdefault("height", composite_size_for(renditions)[1])
+    if options.get("engine") not in (None,) + ENGINES:
+        raise ValueError(f"'engine' phải là một trong: {', '.join(ENGINES)}")
+    for key in ("output_path", "progress_queue", "sem", "scratch", "cancel_token", "on_clip_done"):
+        options.pop(key, None)
+    try:
+        priority = int(data.get("priority", 0))
+    except (TypeError, ValueError):
+        raise ValueError("'priority' phải là số nguyên.")
+    return {"sentences": [str(s) for s in sentences], "output": os.path.abspath(output),
+            "options": options}, priority
+
+
+def _resolve_encoder(options, calibrate_if_missing=True):
+    """Bỏ encoder/auto_encoders khỏi options, trả về (encoder, options) với preset đã chọn nếu encoder là "auto"."""
+    options = dict(options)
+    encoder = options.pop("encoder", AUTO_ENCODER)
+    auto_encoders = options.pop("auto_encoders", None) or ["libx264"]
+    if encoder == AUTO_ENCODER:
+        encoder, preset = resolve_encoder_setting(auto_encoders, calibrate_if_missing=calibrate_if_missing)
+        if preset and "preset" not in options:
+            options["preset"] = preset
+    return encoder, options
+
+
+def plan_job(data):
+    """Dự toán cho JSON job (render_planner.plan_render); job chạy ở chế độ pipe nên dự toán cũng vậy."""
+    spec, _ = _parse_job_spec(data)
+    encoder, options = _resolve_encoder(spec["options"], calibrate_if_missing=False)
+    options.pop("use_pipes", None)
+    plan = plan_render(spec["sentences"], options.pop("voice"), options.pop("image_or_video_paths", []),
+                       encoder=encoder, use_pipes=True, **options)
+    return plan
+
+
+class RenderJobServer:
+    def __init__(self, max_jobs=DEFAULT_CONCURRENT_JOBS, clip_workers=None, profile=False):
+        self.max_jobs = max(1, max_jobs)
+        self.clip_workers = clip_workers or os.cpu_count() or 1
+        self.profile = profile
+        self.started_at = time.time()
+        self.totals = RenderProgress()
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._heap = []
+        self._counter = itertools.count(1)
+        self._running = 0
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self.clip_sem = None
+
+    # --- event loop của các job (thread riêng; HTTP handler chỉ gọi qua call_soon_threadsafe) ---
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        # Một semaphore clip chung cho mọi job: job sau lấp chỗ trống khi job trước đang ghép/đợi TTS
+        self.clip_sem = asyncio.Semaphore(self.clip_workers)
+        self.loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+        get_voicevox_pool()
+        get_memory_budget()
+
+    def stop(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.status in ("queued", "running"):
+                job.cancel_token.cancel()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def submit(self, data):
+        spec, priority = _parse_job_spec(data)
+        with self._lock:
+            job = RenderJob(next(self._counter), spec, priority)
+            self._jobs[job.id] = job
+            # heapq lấy nhỏ nhất trước: ưu tiên cao -> -priority nhỏ; cùng ưu tiên thì job gửi trước chạy trước
+            heapq.heappush(self._heap, (-priority, job.number, job))
+            self._trim_finished()
+        self.loop.call_soon_threadsafe(self._schedule)
+        print(f"[DEBUG] Nhận {job.id} (ưu tiên {priority}, {len(spec['sentences'])} câu) -> {spec['output']}")
+        return job
+
+    def _trim_finished(self):
+        finished = [j for j in self._jobs.values() if j.finished_at is not None]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+    def _schedule(self):
+        while True:
+            with self._lock:
+                if self._running >= self.max_jobs or not self._heap:
+                    return
+                _, _, job = heapq.heappop(self._heap)
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+                job.started_at = time.time()
+                job.progress.reset()
+                self._running += 1
+            self.loop.create_task(self._run_job(job))
+
+    async def _run_job(self, job):
+        job_dir = tempfile.mkdtemp(prefix=f"auto_video_{job.id}_")
+        scratch = ScratchSpace(disk_dir=job_dir)
+        recorder = None
+        # Profiler là toàn cục của process: job nào bắt đầu khi chưa có phiên profiling thì được đo
+        profiler = start_profiling(job.id) if self.profile else None
+        try:
+            job.cancel_token.bind_current_task()
+            encoder, options = await self.loop.run_in_executor(None, _resolve_encoder, job.spec["options"])
+            options.pop("use_pipes", None)
+            workers = options.pop("workers", None) or self.clip_workers
+            manifest_options = dict(options, encoder=encoder, use_pipes=True)
+            clip_records = []
+            key = settings_key(
+                options.get("width", 1280), options.get("height", 720), options.get("fps", 25), encoder,
+                options.get("preset", "fast"), options.get("effect", "none"), options.get("is_video_input", False),
+                options.get("overlay_effect", "none"), options.get("renditions"), use_pipes=True,
+                engine=options.get("engine") or default_engine()
+            )
+            recorder = RunRecorder(key, workers=workers, history=get_run_history(), machine=machine_fingerprint()).start()
+            os.makedirs(os.path.dirname(job.output) or ".", exist_ok=True)
+            # File cũ trùng tên (của job trước) không được coi là kết quả của job này
+            remove_partial_outputs(job.output, options.get("renditions"))
+            discard_manifest(job.output)
+            # Pipe + scratch riêng: file tạm của các job chạy song song không bao giờ trùng tên
+            valid_videos = await render_shard(
+                job.number, job.spec["sentences"], options.pop("voice"), options.pop("image_or_video_paths", []),
+                options.pop("font_path"), options.pop("subtitle_color", "#FFFF00"),
+                options.pop("stroke_color", "#000000"), options.pop("bg_color", "#FFFFFF"),
+                options.pop("effect", "none"), job.output, encoder, _JobProgressQueue(job, self),
+                sem=self.clip_sem, use_pipes=True, scratch=scratch, cancel_token=job.cancel_token,
+                workers=workers, recorder=recorder, clip_records=clip_records, **options
+            )
+            if not valid_videos or not os.path.exists(job.output):
+                raise RuntimeError("Không có clip nào được tạo.")
+            # Manifest cạnh video: sửa kịch bản sau này chỉ render lại câu thay đổi (render_manifest.py)
+            try:
+                write_manifest(job.output, build_manifest(manifest_options, clip_records))
+            except (OSError, ValueError) as e:
+                discard_manifest(job.output)
+                print(f"[⚠️] {job.id}: không ghi được manifest: {e}")
+            status, error = "done", None
+        except (RenderCancelled, asyncio.CancelledError):
+            status, error = "cancelled", None
+        except Exception as e:
+            print(f"❌ {job.id} lỗi: {e}")
+            status, error = "failed", str(e)
+        finally:
+            scratch.cleanup()
+            shutil.rmtree(job_dir, ignore_errors=True)
+        if recorder is not None:
+            recorder.finish(status)
+        if profiler is not None:
+            job.profile_report = await self.loop.run_in_executor(None, stop_profiling, profiler)
+        with self._lock:
+            job.status = status
+            job.error = error
+            job.finished_at = time.time()
+            self._running -= 1
+        print(f"[DEBUG] {job.id} kết thúc: {status}")
+        self._schedule()
+
+    # --- truy vấn từ HTTP handler ---
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def list(self):
+        with self._lock:
+            return [job.to_dict() for job in sorted(self._jobs.values(), key=lambda j: j.number)]
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished_at = time.time()
+                return job.to_dict()
+        if job.status == "running":
+            job.cancel_token.cancel()
+        return self.get(job_id)
+
+    def metrics(self):
+        with self._lock:
+            counts = {state: 0 for state in JOB_STATES}
+            durations = []
+            for job in self._jobs.values():
+                counts[job.status] += 1
+                if job.status == "done":
+                    durations.append(job.finished_at - job.started_at)
+            snap = self.totals.snapshot()
+        budget = get_memory_budget()
+        return {
+            "uptime": time.time() - self.started_at,
+            "max_jobs": self.max_jobs, "clip_workers": self.clip_workers,
+            "jobs": counts,
+            "clips_done": snap["done"], "clips_failed": snap["failed"],
+            "clips_per_sec": snap["clips_per_sec"], "video_speed": snap["video_speed"],
+            "video_seconds": snap["video_seconds"],
+            "avg_job_seconds": sum(durations) / len(durations) if durations else None,
+            "memory_budget_mb": budget.budget_bytes // MB if budget.budget_bytes else None,
+            "memory_peak_mb": budget.peak_usage // MB,
+            "memory_throttled_seconds": budget.throttled_seconds,
+            "voicevox": get_voicevox_pool().stats(),
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "AutoVideoRender/1.0"
+
+    def _send_json(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job_id(self):
+        parts = self.path.rstrip("/").split("/")
+        return parts[2] if len(parts) == 3 and parts[1] == "jobs" else None
+
+    def do_GET(self):
+        jobs = self.server.jobs
+        path = self.path.rstrip("/")
+        if path == "/health":
+            self._send_json(200, {"ok": True})
+        elif path == "/metrics":
+            self._send_json(200, jobs.metrics())
+        elif path == "/jobs":
+            self._send_json(200, jobs.list())
+        elif self._job_id():
+            info = jobs.get(self._job_id())
+            self._send_json(200 if info else 404, info or {"error": "Không tìm thấy job"})
+        else:
+            self._send_json(404, {"error": "Không có endpoint này"})
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        if path not in ("/jobs", "/plan"):
+            self._send_json(404, {"error": "Không có endpoint này"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            data = json.loads(self.rfile.read(length).decode("utf-8") or "null")
+            if path == "/plan":
+                self._send_json(200, plan_job(data))
+                return
+            job = self.server.jobs.submit(data)
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            print(f"❌ Lỗi xử lý {path}: {e}")
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(202, {"id": job.id, "status": job.status})
+
+    def do_DELETE(self):
+        job_id = self._job_id()
+        info = self.server.jobs.cancel(job_id) if job_id else None
+        self._send_json(200 if info else 404, info or {"error": "Không tìm thấy job"})
+
+    def log_message(self, format, *args):
+        print(f"[DEBUG] HTTP {self.address_string()} {format % args}")
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, max_jobs=DEFAULT_CONCURRENT_JOBS, clip_workers=None, profile=False):
+    jobs = RenderJobServer(max_jobs, clip_workers, profile=profile)
+    jobs.start()
+    httpd = ThreadingHTTPServer((host, port), _Handler)
+    httpd.jobs = jobs
+    print(f"[DEBUG] Render server: http://{host}:{port} ({jobs.max_jobs} job song song, {jobs.clip_workers} clip/lần)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        jobs.stop()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dịch vụ render video chạy nền (HTTP localhost)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--jobs", type=int, default=DEFAULT_CONCURRENT_JOBS, help="Số job chạy song song")
+    parser.add_argument("--clip-workers", type=int, default=None,
+                        help="Tổng số clip render song song cho mọi job (mặc định: số core)")
+    parser.add_argument("--voicevox", default=None, help="Danh sách Voicevox Engine, phân tách bằng dấu phẩy")
+    parser.add_argument("--profile", action="store_true", default=profiling_requested(),
+                        help="Profiling job (báo cáo trong RENDER_PROFILE hoặc ./render_profiles)")
+    args = parser.parse_args(argv)
+    if args.voicevox:
+        set_voicevox_endpoints(parse_endpoints(args.voicevox))
+    return serve(args.host, args.port, args.jobs, args.clip_workers, profile=args.profile)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
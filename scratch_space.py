@@ -0,0 +1,76 @@
+"""Thư mục tạm trên RAM (ví dụ /dev/shm) cho file trung gian của chế độ pipe,
+tự chuyển sang thư mục tạm trên đĩa khi dung lượng RAM đã dùng vượt giới hạn.
+
+Giới hạn mặc định đọc từ biến môi trường RENDER_SCRATCH_LIMIT_MB (mặc định 1024 MB).
+"""
+import os
+import shutil
+import tempfile
+import threading
+
+DEFAULT_SCRATCH_LIMIT_MB = 1024
+
+
+def _default_ram_dir():
+    for candidate in ("/dev/shm",):
+        if os.path.isdir(candidate) and os.access(candidate, os.W_OK):
+            return candidate
+    return None
+
+
+class ScratchSpace:
+    def __init__(self, ram_dir=None, disk_dir=None, limit_bytes=None):
+        if limit_bytes is None:
+            limit_mb = float(os.environ.get("RENDER_SCRATCH_LIMIT_MB", DEFAULT_SCRATCH_LIMIT_MB))
+            limit_bytes = int(limit_mb * 1024 * 1024)
+        self.limit_bytes = limit_bytes
+        ram_root = ram_dir or _default_ram_dir()
+        # Mỗi ScratchSpace một thư mục riêng để cleanup() không xóa nhầm file của lần render khác
+        self.ram_dir = tempfile.mkdtemp(prefix="auto_video_", dir=ram_root) if ram_root else None
+        self.disk_dir = disk_dir or tempfile.gettempdir()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ram_used(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def path_for(self, name, expected_size=0):
+        """Chọn chỗ ghi file: RAM nếu còn đủ hạn mức, ngược lại ghi xuống đĩa."""
+        with self._lock:
+            used = sum(self._sizes.values())
+            if self.ram_dir and used + expected_size <= self.limit_bytes:
+                path = os.path.join(self.ram_dir, name)
+                self._sizes[path] = expected_size
+                return path
+        return os.path.join(self.disk_dir, name)
+
+    def account(self, path):
+        """Cập nhật dung lượng thật sau khi file đã được ghi xong."""
+        with self._lock:
+            if path in self._sizes:
+                try:
+                    self._sizes[path] = os.path.getsize(path)
+                except OSError:
+                    self._sizes.pop(path, None)
+
+    def release(self, paths):
+        """Xóa các file trên RAM không còn cần nữa để trả hạn mức."""
+        for path in paths:
+            with self._lock:
+                tracked = self._sizes.pop(path, None)
+            if tracked is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def is_ram(self, path):
+        return bool(self.ram_dir) and os.path.dirname(path) == self.ram_dir
+
+    def cleanup(self):
+        if self.ram_dir and os.path.isdir(self.ram_dir):
+            shutil.rmtree(self.ram_dir, ignore_errors=True)
+        with self._lock:
+            self._sizes.clear()
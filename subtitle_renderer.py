@@ -0,0 +1,129 @@
+"""Vẽ ảnh phụ đề (PNG RGBA) bằng Pillow trong process pool riêng.
+
+Module này chỉ phụ thuộc Pillow để process con khởi động nhanh; mỗi process giữ
+font đã nạp (lru_cache) nên cả lần render chỉ nạp font một lần cho mỗi process.
+"""
+import os
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw, ImageFont
+
+BASE_FONT_SIZE = 48
+
+
+def subtitle_layout(width=1280, height=720, renditions=None):
+    """Cỡ chữ, độ rộng tối đa của dòng và hệ số scale theo khung hình đầu ra."""
+    scale = height / 720.0
+    font_size = max(12, int(round(BASE_FONT_SIZE * scale)))
+    max_text_width = int(1100 * width / 1280)
+    for r in renditions or []:
+        if r["height"] > r["width"]:
+            # Có bản dọc: phụ đề phải nằm gọn trong vùng cắt giữa khung hình
+            target_ratio = r["width"] / r["height"]
+            crop_w = min(width, int(round(height * target_ratio))) // 2 * 2
+            max_text_width = min(max_text_width, crop_w - int(80 * scale))
+    return font_size, max(max_text_width, int(200 * scale)), scale
+
+
+@functools.lru_cache(maxsize=32)
+def load_font(font_path, font_size):
+    return ImageFont.truetype(font_path, font_size)
+
+
+@functools.lru_cache(maxsize=1)
+def _measure_draw():
+    return ImageDraw.Draw(Image.new("RGBA", (10, 10)))
+
+
+def wrap_text(draw, text, font, max_width):
+    lines = []
+    line = ''
+    for ch in text:
+        test_line = line + ch
+        if draw.textlength(test_line, font=font) <= max_width:
+            line = test_line
+        else:
+            lines.append(line)
+            line = ch
+    if line:
+        lines.append(line)
+    return lines
+
+
+def build_subtitle_image(sentence, font_path, font_size, max_text_width, scale,
+                         subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width):
+    """Vẽ phụ đề, trả về ảnh RGBA (chưa lưu)."""
+    font = load_font(font_path, font_size)
+    draw = _measure_draw()
+    wrapped = wrap_text(draw, sentence, font, max_width=max_text_width)
+    line_heights = [draw.textbbox((0, 0), line, font=font)[3] for line in wrapped]
+    total_height = sum(line_heights) + (len(wrapped) - 1) * 10
+    max_line_width = max(draw.textlength(line, font=font) for line in wrapped)
+    sub_image_width = max(int(max_line_width) + int(80 * scale), int(200 * scale))
+    sub_image_height = max(total_height + int(40 * scale), int(80 * scale))
+
+    img_sub = Image.new("RGBA", (sub_image_width, sub_image_height), (0, 0, 0, 0))
+    draw_sub = ImageDraw.Draw(img_sub)
+    bg_rgb = Image.new("RGB", (1, 1), bg_color).getpixel((0, 0))
+    draw_sub.rectangle([(0, 0), img_sub.size], fill=(*bg_rgb, int(bg_opacity)))
+    scaled_stroke = max(1, int(round(stroke_width * scale))) if stroke_width else 0
+    y = int(20 * scale)
+    for line, h in zip(wrapped, line_heights):
+        x = (img_sub.size[0] - draw.textlength(line, font=font)) // 2
+        draw_sub.text((x, y), line, font=font, fill=subtitle_color,
+                      stroke_width=scaled_stroke, stroke_fill=stroke_color)
+        y += h + 10
+    return img_sub
+
+
+def render_subtitle_image(out_path, sentence, font_path, font_size, max_text_width, scale,
+                          subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width):
+    """Vẽ phụ đề và lưu PNG ra out_path (chạy được trong process con). Trả về out_path."""
+    img_sub = build_subtitle_image(
+        sentence, font_path, font_size, max_text_width, scale,
+        subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width
+    )
+    tmp_path = f"{out_path}.{os.getpid()}.tmp.png"
+    img_sub.save(tmp_path)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def render_subtitle_rgba(sentence, font_path, font_size, max_text_width, scale,
+                         subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width):
+    """Vẽ phụ đề, trả về (rộng, cao, bytes RGBA thô) để đưa thẳng vào ffmpeg qua pipe."""
+    img_sub = build_subtitle_image(
+        sentence, font_path, font_size, max_text_width, scale,
+        subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width
+    )
+    return img_sub.size[0], img_sub.size[1], img_sub.tobytes()
+
+
+def _preload_fonts(font_specs):
+    for font_path, font_size in font_specs:
+        try:
+            load_font(font_path, font_size)
+        except OSError:
+            pass
+
+
+_subtitle_pool = None
+
+
+def get_subtitle_pool(font_specs=()):
+    """Process pool dùng chung cho việc vẽ phụ đề; font_specs được nạp sẵn khi process khởi động."""
+    global _subtitle_pool
+    if _subtitle_pool is None:
+        _subtitle_pool = ProcessPoolExecutor(
+            max_workers=max(1, min(8, (os.cpu_count() or 2) - 1)),
+            initializer=_preload_fonts, initargs=(tuple(font_specs),)
+        )
+    return _subtitle_pool
+
+
+def reset_subtitle_pool():
+    """Bỏ pool hỏng (BrokenProcessPool) để lần sau tạo lại."""
+    global _subtitle_pool
+    if _subtitle_pool is not None:
+        _subtitle_pool.shutdown(wait=False, cancel_futures=True)
+    _subtitle_pool = None
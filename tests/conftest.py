@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Các module của app nằm phẳng ở thư mục gốc repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
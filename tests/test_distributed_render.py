@@ -0,0 +1,176 @@
+"""Chạy coordinator với vài process worker thật trên một thư mục queue tạm (Linux, fork).
+
+render_shard được thay bằng bản giả ghi file văn bản, nên không cần ffmpeg/Voicevox;
+"câu" điều khiển hành vi: "slow" ngủ lâu, "crash" làm chết process worker, "fail" ném lỗi.
+"""
+import os
+import sys
+import time
+import signal
+import threading
+import asyncio
+import multiprocessing
+
+import pytest
+
+import distributed_render
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="cần fork và os.kill kiểu POSIX")
+
+OPTIONS = {
+    "voice": "1", "image_or_video_paths": [], "font_path": None,
+    "subtitle_color": "white", "stroke_color": "black", "bg_color": "black",
+}
+
+
+async def fake_render_shard(shard_id, texts, *args, **kwargs):
+    output_path = args[7]
+    for text in texts:
+        if text == "crash":
+            os._exit(1)
+        if text == "fail":
+            raise RuntimeError("lỗi giả")
+        await asyncio.sleep(1.0 if text == "slow" else 0.05)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(texts) + "\n")
+
+
+def fake_concat_videos(paths, output_path, list_path):
+    with open(output_path, "w", encoding="utf-8") as out:
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                out.write(f.read())
+
+
+def _worker_main(queue_dir, worker_id):
+    distributed_render.render_shard = fake_render_shard
+    distributed_render.HEARTBEAT_INTERVAL = 0.2
+    distributed_render.run_worker(queue_dir, worker_id, poll_interval=0.05)
+
+
+@pytest.fixture
+def workers(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    queue_dir = str(tmp_path / "queue")
+    distributed_render.init_queue_dir(queue_dir)
+    procs = {}
+
+    def start(*worker_ids):
+        for worker_id in worker_ids:
+            p = ctx.Process(target=_worker_main, args=(queue_dir, worker_id), daemon=True)
+            p.start()
+            procs[worker_id] = p
+        return procs
+
+    yield queue_dir, start
+    for p in procs.values():
+        if p.is_alive():
+            p.kill()
+        p.join()
+
+
+@pytest.fixture(autouse=True)
+def fake_concat(monkeypatch):
+    monkeypatch.setattr(distributed_render, "concat_videos", fake_concat_videos)
+
+
+def _coordinate(queue_dir, sentences, tmp_path, num_shards, **kwargs):
+    output = str(tmp_path / "out.txt")
+    distributed_render.run_coordinator(
+        sentences, queue_dir, output, OPTIONS, num_shards, timeout=1.0, poll_interval=0.05, **kwargs
+    )
+    with open(output, "r", encoding="utf-8") as f:
+        return f.read().split()
+
+
+def test_jobs_spread_over_workers_and_concat_in_order(workers, tmp_path):
+    queue_dir, start = workers
+    start("w1", "w2", "w3")
+    sentences = [f"s{i}" for i in range(12)]
+    assert _coordinate(queue_dir, sentences, tmp_path, num_shards=6, deadline=30) == sentences
+    done_by = {
+        distributed_render._read_json(os.path.join(queue_dir, "done", f))["worker_id"]
+        for f in os.listdir(os.path.join(queue_dir, "done"))
+    }
+    assert len(done_by) >= 2
+
+
+def test_job_of_killed_worker_is_requeued(workers, tmp_path):
+    queue_dir, start = workers
+    procs = start("w1", "w2")
+    sentences = ["slow", "a", "slow", "b"]
+    victim = {}
+
+    def kill_first_claim():
+        # Giết worker đang giữ job đầu tiên nó nhận, giữa chừng job
+        claimed_dir = os.path.join(queue_dir, "claimed")
+        while not victim:
+            for fname in os.listdir(claimed_dir):
+                worker_id, job_file = fname.split("__", 1)
+                victim.update(worker=worker_id, job=job_file[:-len(".json")])
+                os.kill(procs[worker_id].pid, signal.SIGKILL)
+                procs[worker_id].join()
+                return
+            time.sleep(0.01)
+
+    killer = threading.Thread(target=kill_first_claim)
+    killer.start()
+    result = _coordinate(queue_dir, sentences, tmp_path, num_shards=2, deadline=30)
+    killer.join()
+    assert result == sentences
+    done = distributed_render._read_json(os.path.join(queue_dir, "done", f"{victim['job']}.json"))
+    assert done["ok"] and done["worker_id"] != victim["worker"]
+
+
+def test_job_that_kills_every_worker_stops_after_max_attempts(workers, tmp_path):
+    queue_dir, start = workers
+    start(*(f"w{i}" for i in range(distributed_render.MAX_ATTEMPTS + 1)))
+    with pytest.raises(RuntimeError, match=f"sau {distributed_render.MAX_ATTEMPTS} lần"):
+        _coordinate(queue_dir, ["crash"], tmp_path, num_shards=1, deadline=30)
+
+
+def test_failing_job_is_retried_up_to_max_attempts(workers, tmp_path):
+    queue_dir, start = workers
+    start("w1")
+    with pytest.raises(RuntimeError, match="lỗi giả"):
+        _coordinate(queue_dir, ["fail"], tmp_path, num_shards=1, deadline=30)
+
+
+def test_no_live_worker_raises_instead_of_hanging(workers, tmp_path):
+    queue_dir, _ = workers
+    started = time.time()
+    with pytest.raises(RuntimeError, match="Không có worker nào"):
+        _coordinate(queue_dir, ["a", "b"], tmp_path, num_shards=2)
+    assert time.time() - started < 10
+
+
+def test_deadline(workers, tmp_path):
+    queue_dir, start = workers
+    start("w1")
+    with pytest.raises(TimeoutError):
+        _coordinate(queue_dir, ["slow"] * 5, tmp_path, num_shards=1, deadline=0.5)
+
+
+def test_second_run_on_same_queue_dir_ignores_previous_run(workers, tmp_path):
+    queue_dir, start = workers
+    start("w1", "w2")
+    assert _coordinate(queue_dir, ["a", "b", "c", "d"], tmp_path, num_shards=2, deadline=30) == ["a", "b", "c", "d"]
+    # Job còn sót của lần trước không được worker nhận lại
+    distributed_render._write_json_atomic(
+        os.path.join(queue_dir, "pending", "shard_0009.json"),
+        {"job": "shard_0009", "shard_id": 9, "offset_in_all": 0, "texts": ["old"], "options": OPTIONS,
+         "attempt": 1, "run_id": "old"}
+    )
+    assert _coordinate(queue_dir, ["X", "Y", "Z", "W"], tmp_path, num_shards=2, deadline=30) == ["X", "Y", "Z", "W"]
+    assert not os.path.exists(os.path.join(queue_dir, "done", "shard_0009.json"))
+
+
+def test_result_with_other_run_id_is_discarded(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    distributed_render.init_queue_dir(queue_dir)
+    stale = os.path.join(queue_dir, "done", "shard_0000.json")
+    distributed_render._write_json_atomic(stale, {"job": "shard_0000", "ok": True, "output": "old.mp4", "run_id": "old"})
+    with pytest.raises(TimeoutError):
+        distributed_render.wait_for_jobs(queue_dir, ["shard_0000"], timeout=1.0, poll_interval=0.05,
+                                         deadline=0.3, run_id="new")
+    assert not os.path.exists(stale)
@@ -0,0 +1,182 @@
+"""Kiểm tra VoicevoxPool với vài stub HTTP (http.server) trên các cổng ngẫu nhiên."""
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from voicevox_pool import VoicevoxPool
+
+
+class StubEngine:
+    """Stub Voicevox: /version, /audio_query, /synthesis. mode: ok | close (đóng kết nối khi tổng hợp) | down (503 mọi request)."""
+
+    def __init__(self, delay=0.0):
+        self.mode = "ok"
+        self.delay = delay
+        self.hits = 0
+        self.fail_texts = set()   # câu làm engine trả 500 (engine vẫn sống)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=b""):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                if stub.mode == "down":
+                    return self._reply(503)
+                if self.path.startswith("/version"):
+                    return self._reply(200, b'"0.0.0-stub"')
+                if stub.mode == "close":
+                    self.close_connection = True
+                    return
+                if any(t in self.path for t in stub.fail_texts):
+                    return self._reply(500)
+                if self.path.startswith("/synthesis"):
+                    stub.hits += 1
+                    time.sleep(stub.delay)
+                    return self._reply(200, f"{stub.port}".encode())
+                return self._reply(200, b"{}")
+
+            do_GET = do_POST = _handle
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stubs():
+    created = []
+
+    def make(n, delay=0.0):
+        created.extend(StubEngine(delay) for _ in range(n))
+        return created
+
+    yield make
+    for stub in created:
+        stub.close()
+
+
+def make_pool(engines, **kwargs):
+    return VoicevoxPool([e.url for e in engines], **kwargs)
+
+
+def synthesize(text="こんにちは"):
+    def fn(api_base):
+        requests.post(f"{api_base}/audio_query", params={"text": text, "speaker": 1}, timeout=5).raise_for_status()
+        response = requests.post(f"{api_base}/synthesis", params={"speaker": 1}, json={}, timeout=5)
+        response.raise_for_status()
+        return int(response.content)
+    return fn
+
+
+def test_round_robin_when_idle(stubs):
+    engines = stubs(3)
+    pool = make_pool(engines)
+    try:
+        ports = [pool.call(synthesize()) for _ in range(6)]
+    finally:
+        pool.stop_health_checks()
+    assert ports == [e.port for e in engines] * 2
+
+
+def test_least_outstanding_spreads_concurrent_requests(stubs):
+    engines = stubs(3, delay=0.3)
+    pool = make_pool(engines)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.call(synthesize()))) for _ in range(6)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        pool.stop_health_checks()
+    assert len(results) == 6
+    assert [e.hits for e in engines] == [2, 2, 2]
+    assert all(s["outstanding"] == 0 for s in pool.stats())
+
+
+def test_eject_and_readmit_through_version(stubs):
+    bad, good = stubs(2)
+    pool = make_pool([bad, good], health_interval=0.1, eject_seconds=60)
+    try:
+        bad.mode = "down"
+        assert {pool.call(synthesize()) for _ in range(4)} == {good.port}
+        assert not pool.endpoints[0].available
+        bad.mode = "ok"
+        deadline = time.time() + 5
+        while not pool.endpoints[0].available and time.time() < deadline:
+            time.sleep(0.05)
+        assert pool.endpoints[0].available
+        assert {pool.call(synthesize()) for _ in range(4)} == {bad.port, good.port}
+    finally:
+        pool.stop_health_checks()
+
+
+@pytest.mark.parametrize("mode", ["503", "close"])
+def test_failover_to_another_engine(stubs, mode):
+    bad, good = stubs(2)
+    bad.mode = "down" if mode == "503" else "close"   # "down": 503 cả /version, engine hỏng thật
+    pool = make_pool([bad, good], health_interval=60)
+    try:
+        assert pool.call(synthesize()) == good.port
+        assert not pool.endpoints[0].available
+        assert pool.endpoints[1].available
+    finally:
+        pool.stop_health_checks()
+
+
+def test_sentence_specific_500_does_not_eject(stubs):
+    first, second = stubs(2)
+    first.fail_texts.add("bad")
+    pool = make_pool([first, second], health_interval=60)
+    try:
+        assert pool.call(synthesize("bad")) == second.port   # thử lại trên engine kia
+        assert all(ep.available for ep in pool.endpoints)   # /version vẫn ổn nên không loại
+    finally:
+        pool.stop_health_checks()
+
+
+def test_last_engine_is_never_ejected(stubs):
+    (engine,) = stubs(1)
+    pool = make_pool([engine], health_interval=60)
+    try:
+        engine.mode = "close"
+        with pytest.raises(requests.exceptions.ConnectionError):
+            pool.call(synthesize())
+        assert pool.endpoints[0].available
+        engine.mode = "ok"
+        assert pool.call(synthesize()) == engine.port
+    finally:
+        pool.stop_health_checks()
+
+
+def test_all_ejected_still_tries_earliest(stubs):
+    a, b = stubs(2)
+    pool = make_pool([a, b], health_interval=60)
+    try:
+        now = time.time()
+        pool.endpoints[0].ejected_until = now + 30
+        pool.endpoints[1].ejected_until = now + 10
+        assert pool.call(synthesize()) == b.port
+    finally:
+        pool.stop_health_checks()
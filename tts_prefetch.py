@@ -0,0 +1,117 @@
+"""TTS đoán trước (speculative prefetch) cho GUI: tổng hợp giọng đọc ngay khi đã có kịch bản + giọng + tốc độ,
+trong lúc người dùng còn chọn ảnh/font/màu (những thứ không ảnh hưởng tới audio).
+
+Chạy trên event loop riêng trong một thread nền. Đổi kịch bản/giọng/tốc độ thì hủy lượt đang chạy và bắt đầu lại.
+Kết quả đến tay render_shard theo hai đường:
+  - Có kho artifact (artifact_store): mỗi câu được ghi vào kho như TTS của render; render gặp câu đang
+    tổng hợp dở thì chờ khóa của kho rồi dùng lại.
+  - Kho bị tắt: từng câu được đăng ký trong video_worker (register_tts_prefetch), render chờ đúng future đó.
+Tắt bằng RENDER_TTS_PREFETCH=0.
+"""
+import os
+import asyncio
+import threading
+import concurrent.futures
+
+from video_worker import (
+    _synthesize_tts_cached, _sentence_key, _tts_duration_cache, register_tts_prefetch, clear_tts_prefetch
+)
+from voicevox_pool import get_voicevox_pool
+from artifact_store import get_artifact_store
+from render_cancel import CancelToken, RenderCancelled
+
+EDGE_TTS_CONCURRENCY = 4
+
+
+def prefetch_enabled():
+    return os.environ.get("RENDER_TTS_PREFETCH", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+class TtsPrefetcher:
+    def __init__(self, on_progress=None):
+        self.on_progress = on_progress   # on_progress(đã xong, tổng) gọi từ thread nền
+        self._loop = None
+        self._params = None
+        self._token = None
+        self._future = None
+        self._lock = threading.Lock()
+        self.done = 0
+        self.total = 0
+
+    def _ensure_loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name="tts-prefetch", daemon=True).start()
+
+    def update(self, sentences, voice, voice_speed=1.0, voice_source="Voicevox"):
+        """Bắt đầu (hoặc giữ nguyên nếu tham số không đổi) lượt TTS trước cho kịch bản hiện tại."""
+        keys = list(dict.fromkeys(k for k in (_sentence_key(s) for s in sentences) if k))
+        params = (tuple(keys), voice, voice_speed, voice_source)
+        with self._lock:
+            if params == self._params:
+                return
+            self._stop_locked()
+            if not keys or voice is None:
+                return
+            self._params = params
+            self._token = CancelToken()
+            self.done, self.total = 0, len(keys)
+            self._ensure_loop()
+            self._future = asyncio.run_coroutine_threadsafe(
+                self._run(keys, voice, voice_speed, voice_source, self._token), self._loop
+            )
+        print(f"[DEBUG] TTS trước: {len(keys)} câu ({voice_source} {voice}, tốc độ {voice_speed})")
+
+    def stop(self):
+        with self._lock:
+            self._stop_locked()
+
+    def _stop_locked(self):
+        if self._token is not None:
+            self._token.cancel()
+        self._params = self._token = self._future = None
+        clear_tts_prefetch()
+
+    async def _run(self, keys, voice, voice_speed, voice_source, token):
+        token.bind_current_task()
+        if voice_source.lower() == "edge-tts":
+            concurrency = EDGE_TTS_CONCURRENCY
+        else:
+            # Mỗi engine Voicevox một request: engine luôn bận mà không giành CPU của các engine khác
+            concurrency = max(1, len(get_voicevox_pool().endpoints))
+        sem = asyncio.Semaphore(concurrency)
+        use_store = get_artifact_store() is not None
+        handoff = {}
+        if not use_store:
+            for key in keys:
+                handoff[key] = concurrent.futures.Future()
+                register_tts_prefetch((voice_source, voice, voice_speed, key), handoff[key])
+
+        async def one(key):
+            result = None
+            try:
+                async with sem:
+                    token.raise_if_cancelled()
+                    result = await _synthesize_tts_cached(key, voice, voice_speed, voice_source, token)
+                if result is not None:
+                    # Độ dài thật cho dự toán và thứ tự "câu dài trước" của render
+                    _tts_duration_cache[(voice_source, voice, voice_speed, key)] = result[1]
+            finally:
+                if key in handoff and not handoff[key].done():
+                    if token.cancelled:
+                        handoff[key].cancel()
+                    else:
+                        handoff[key].set_result(result)
+            if token is not self._token:
+                return   # lượt cũ đã bị thay bằng lượt mới
+            self.done += 1
+            if self.on_progress is not None:
+                self.on_progress(self.done, self.total)
+
+        try:
+            await asyncio.gather(*(one(key) for key in keys), return_exceptions=True)
+        except (RenderCancelled, asyncio.CancelledError):
+            pass
+        finally:
+            for fut in handoff.values():
+                fut.cancel()
@@ -5,9 +5,33 @@ import tempfile
 import re
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import requests
 import json
+from voicevox_pool import get_voicevox_pool
+from scratch_space import ScratchSpace
+from render_progress import report_progress
+from ken_burns import MOTION_EFFECTS, ken_burns_frames
+from frame_compositor import (
+    clip_frame_count, load_background, clip_frames, subtitle_image, wav_format, wav_pcm, fit_pcm,
+    segment_times, assign_to_workers, DEFAULT_PCM_RATE, DEFAULT_PCM_CHANNELS
+)
+from memory_budget import get_memory_budget, estimate_clip_memory
+from artifact_store import get_artifact_store
+from render_cancel import CancelToken, RenderCancelled, process_group_kwargs, kill_process_tree
+from render_profiler import get_active_profiler, profile_stage, profile_call
+from subtitle_renderer import (
+    load_font, subtitle_layout, render_subtitle_image, render_subtitle_rgba,
+    get_subtitle_pool, reset_subtitle_pool
+)
+from concurrent.futures.process import BrokenProcessPool
+import math
+import time
+import functools
+import shutil
+import io
+import wave
+import threading
 
 # Thiết lập BASE_DIR để luôn đúng cả khi chạy bằng PyInstaller (đã đóng gói .exe)
 if getattr(sys, 'frozen', False):
@@ -25,13 +49,22 @@ else:
     CREATE_NO_WINDOW = 0
 
 output_temp_dir = tempfile.gettempdir()
+
+# Chế độ nháp: độ phân giải/fps thấp + preset nhanh nhất, chỉ để kiểm tra font/màu/hiệu ứng
+DRAFT_SETTINGS = {"width": 640, "height": 360, "fps": 12, "preset": "ultrafast"}
 executor = ThreadPoolExecutor(max_workers=min(24, os.cpu_count()))
 
 def get_ffmpeg_path():
-    return os.path.join(BASE_DIR, "ffmpeg", "ffmpeg.exe")
+    ffmpeg_path = os.path.join(BASE_DIR, "ffmpeg", "ffmpeg.exe")
+    if not os.path.exists(ffmpeg_path):
+        # Máy render Linux không có bản ffmpeg.exe đóng gói -> dùng ffmpeg trong PATH
+        ffmpeg_path = shutil.which("ffmpeg") or ffmpeg_path
+    return ffmpeg_path
 
 def get_ffprobe_path():
     ffprobe_path = os.path.join(BASE_DIR, "ffmpeg", "ffprobe.exe")
+    if not os.path.exists(ffprobe_path):
+        ffprobe_path = shutil.which("ffprobe") or ffprobe_path
     if not os.path.exists(ffprobe_path):
         print(f"[⚠️] Cảnh báo: Không tìm thấy ffprobe.exe tại {ffprobe_path}. Media info có thể không chính xác.")
         return None
@@ -43,59 +76,167 @@ def normalize_path_for_ffmpeg(path):
 def split_sentences(text):
     return [s.strip() for s in re.split(r'[\u3002\uFF0E.!?\n]', text) if s.strip()]
 
-def wrap_text(draw, text, font, max_width):
-    lines = []
-    line = ''
-    for ch in text:
-        test_line = line + ch
-        if draw.textlength(test_line, font=font) <= max_width:
-            line = test_line
-        else:
-            lines.append(line)
-            line = ch
-    if line:
-        lines.append(line)
-    return lines
-
-async def generate_voicevox_audio(sentence, speaker_id, output_path, rate=1.0):
-    VOICEVOX_API_BASE = "http://127.0.0.1:50021"
+def _parse_bitrate(value):
+    value = str(value).strip().lower()
+    units = {"k": 1000, "m": 1000 * 1000}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+def parse_renditions(spec):
+    """Đọc danh sách rendition dạng "1080p=1920x1080@6M,720p=1280x720@3M,doc=720x1280@2M".
+    Rendition đầu tiên là bản chính (giữ nguyên tên file), các bản khác thêm hậu tố _<tên>.
+    Rendition dọc (cao > rộng) được cắt giữa khung hình theo đúng tỉ lệ rồi scale."""
+    renditions = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, rest = item.partition("=")
+        size, _, bitrate = rest.partition("@")
+        w, _, h = size.lower().partition("x")
+        try:
+            rendition = {
+                "name": name.strip(),
+                "width": int(w) // 2 * 2,
+                "height": int(h) // 2 * 2,
+                "bitrate": _parse_bitrate(bitrate) if bitrate.strip() else None,
+            }
+        except ValueError:
+            raise ValueError(f"Rendition không hợp lệ: '{item}' (dạng đúng: tên=RỘNGxCAO@bitrate)")
+        if not rendition["name"]:
+            raise ValueError(f"Rendition thiếu tên: '{item}'")
+        renditions.append(rendition)
+    return renditions
+
+def composite_size_for(renditions, default=(1280, 720)):
+    """Kích thước khung ghép chung: bằng rendition ngang lớn nhất, các rendition khác scale/cắt từ đó."""
+    landscape = [r for r in renditions or [] if r["width"] >= r["height"]]
+    if not landscape:
+        return default
+    best = max(landscape, key=lambda r: r["width"] * r["height"])
+    return best["width"], best["height"]
+
+def rendition_path(path, rendition_name, renditions):
+    """Đường dẫn file của một rendition: bản chính giữ nguyên path, bản khác thêm _<tên>."""
+    if not renditions or renditions[0]["name"] == rendition_name:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}_{rendition_name}{ext}"
+
+def _rendition_crop(rendition, base_w, base_h):
+    # Cắt giữa khung ghép theo tỉ lệ của rendition (ví dụ 9:16) trước khi scale
+    target_ratio = rendition["width"] / rendition["height"]
+    crop_w = min(base_w, int(round(base_h * target_ratio)))
+    crop_h = min(base_h, int(round(base_w / target_ratio)))
+    return crop_w // 2 * 2, crop_h // 2 * 2
+
+def _build_outputs(renditions, temp_out, base_w, base_h, encoder_args):
+    """Trả về (filter bổ sung, tham số output). Không có rendition thì giữ một output [v]/[a] như cũ."""
+    if not renditions:
+        return "", ['-map', '[v]', '-map', '[a]'] + encoder_args + [normalize_path_for_ffmpeg(temp_out)]
+
+    n = len(renditions)
+    extra_filter = ";[v]split=" + str(n) + "".join(f"[rv{k}]" for k in range(n))
+    extra_filter += ";[a]asplit=" + str(n) + "".join(f"[ra{k}]" for k in range(n))
+    output_args = []
+    for k, r in enumerate(renditions):
+        crop_w, crop_h = _rendition_crop(r, base_w, base_h)
+        chain = []
+        if (crop_w, crop_h) != (base_w, base_h):
+            chain.append(f"crop={crop_w}:{crop_h}")
+        if (r["width"], r["height"]) != (crop_w, crop_h):
+            chain.append(f"scale={r['width']}:{r['height']}")
+        chain.append("setsar=1")
+        extra_filter += f";[rv{k}]{','.join(chain)}[ov{k}]"
+        output_args += ['-map', f'[ov{k}]', '-map', f'[ra{k}]'] + encoder_args
+        if r.get("bitrate"):
+            output_args += ['-b:v', str(r["bitrate"]), '-maxrate', str(r["bitrate"]), '-bufsize', str(r["bitrate"] * 2)]
+        output_args.append(normalize_path_for_ffmpeg(rendition_path(temp_out, r["name"], renditions)))
+    return extra_filter, output_args
+
+def sample_sentences(sentences, first_n=None, every_k=None):
+    """Lấy mẫu câu cho bản nháp: mỗi every_k câu lấy một câu, tối đa first_n câu.
+    Trả về [(chỉ số gốc, câu), ...] để giữ đúng ảnh/video nền như khi render đầy đủ."""
+    step = max(1, int(every_k or 1))
+    picked = [(i, s) for i, s in enumerate(sentences) if i % step == 0]
+    if first_n:
+        picked = picked[:int(first_n)]
+    return picked
+
+def split_into_shards(sentences, num_shards):
+    """Chia danh sách câu thành các shard liên tiếp: [(shard_id, offset_in_all, texts), ...]."""
+    if not sentences:
+        return []
+    num_shards = max(1, num_shards or 1)
+    shard_size = math.ceil(len(sentences) / num_shards)
+    shards = []
+    offset = 0
+    for i in range(num_shards):
+        part_texts = sentences[i * shard_size:(i + 1) * shard_size]
+        if not part_texts:
+            continue
+        shards.append((i, offset, part_texts))
+        offset += len(part_texts)
+    return shards
+
+async def synthesize_voicevox_bytes(sentence, speaker_id, rate=1.0, cancel_token=None):
+    """Gọi Voicevox (qua pool engine), trả về dữ liệu WAV hoặc None nếu lỗi.
+    Khi bị hủy: không gửi thêm request nào và trả quyền ngay (request đang chạy bị bỏ kết quả)."""
+    pool = get_voicevox_pool()
     try:
         query_params = {
             "text": sentence,
             "speaker": speaker_id,
             "speedScale": rate
         }
-        query_response = await asyncio.to_thread(
-            lambda: requests.post(f"{VOICEVOX_API_BASE}/audio_query", params=query_params, timeout=30)
-        )
-        query_response.raise_for_status()
-        audio_query = query_response.json()
-
         synthesis_params = {
             "speaker": speaker_id
         }
-        audio_response = await asyncio.to_thread(
-            lambda: requests.post(f"{VOICEVOX_API_BASE}/synthesis", params=synthesis_params, json=audio_query, timeout=60)
-        )
-        audio_response.raise_for_status()
 
-        with open(output_path, "wb") as f:
-            f.write(audio_response.content)
-        return True
+        def synthesize(api_base):
+            # audio_query và synthesis chạy trên cùng một engine
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            query_response = requests.post(f"{api_base}/audio_query", params=query_params, timeout=30)
+            query_response.raise_for_status()
+            audio_query = query_response.json()
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            audio_response = requests.post(f"{api_base}/synthesis", params=synthesis_params, json=audio_query, timeout=60)
+            audio_response.raise_for_status()
+            return audio_response
+
+        audio_response = await asyncio.to_thread(pool.call, synthesize)
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        return audio_response.content
+    except RenderCancelled:
+        raise
     except requests.exceptions.ConnectionError:
-        print("❌ Voicevox Engine connection error. Make sure Voicevox Engine is running at http://127.0.0.1:50021 and not blocked by firewall.")
-        return False
+        endpoints = ", ".join(ep.url for ep in pool.endpoints)
+        print(f"❌ Voicevox Engine connection error. Make sure Voicevox Engine is running at {endpoints} and not blocked by firewall.")
+        return None
     except requests.exceptions.Timeout:
         print(f"❌ Timeout calling Voicevox API for: {sentence[:30]}...")
-        return False
+        return None
     except requests.exceptions.RequestException as e:
         print(f"❌ Voicevox API error for: {sentence[:30]}... => {str(e)}")
-        return False
+        return None
     except Exception as e:
         print(f"❌ Unknown error generating Voicevox audio for: {sentence[:30]}... => {str(e)}")
+        return None
+
+async def generate_voicevox_audio(sentence, speaker_id, output_path, rate=1.0, cancel_token=None):
+    data = await synthesize_voicevox_bytes(sentence, speaker_id, rate, cancel_token=cancel_token)
+    if data is None:
         return False
+    with open(output_path, "wb") as f:
+        f.write(data)
+    return True
 
-async def generate_edge_tts_audio(sentence, speaker_id, output_path, rate=1.0):
+async def synthesize_edge_tts_bytes(sentence, speaker_id, rate=1.0, cancel_token=None):
+    """Gọi edge-tts, trả về dữ liệu MP3 hoặc None nếu lỗi."""
     try:
         import edge_tts
         percent = int(round((rate - 1) * 100))
@@ -104,28 +245,55 @@ async def generate_edge_tts_audio(sentence, speaker_id, output_path, rate=1.0):
         else:
             rate_str = f"{percent}%"
         communicate = edge_tts.Communicate(text=sentence, voice=speaker_id, rate=rate_str)
-        await communicate.save(output_path)
-        if not os.path.exists(output_path) or os.path.getsize(output_path) < 1024:
-            print(f"❌ edge-tts tạo file audio lỗi hoặc rỗng: {output_path}")
-            return False
-        return True
+        chunks = []
+        async for chunk in communicate.stream():
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            if chunk.get("type") == "audio":
+                chunks.append(chunk["data"])
+        data = b"".join(chunks)
+        if len(data) < 1024:
+            print(f"❌ edge-tts tạo audio lỗi hoặc rỗng cho: {sentence[:30]}...")
+            return None
+        return data
+    except RenderCancelled:
+        raise
     except ImportError:
         print("❌ Chưa cài đặt edge-tts. Cài đặt với: pip install edge-tts")
-        return False
+        return None
     except Exception as e:
         print(f"❌ edge-tts error: {e}")
+        return None
+
+async def generate_edge_tts_audio(sentence, speaker_id, output_path, rate=1.0, cancel_token=None):
+    data = await synthesize_edge_tts_bytes(sentence, speaker_id, rate, cancel_token=cancel_token)
+    if data is None:
         return False
+    with open(output_path, "wb") as f:
+        f.write(data)
+    return True
 
-async def generate_tts_audio(sentence, speaker_id, output_path, rate=1.0, voice_source="Voicevox"):
+async def synthesize_tts_bytes(sentence, speaker_id, rate=1.0, voice_source="Voicevox", cancel_token=None):
     if voice_source.lower() == "edge-tts":
-        return await generate_edge_tts_audio(sentence, speaker_id, output_path, rate)
+        return await synthesize_edge_tts_bytes(sentence, speaker_id, rate, cancel_token=cancel_token)
     else:
-        return await generate_voicevox_audio(sentence, speaker_id, output_path, rate)
+        return await synthesize_voicevox_bytes(sentence, speaker_id, rate, cancel_token=cancel_token)
+
+async def generate_tts_audio(sentence, speaker_id, output_path, rate=1.0, voice_source="Voicevox", cancel_token=None):
+    if voice_source.lower() == "edge-tts":
+        return await generate_edge_tts_audio(sentence, speaker_id, output_path, rate, cancel_token=cancel_token)
+    else:
+        return await generate_voicevox_audio(sentence, speaker_id, output_path, rate, cancel_token=cancel_token)
 
 def get_audio_duration(path):
+    duration = probe_duration(path)
+    return 5.0 if duration is None else duration
+
+def probe_duration(path):
+    """Độ dài (giây) của file audio/video theo ffprobe, None nếu không đo được."""
     ffprobe_path = get_ffprobe_path()
     if ffprobe_path is None:
-        return 5.0
+        return None
 
     si = None
     if sys.platform == "win32":
@@ -146,50 +314,444 @@ def get_audio_duration(path):
         return duration
     except (subprocess.CalledProcessError, ValueError) as e:
         print(f"❌ Error getting audio duration for {path}: {e}")
-        return 5.0
+        return None
     except Exception as e:
         print(f"❌ Unknown error getting audio duration for {path}: {e}")
+        return None
+
+AUDIO_FD_PLACEHOLDER = "{audio_fd}"
+SUBTITLE_FD_PLACEHOLDER = "{subtitle_fd}"
+
+def get_audio_duration_from_bytes(data):
+    """Độ dài audio (giây) từ dữ liệu trong bộ nhớ: WAV đọc header, định dạng khác hỏi ffprobe qua stdin."""
+    try:
+        with wave.open(io.BytesIO(data), "rb") as w:
+            return w.getnframes() / float(w.getframerate())
+    except (wave.Error, EOFError):
+        pass
+    ffprobe_path = get_ffprobe_path()
+    if ffprobe_path is None:
+        return 5.0
+    si = None
+    if sys.platform == "win32":
+        si = subprocess.STARTUPINFO()
+        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        si.wShowWindow = subprocess.SW_HIDE
+    try:
+        cmd = [
+            ffprobe_path, '-v', 'error', '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1', 'pipe:0'
+        ]
+        result = subprocess.run(cmd, input=data, capture_output=True, check=True, startupinfo=si)
+        return float(result.stdout.decode().strip())
+    except (subprocess.CalledProcessError, ValueError) as e:
+        print(f"❌ Error getting audio duration from memory: {e}")
         return 5.0
 
+def decode_pcm_from_bytes(data, rate, channels):
+    """Giải mã audio bất kỳ (ví dụ mp3 của edge-tts) thành PCM s16le rate Hz / channels kênh; None nếu lỗi."""
+    si = None
+    if sys.platform == "win32":
+        si = subprocess.STARTUPINFO()
+        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        si.wShowWindow = subprocess.SW_HIDE
+    cmd = [get_ffmpeg_path(), '-v', 'error', '-i', 'pipe:0', '-f', 's16le', '-ar', str(rate), '-ac', str(channels), 'pipe:1']
+    try:
+        return subprocess.run(cmd, input=data, capture_output=True, check=True, startupinfo=si).stdout
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"❌ Error decoding audio to PCM: {e}")
+        return None
+
+def _feed_pipe(f, data):
+    """Ghi data (bytes hoặc iterable các bytes, ví dụ generator frame) vào pipe rồi đóng."""
+    try:
+        with f:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                f.write(data)
+            else:
+                for chunk in data:
+                    f.write(chunk)
+    except (BrokenPipeError, OSError, ValueError):
+        # ffmpeg đã thoát (lỗi, -shortest hoặc bị hủy) -> kết quả thật nằm ở returncode/stderr
+        pass
+    except Exception as e:
+        print(f"❌ Error producing pipe input for ffmpeg: {e}")
+
+def run_ffmpeg_blocking(cmd, si=None, stdin_data=None, fd_inputs=None, cancel_token=None, on_spawn=None):
+    """Chạy ffmpeg (blocking). stdin_data đi vào pipe:0; fd_inputs {placeholder: data} (POSIX) mỗi mục
+    đi vào một pipe riêng, placeholder trong cmd được thay bằng số fd. data là bytes hoặc iterable bytes
+    (được ghi trong thread riêng, không cần giữ hết trong RAM).
+    Lỗi ném CalledProcessError như subprocess.run(check=True).
+    cancel_token: process chạy trong nhóm riêng và bị giết cả nhóm khi token bị hủy (ném RenderCancelled).
+    on_spawn(proc): gọi ngay sau khi process khởi động (ví dụ MemorySlot.attach để đo RSS)."""
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    profiler = get_active_profiler()
+    if profiler is not None and os.path.splitext(os.path.basename(cmd[0]))[0] == "ffmpeg":
+        # chế độ profiling: ffmpeg in utime/stime/rtime/maxrss ra stderr khi kết thúc
+        cmd = [cmd[0], '-benchmark'] + list(cmd[1:])
+    pipes = []
+    for placeholder, data in (fd_inputs or {}).items():
+        read_fd, write_fd = os.pipe()
+        pipes.append((read_fd, write_fd, data))
+        cmd = [arg.replace(placeholder, str(read_fd)) for arg in cmd]
+    try:
+        proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=si,
+            pass_fds=tuple(read_fd for read_fd, _, _ in pipes),
+            **process_group_kwargs()
+        )
+    except Exception:
+        for read_fd, write_fd, _ in pipes:
+            os.close(read_fd)
+            os.close(write_fd)
+        raise
+    if on_spawn is not None:
+        on_spawn(proc)
+    writers = []
+    for read_fd, write_fd, data in pipes:
+        os.close(read_fd)
+        writers.append(threading.Thread(target=_feed_pipe, args=(os.fdopen(write_fd, "wb"), data), daemon=True))
+    if stdin_data is not None:
+        # communicate() chỉ đọc stdout/stderr, stdin do thread riêng ghi (hỗ trợ generator)
+        writers.append(threading.Thread(target=_feed_pipe, args=(proc.stdin, stdin_data), daemon=True))
+        proc.stdin = None
+    for writer in writers:
+        writer.start()
+    if cancel_token is not None:
+        cancel_token.register(proc)
+    try:
+        stdout, stderr = proc.communicate()
+    finally:
+        if cancel_token is not None:
+            cancel_token.unregister(proc)
+        if proc.poll() is None:
+            kill_process_tree(proc)
+    for writer in writers:
+        writer.join()
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    stdout = stdout.decode("utf-8", errors="replace")
+    stderr = stderr.decode("utf-8", errors="replace")
+    if profiler is not None:
+        profiler.record_ffmpeg(cmd, stderr, ok=not proc.returncode)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+async def run_cancellable(fn, *args, cancel_token=None, **kwargs):
+    """Chạy fn(*args, cancel_token=...) trong executor. Nếu task asyncio bị cancel
+    (hoặc cancel_token bị hủy) thì process con của riêng lệnh này bị giết ngay."""
+    token = cancel_token.child() if cancel_token is not None else CancelToken()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, functools.partial(fn, *args, cancel_token=token, **kwargs))
+    except asyncio.CancelledError:
+        token.cancel()
+        raise
+    finally:
+        token.close()
+
+async def run_ffmpeg(cmd, si=None, stdin_data=None, fd_inputs=None, cancel_token=None, on_spawn=None):
+    return await run_cancellable(run_ffmpeg_blocking, cmd, si, stdin_data, fd_inputs,
+                                 cancel_token=cancel_token, on_spawn=on_spawn)
+
+async def run_clip_ffmpeg(cmd, si, stdin_data, fd_inputs, cancel_token, memory_estimate, recorder=None):
+    """run_ffmpeg cho một clip, chỉ khởi chạy khi ngân sách RAM còn chỗ (xem memory_budget).
+    recorder (render_history.RunRecorder): ghi thời gian chờ RAM và thời gian encode."""
+    budget = get_memory_budget()
+    stage_started = time.monotonic()
+    slot = await budget.acquire(memory_estimate)
+    _record_stage(recorder, "memory_wait", stage_started)
+    stage_started = time.monotonic()
+    try:
+        return await run_ffmpeg(cmd, si, stdin_data, fd_inputs, cancel_token=cancel_token, on_spawn=slot.attach)
+    finally:
+        _record_stage(recorder, "encode", stage_started)
+        budget.release(slot)
+
+def _record_stage(recorder, stage, started):
+    if recorder is not None:
+        recorder.add_stage(stage, time.monotonic() - started)
+
+def output_bytes(path, renditions=None):
+    """Tổng dung lượng file đầu ra của mọi rendition (0 nếu chưa có)."""
+    total = 0
+    for r in renditions or [None]:
+        try:
+            total += os.path.getsize(rendition_path(path, r["name"] if r else None, renditions))
+        except OSError:
+            pass
+    return total
+
+def remove_partial_outputs(path, renditions=None):
+    """Xóa file đầu ra dở dang (mọi rendition) khi render bị hủy."""
+    if not path:
+        return
+    for r in renditions or [None]:
+        p = rendition_path(path, r["name"] if r else None, renditions)
+        try:
+            if os.path.exists(p):
+                os.remove(p)
+        except OSError:
+            pass
+
+def _write_scratch(scratch, name, data):
+    path = scratch.path_for(name, len(data)) if scratch else os.path.join(output_temp_dir, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    if scratch:
+        scratch.account(path)
+    return path
+
+def _sentence_key(sentence):
+    return sentence.lstrip('\ufeff\u200b').strip()
+
+CHARS_PER_SECOND = 7.0  # ước lượng tốc độ đọc tiếng Nhật khi chưa có TTS
+_tts_duration_cache = {}
+# (nguồn giọng, giọng, tốc độ, câu) -> concurrent.futures.Future của TTS đoán trước (tts_prefetch, khi tắt kho artifact)
+_tts_prefetched = {}
+_tts_prefetched_lock = threading.Lock()
+
+def register_tts_prefetch(key, future):
+    with _tts_prefetched_lock:
+        _tts_prefetched[key] = future
+
+def clear_tts_prefetch():
+    with _tts_prefetched_lock:
+        _tts_prefetched.clear()
+
+async def _take_prefetched_tts(key):
+    """(bytes, độ dài) từ TTS đoán trước của câu này (chờ nếu đang chạy); None nếu không có/bị hủy/lỗi."""
+    with _tts_prefetched_lock:
+        future = _tts_prefetched.get(key)
+    if future is None:
+        return None
+    try:
+        return await asyncio.shield(asyncio.wrap_future(future))
+    except asyncio.CancelledError:
+        if future.cancelled():
+            return None   # lượt đoán trước bị hủy (đổi giọng/tốc độ), không phải render bị hủy
+        raise
+
+def estimate_clip_seconds(sentence, voice, voice_speed=1.0, voice_source="Voicevox"):
+    """Độ dài clip dự kiến: lấy từ TTS đã đo trong phiên này, nếu chưa có thì ước lượng theo số ký tự."""
+    sentence = _sentence_key(sentence)
+    cached = _tts_duration_cache.get((voice_source, voice, voice_speed, sentence))
+    if cached is not None:
+        return cached
+    return len(sentence) / (CHARS_PER_SECOND * (voice_speed or 1.0))
+
+async def _await_subtitle(subtitle_future, sub_path, sentence, font_path, width, height, renditions,
+                          subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width, raw=False):
+    """Chờ ảnh phụ đề đã được vẽ sẵn trong process pool; nếu không có (hoặc pool lỗi) thì vẽ trong thread.
+    raw=True: trả về (rộng, cao, bytes RGBA) thay cho đường dẫn PNG."""
+    if subtitle_future is not None:
+        try:
+            return await subtitle_future
+        except BrokenProcessPool:
+            reset_subtitle_pool()
+        except Exception as e:
+            print(f"❌ Subtitle process error for: {sentence[:30]}... => {e}")
+    font_size, max_text_width, scale = subtitle_layout(width, height, renditions)
+    try:
+        if raw:
+            return await asyncio.to_thread(
+                render_subtitle_rgba, sentence, font_path, font_size, max_text_width, scale,
+                subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width
+            )
+        return await asyncio.to_thread(
+            render_subtitle_image, sub_path, sentence, font_path, font_size, max_text_width, scale,
+            subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width
+        )
+    except Exception as e:
+        print(f"❌ Subtitle render error for: {sentence[:30]}... => {e}")
+        return None
+
+def submit_subtitle_batch(jobs, font_path, width=1280, height=720, renditions=None,
+                          subtitle_color="#FFFF00", stroke_color="#000000", bg_color="#FFFFFF",
+                          bg_opacity=255, stroke_width=1, raw=False):
+    """Gửi cả lô phụ đề [(sub_path, sentence), ...] vào process pool trước khi encode.
+    Trả về {sub_path: asyncio.Future}; phải gọi trong event loop đang chạy.
+    raw=True: không ghi PNG, future trả về (rộng, cao, bytes RGBA) cho chế độ pipe."""
+    font_size, max_text_width, scale = subtitle_layout(width, height, renditions)
+    loop = asyncio.get_running_loop()
+    profiler = get_active_profiler()
+    try:
+        pool = get_subtitle_pool([(font_path, font_size)])
+        futures = {}
+        for sub_path, sentence in jobs:
+            sentence = sentence.lstrip('\ufeff\u200b').strip()
+            style_args = (font_path, font_size, max_text_width, scale,
+                          subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width)
+            if raw:
+                call = (render_subtitle_rgba, sentence) + style_args
+            else:
+                call = (render_subtitle_image, sub_path, sentence) + style_args
+            if profiler is None:
+                futures[sub_path] = loop.run_in_executor(pool, *call)
+            else:
+                # chế độ profiling: process con chạy dưới cProfile, số liệu gửi về cùng kết quả
+                futures[sub_path] = asyncio.ensure_future(
+                    _unwrap_profiled(loop.run_in_executor(pool, profile_call, *call), profiler)
+                )
+        return futures
+    except (BrokenProcessPool, OSError, RuntimeError) as e:
+        print(f"[⚠️] Không dùng được process pool cho phụ đề, vẽ trong thread: {e}")
+        reset_subtitle_pool()
+        return {}
+
+async def _unwrap_profiled(future, profiler):
+    result, stats = await future
+    profiler.record_subtitle_stats(stats)
+    return result
+
+async def _shared_call(cache, key, factory):
+    """Chạy factory() một lần cho mỗi key trong cache; các clip trùng câu chờ chung một kết quả."""
+    if cache is None:
+        return await factory()
+    task = cache.get(key)
+    if task is None:
+        task = cache[key] = asyncio.ensure_future(factory())
+    # shield: một clip bị hủy không kéo theo kết quả mà clip khác đang chờ
+    return await asyncio.shield(task)
+
+async def _tts_bytes_with_duration(sentence, voice, voice_speed, voice_source, cancel_token):
+    prefetched = await _take_prefetched_tts((voice_source, voice, voice_speed, sentence)) if _tts_prefetched else None
+    if prefetched is not None:
+        return prefetched
+    return await _synthesize_tts_cached(sentence, voice, voice_speed, voice_source, cancel_token)
+
+async def _synthesize_tts_cached(sentence, voice, voice_speed, voice_source, cancel_token):
+    """TTS qua kho artifact (nếu bật): (bytes, độ dài) hoặc None nếu lỗi."""
+    store = get_artifact_store()
+    if store is None:
+        audio_bytes = await synthesize_tts_bytes(sentence, voice, voice_speed, voice_source=voice_source,
+                                                 cancel_token=cancel_token)
+        if not audio_bytes:
+            return None
+        return audio_bytes, await asyncio.to_thread(get_audio_duration_from_bytes, audio_bytes)
+    # Kho artifact: job khác (kể cả process khác) đang TTS cùng câu thì chờ rồi dùng lại kết quả
+    async with store.entry(store.key_for("tts", voice_source, voice, voice_speed, sentence), cancel_token) as entry:
+        if entry.exists:
+            return await asyncio.to_thread(entry.read_bytes, "audio"), entry.meta["duration"]
+        audio_bytes = await synthesize_tts_bytes(sentence, voice, voice_speed, voice_source=voice_source,
+                                                 cancel_token=cancel_token)
+        if not audio_bytes:
+            return None
+        duration = await asyncio.to_thread(get_audio_duration_from_bytes, audio_bytes)
+        try:
+            await asyncio.to_thread(entry.put, {"audio": audio_bytes}, {"duration": duration})
+        except OSError as e:
+            print(f"[⚠️] Không ghi được TTS vào kho artifact: {e}")
+        return audio_bytes, duration
+
+async def _tts_file_with_duration(sentence, voice, audio_path, voice_speed, voice_source, cancel_token):
+    if get_artifact_store() is not None or (voice_source, voice, voice_speed, sentence) in _tts_prefetched:
+        tts = await _tts_bytes_with_duration(sentence, voice, voice_speed, voice_source, cancel_token)
+        if tts is None:
+            return None
+        with open(audio_path, "wb") as f:
+            f.write(tts[0])
+        return audio_path, tts[1]
+    success = await generate_tts_audio(sentence, voice, audio_path, voice_speed, voice_source=voice_source,
+                                       cancel_token=cancel_token)
+    if not success or not os.path.exists(audio_path):
+        return None
+    return audio_path, get_audio_duration(audio_path)
+
 async def render_sentence(
     index, sentence, voice, img_or_video, font, draw, ffmpeg_path,
     font_path, subtitle_color, stroke_color, bg_color, effect, encoder,
     volume_factor, bg_opacity, voice_speed, stroke_width, sem,
     video_speed=1.0, is_video_input=False, voice_source="Voicevox",
-    effects_dir=None, overlay_effect="none" # thêm overlay_effect
+    effects_dir=None, overlay_effect="none", # thêm overlay_effect
+    width=1280, height=720, fps=25, preset="fast", renditions=None,
+    subtitle_future=None, use_pipes=False, scratch=None, cancel_token=None, progress_queue=None,
+    shared_tts=None, recorder=None
 ):
+    """Render một câu thành clip. use_pipes=True: TTS và phụ đề RGBA đi thẳng vào ffmpeg qua pipe
+    (không ghi line_*.mp3 / subtitle_*.png); scratch (ScratchSpace) quyết định nơi ghi temp_*.mp4.
+    cancel_token: hủy thì giết ffmpeg đang chạy, xóa clip dở dang và ném RenderCancelled.
+    shared_tts: dict dùng chung giữa các clip của một lần render để câu trùng chỉ gọi TTS một lần.
+    recorder (render_history.RunRecorder): ghi thời gian từng giai đoạn (tts/subtitle/encode) cho lịch sử render."""
     async with sem:
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
         sentence = sentence.lstrip('\ufeff\u200b').strip()
-        audio_path = os.path.join(output_temp_dir, f"line_{index}.mp3")
+        scale = height / 720.0
+        stdin_data = None
+        fd_inputs = {}
 
-        success = await generate_tts_audio(sentence, voice, audio_path, voice_speed, voice_source=voice_source)
-        if not success or not os.path.exists(audio_path):
-            print(f"[⚠️] Skipping sentence (audio error or not found): {sentence[:30]}...")
-            return None
+        if use_pipes:
+            stage_started = time.monotonic()
+            tts = await _shared_call(shared_tts, sentence, lambda: _tts_bytes_with_duration(
+                sentence, voice, voice_speed, voice_source, cancel_token
+            ))
+            _record_stage(recorder, "tts", stage_started)
+            if tts is None:
+                print(f"[⚠️] Skipping sentence (audio error): {sentence[:30]}...")
+                return None
+            audio_bytes, duration = tts
+            stage_started = time.monotonic()
+            subtitle = await _await_subtitle(
+                subtitle_future, None, sentence, font_path, width, height, renditions,
+                subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width, raw=True
+            )
+            _record_stage(recorder, "subtitle", stage_started)
+            if subtitle is None:
+                print(f"[⚠️] Skipping sentence (subtitle error): {sentence[:30]}...")
+                return None
+            sub_w, sub_h, sub_rgba = subtitle
+            raw_sub_args = ['-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{sub_w}x{sub_h}', '-i']
+            # stdin (pipe:0) để dành cho frame Ken Burns; audio/phụ đề đi qua pipe riêng
+            if sys.platform == "win32":
+                # Windows không truyền thêm fd cho process con được -> đi qua thư mục tạm (RAM nếu có)
+                audio_path = _write_scratch(scratch, f"line_{index}.audio", audio_bytes)
+                sub_raw_path = _write_scratch(scratch, f"subtitle_{index}.rgba", sub_rgba)
+                audio_input = ['-i', normalize_path_for_ffmpeg(audio_path)]
+                sub_input = raw_sub_args + [normalize_path_for_ffmpeg(sub_raw_path)]
+            else:
+                fd_inputs[AUDIO_FD_PLACEHOLDER] = audio_bytes
+                fd_inputs[SUBTITLE_FD_PLACEHOLDER] = sub_rgba
+                audio_input = ['-i', f'pipe:{AUDIO_FD_PLACEHOLDER}']
+                sub_input = raw_sub_args + [f'pipe:{SUBTITLE_FD_PLACEHOLDER}']
+            bitrate_total = sum(r.get("bitrate") or 4000000 for r in renditions) if renditions else 4000000
+            expected_size = int(duration * bitrate_total / 8 * 1.2) + 256 * 1024
+            temp_out = (scratch.path_for(f"temp_{index}.mp4", expected_size) if scratch
+                        else os.path.join(output_temp_dir, f"temp_{index}.mp4"))
+        else:
+            audio_path = os.path.join(output_temp_dir, f"line_{index}.mp3")
+
+            # Câu trùng trong cùng lần render dùng chung file audio của lần đầu tiên
+            stage_started = time.monotonic()
+            tts = await _shared_call(shared_tts, sentence, lambda: _tts_file_with_duration(
+                sentence, voice, audio_path, voice_speed, voice_source, cancel_token
+            ))
+            _record_stage(recorder, "tts", stage_started)
+            if tts is None:
+                print(f"[⚠️] Skipping sentence (audio error or not found): {sentence[:30]}...")
+                return None
+            audio_path, duration = tts
+            sub_path = os.path.join(output_temp_dir, f"subtitle_{index}.png")
+            stage_started = time.monotonic()
+            sub_path = await _await_subtitle(
+                subtitle_future, sub_path, sentence, font_path, width, height, renditions,
+                subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width
+            )
+            _record_stage(recorder, "subtitle", stage_started)
+            if sub_path is None:
+                print(f"[⚠️] Skipping sentence (subtitle error): {sentence[:30]}...")
+                return None
+            audio_input = ['-i', normalize_path_for_ffmpeg(audio_path)]
+            sub_input = ['-i', normalize_path_for_ffmpeg(sub_path)]
+            temp_out = os.path.join(output_temp_dir, f"temp_{index}.mp4")
+        sub_margin = int(30 * scale)
+        _tts_duration_cache[(voice_source, voice, voice_speed, sentence)] = duration
+        report_progress(progress_queue, "duration", index, duration)
 
-        duration = get_audio_duration(audio_path)
-        wrapped = wrap_text(draw, sentence, font, max_width=1100)
-        line_heights = [draw.textbbox((0, 0), line, font=font)[3] for line in wrapped]
-        total_height = sum(line_heights) + (len(wrapped) - 1) * 10
-        max_line_width = max(draw.textlength(line, font=font) for line in wrapped)
-        sub_image_width = max(int(max_line_width) + 80, 200)
-        sub_image_height = max(total_height + 40, 80)
-
-        img_sub = Image.new("RGBA", (sub_image_width, sub_image_height), (0, 0, 0, 0))
-        draw_sub = ImageDraw.Draw(img_sub)
-        bg_rgb = Image.new("RGB", (1, 1), bg_color).getpixel((0, 0))
-        draw_sub.rectangle([(0, 0), img_sub.size], fill=(*bg_rgb, int(bg_opacity)))
-        y = 20
-        for line, h in zip(wrapped, line_heights):
-            x = (img_sub.size[0] - draw.textlength(line, font=font)) // 2
-            draw_sub.text((x, y), line, font=font, fill=subtitle_color,
-                          stroke_width=stroke_width, stroke_fill=stroke_color)
-            y += h + 10
-        sub_path = os.path.join(output_temp_dir, f"subtitle_{index}.png")
-        img_sub.save(sub_path)
-        temp_out = os.path.join(output_temp_dir, f"temp_{index}.mp4")
-
-        encoder_preset_option = ["-preset", "fast"]
+        encoder_preset_option = ["-preset", preset]
         if encoder in ["h264_nvenc", "h264_amf", "h264_qsv"]:
             encoder_preset_option = []
 
@@ -210,13 +772,10 @@ async def render_sentence(
         if is_video_input:
             norm_ffmpeg_path = get_ffmpeg_path()
             norm_video_path = normalize_path_for_ffmpeg(img_or_video)
-            norm_audio_path = normalize_path_for_ffmpeg(audio_path)
-            norm_sub_path = normalize_path_for_ffmpeg(sub_path)
-            norm_temp_out = normalize_path_for_ffmpeg(temp_out)
 
             vf_parts = [
-                "scale=1280:720:force_original_aspect_ratio=increase",
-                "crop=1280:720"
+                f"scale={width}:{height}:force_original_aspect_ratio=increase",
+                f"crop={width}:{height}"
             ]
             if abs(float(video_speed) - 1.0) > 0.01:
                 vf_parts.append(f"setpts=1/{video_speed}*PTS")
@@ -225,7 +784,7 @@ async def render_sentence(
             # Overlay hiệu ứng snow/sakura MOV nếu chọn
             filter_complex = ""
             inputs = [
-                norm_video_path, norm_audio_path, norm_sub_path
+                ['-i', norm_video_path], audio_input, sub_input
             ]
             map_video = "[v]"
             if overlay_effect in ["snow", "sakura"] and EFFECTS_DIR_LOCAL is not None:
@@ -233,10 +792,10 @@ async def render_sentence(
                 print(f"[DEBUG] overlay_mov: {overlay_mov}")  # Chèn debug ở đây
                 if os.path.exists(overlay_mov):
                     overlay_mov_ffmpeg = normalize_path_for_ffmpeg(overlay_mov)
-                    inputs.append(overlay_mov_ffmpeg)
+                    inputs.append(['-i', overlay_mov_ffmpeg])
                     filter_complex = (
                         f"[0:v]{vf_chain}[vbg];"
-                        f"[vbg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-30:enable='between(t,0,{duration:.2f})'[tmpv];"
+                        f"[vbg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-{sub_margin}:enable='between(t,0,{duration:.2f})'[tmpv];"
                         f"[tmpv][3:v]overlay=0:0:shortest=1[v];"
                         f"[1:a]volume={volume_factor}[a]"
                     )
@@ -245,33 +804,34 @@ async def render_sentence(
                     print(f"[⚠️] Không tìm thấy file hiệu ứng: {overlay_mov}")
                     filter_complex = (
                         f"[0:v]{vf_chain}[vbg];"
-                        f"[vbg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-30:enable='between(t,0,{duration:.2f})'[v];"
+                        f"[vbg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-{sub_margin}:enable='between(t,0,{duration:.2f})'[v];"
                         f"[1:a]volume={volume_factor}[a]"
                     )
             else:
                 filter_complex = (
                     f"[0:v]{vf_chain}[vbg];"
-                    f"[vbg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-30:enable='between(t,0,{duration:.2f})'[v];"
+                    f"[vbg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-{sub_margin}:enable='between(t,0,{duration:.2f})'[v];"
                     f"[1:a]volume={volume_factor}[a]"
                 )
 
             cmd = [norm_ffmpeg_path, '-y']
             for ip in inputs:
-                cmd.extend(['-i', ip])
-            cmd.extend([
-                '-filter_complex', filter_complex,
-                '-map', map_video, '-map', '[a]',
-                '-c:v', encoder, '-r', '25'
-            ])
-            cmd += encoder_preset_option + [
-                '-threads', str(os.cpu_count()), '-shortest', '-an', norm_temp_out
+                cmd.extend(ip)
+            encoder_args = ['-c:v', encoder, '-r', str(fps)] + encoder_preset_option + [
+                '-threads', str(os.cpu_count()), '-shortest', '-an'
             ]
+            extra_filter, output_args = _build_outputs(renditions, temp_out, width, height, encoder_args)
+            cmd.extend(['-filter_complex', filter_complex + extra_filter] + output_args)
             cmd = [arg for arg in cmd if arg]
 
+            memory_estimate = estimate_clip_memory(
+                width, height, video_input=True, overlay=len(inputs) > 3, renditions=renditions
+            )
             try:
-                result = await asyncio.get_event_loop().run_in_executor(
-                    executor, lambda: subprocess.run(cmd, check=True, capture_output=True, text=True, startupinfo=si)
-                )
+                result = await run_clip_ffmpeg(cmd, si, stdin_data, fd_inputs, cancel_token, memory_estimate, recorder)
+            except (RenderCancelled, asyncio.CancelledError):
+                remove_partial_outputs(temp_out, renditions)
+                raise
             except subprocess.CalledProcessError as e:
                 print(f"❌ FFmpeg error creating video clip {index}:\nCommand: {' '.join(e.cmd) if isinstance(e.cmd, list) else e.cmd}\nReturn Code: {e.returncode}\nSTDOUT:\n{e.stdout}\nSTDERR:\n{e.stderr}")
                 return None
@@ -279,44 +839,48 @@ async def render_sentence(
                 print(f"❌ Unknown error running FFmpeg for video clip {index}: {e}")
                 return None
             if os.path.exists(temp_out):
+                if scratch:
+                    scratch.account(temp_out)
+                if recorder is not None:
+                    recorder.add_clip(duration, output_bytes(temp_out, renditions),
+                                      tts_key=(voice_source, voice, voice_speed, sentence))
                 return temp_out
             return None
 
         # --- Xử lý ẢNH INPUT ---
         norm_ffmpeg_path = get_ffmpeg_path()
         norm_img_path = normalize_path_for_ffmpeg(img_or_video)
-        norm_audio_path = normalize_path_for_ffmpeg(audio_path)
-        norm_sub_path = normalize_path_for_ffmpeg(sub_path)
-        norm_temp_out = normalize_path_for_ffmpeg(temp_out)
 
-        fps = 25
-        num_frames = max(1, int(duration * fps))
+        # +1 frame dư: -shortest sẽ cắt theo audio
+        num_frames = max(1, int(math.ceil(duration * fps)) + 1)
 
-        # Hiệu ứng zoom/pan/zoom+pan chỉ thêm khi ảnh lớn hơn 1280x720
-        vf_parts = [
-            "scale=1280:720:force_original_aspect_ratio=increase",
-            "crop=1280:720"
-        ]
         try:
             with Image.open(img_or_video) as original_img:
                 img_width, img_height = original_img.size
         except Exception:
-            img_width, img_height = 1280, 720
-
-        if img_width > 1280 and img_height > 720:
-            if effect == "zoom":
-                vf_parts.append(f"zoompan=z='min(zoom+0.0007,1.3)':d={num_frames}:s=1280x720")
-            elif effect == "pan":
-                vf_parts.append(f"zoompan=z=1.0:x='if(eq(n,0),0,x+1)':y='if(eq(n,0),0,y+1)':d={num_frames}:s=1280x720")
-            elif effect == "zoom+pan":
-                vf_parts.append(f"zoompan=z='min(zoom+0.0007,1.3)':x='if(eq(n,0),iw/2,x+(iw-iw/zoom)/{num_frames}/4)':y='if(eq(n,0),ih/2,y+(ih-ih/zoom)/{num_frames}/4)':d={num_frames}:s=1280x720")
-        vf_parts.append("pad=1280:720:(ow-iw)/2:(oh-ih)/2")
-        vf_chain = ",".join(vf_parts)
+            img_width, img_height = width, height
+
+        # Hiệu ứng zoom/pan/zoom+pan chỉ thêm khi ảnh lớn hơn khung hình đầu ra.
+        # Frame được tạo sẵn bằng Pillow (ken_burns) và đưa vào ffmpeg dạng rawvideo qua stdin.
+        if effect in MOTION_EFFECTS and img_width > width and img_height > height:
+            stdin_data = ken_burns_frames(img_or_video, effect, width, height, num_frames, duration)
+            bg_input = [
+                '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}',
+                '-framerate', str(fps), '-i', 'pipe:0'
+            ]
+            vf_chain = "setsar=1"
+        else:
+            bg_input = ['-loop', '1', '-i', norm_img_path]
+            vf_chain = ",".join([
+                f"scale={width}:{height}:force_original_aspect_ratio=increase",
+                f"crop={width}:{height}",
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2"
+            ])
 
         # Áp dụng đồng thời hiệu ứng zoom/pan + overlay snow/sakura nếu chọn
         filter_complex = ""
         inputs = [
-            norm_img_path, norm_audio_path, norm_sub_path
+            bg_input, audio_input, sub_input
         ]
         map_video = "[v]"
         if overlay_effect in ["snow", "sakura"] and EFFECTS_DIR_LOCAL is not None:
@@ -324,10 +888,10 @@ async def render_sentence(
             print(f"[DEBUG] overlay_mov: {overlay_mov}")   # Chèn debug ở đây
             if os.path.exists(overlay_mov):
                 overlay_mov_ffmpeg = normalize_path_for_ffmpeg(overlay_mov)
-                inputs.append(overlay_mov_ffmpeg)
+                inputs.append(['-i', overlay_mov_ffmpeg])
                 filter_complex = (
                     f"[0:v]format=rgba,{vf_chain}[v_bg];"
-                    f"[v_bg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-30:enable='between(t,0,{duration:.2f})'[tmpv];"
+                    f"[v_bg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-{sub_margin}:enable='between(t,0,{duration:.2f})'[tmpv];"
                     f"[tmpv][3:v]overlay=0:0:shortest=1[v];"
                     f"[1:a]volume={volume_factor}[a]"
                 )
@@ -336,32 +900,36 @@ async def render_sentence(
                 print(f"[⚠️] Không tìm thấy file hiệu ứng: {overlay_mov}")
                 filter_complex = (
                     f"[0:v]format=rgba,{vf_chain}[v_bg];"
-                    f"[v_bg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-30:enable='between(t,0,{duration:.2f})'[v];"
+                    f"[v_bg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-{sub_margin}:enable='between(t,0,{duration:.2f})'[v];"
                     f"[1:a]volume={volume_factor}[a]"
                 )
         else:
             filter_complex = (
                 f"[0:v]format=rgba,{vf_chain}[v_bg];"
-                f"[v_bg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-30:enable='between(t,0,{duration:.2f})'[v];"
+                f"[v_bg][2:v]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)-{sub_margin}:enable='between(t,0,{duration:.2f})'[v];"
                 f"[1:a]volume={volume_factor}[a]"
             )
 
         cmd = [
-            norm_ffmpeg_path, '-y', '-loop', '1'
+            norm_ffmpeg_path, '-y'
         ]
         for ip in inputs:
-            cmd.extend(['-i', ip])
-        cmd.extend([
-            '-filter_complex', filter_complex,
-            '-map', map_video, '-map', '[a]', '-c:v', encoder, '-r', '25',
-        ] + encoder_preset_option + [
-            '-threads', str(os.cpu_count()), '-shortest', norm_temp_out
-        ])
+            cmd.extend(ip)
+        encoder_args = ['-c:v', encoder, '-r', str(fps)] + encoder_preset_option + [
+            '-threads', str(os.cpu_count()), '-shortest'
+        ]
+        extra_filter, output_args = _build_outputs(renditions, temp_out, width, height, encoder_args)
+        cmd.extend(['-filter_complex', filter_complex + extra_filter] + output_args)
         cmd = [arg.strip() for arg in cmd if arg.strip()]
+        memory_estimate = estimate_clip_memory(
+            width, height, src_size=(img_width, img_height), motion=stdin_data is not None,
+            overlay=len(inputs) > 3, renditions=renditions
+        )
         try:
-            result = await asyncio.get_event_loop().run_in_executor(
-                executor, lambda: subprocess.run(cmd, check=True, capture_output=True, text=True, startupinfo=si)
-            )
+            result = await run_clip_ffmpeg(cmd, si, stdin_data, fd_inputs, cancel_token, memory_estimate, recorder)
+        except (RenderCancelled, asyncio.CancelledError):
+            remove_partial_outputs(temp_out, renditions)
+            raise
         except subprocess.CalledProcessError as e:
             print(f"❌ FFmpeg error creating clip {index}:\nCommand: {' '.join(e.cmd) if isinstance(e.cmd, list) else e.cmd}\nReturn Code: {e.returncode}\nSTDOUT:\n{e.stdout}\nSTDERR:\n{e.stderr}")
             return None
@@ -369,9 +937,341 @@ async def render_sentence(
             print(f"❌ Unknown error running FFmpeg for clip {index}: {e}")
             return None
         if os.path.exists(temp_out):
+            if scratch:
+                scratch.account(temp_out)
+            if recorder is not None:
+                recorder.add_clip(duration, output_bytes(temp_out, renditions),
+                                  tts_key=(voice_source, voice, voice_speed, sentence))
             return temp_out
         return None
 
+ENGINES = ("ffmpeg", "compositor")
+SEGMENT_POLL_INTERVAL = 0.25   # giây: kiểm tra segment clip của engine compositor đã đóng chưa
+
+def default_engine():
+    """Engine render mặc định: biến môi trường RENDER_ENGINE ("ffmpeg" hoặc "compositor")."""
+    engine = os.environ.get("RENDER_ENGINE", "ffmpeg").strip().lower()
+    return engine if engine in ENGINES else "ffmpeg"
+
+async def render_worker_clips(
+    shard_id, worker_no, clips, voice, font_path, subtitle_color, stroke_color, bg_color, effect,
+    encoder, volume_factor, bg_opacity, voice_speed, stroke_width, sem, voice_source="Voicevox",
+    effects_dir=None, overlay_effect="none", width=1280, height=720, fps=25, preset="fast",
+    renditions=None, scratch=None, cancel_token=None, progress_queue=None, shared_tts=None, recorder=None
+):
+    """Engine "compositor": render các clip [(index, câu, ảnh nền, subtitle_future), ...] của một worker
+    bằng MỘT process ffmpeg. TTS + phụ đề của mọi clip được lấy trước (song song), frame được ghép bằng Python
+    (frame_compositor) rồi đẩy liên tục vào encoder cùng PCM; keyframe ép buộc ở ranh giới clip + muxer segment
+    tách ra từng temp_<index>.mp4 như engine ffmpeg. Trả về đường dẫn clip (None nếu lỗi) theo thứ tự clips.
+    Tự báo sự kiện "clip" cho từng clip: muxer segment đóng segment k trước khi mở segment k+1, nên clip k
+    được báo xong ngay khi segment k+1 xuất hiện thay vì chờ cả worker xong."""
+    results = [None] * len(clips)
+
+    async def prepare(index, sentence, subtitle_future):
+        sentence = _sentence_key(sentence)
+        stage_started = time.monotonic()
+        tts = await _shared_call(shared_tts, sentence, lambda: _tts_bytes_with_duration(
+            sentence, voice, voice_speed, voice_source, cancel_token
+        ))
+        _record_stage(recorder, "tts", stage_started)
+        if tts is None:
+            print(f"[⚠️] Skipping sentence (audio error): {sentence[:30]}...")
+            return None
+        stage_started = time.monotonic()
+        subtitle = await _await_subtitle(
+            subtitle_future, None, sentence, font_path, width, height, renditions,
+            subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width, raw=True
+        )
+        _record_stage(recorder, "subtitle", stage_started)
+        if subtitle is None:
+            print(f"[⚠️] Skipping sentence (subtitle error): {sentence[:30]}...")
+            return None
+        audio_bytes, duration = tts
+        _tts_duration_cache[(voice_source, voice, voice_speed, sentence)] = duration
+        report_progress(progress_queue, "duration", index, duration)
+        return sentence, audio_bytes, duration, subtitle_image(subtitle)
+
+    prepared = await asyncio.gather(*(prepare(index, sentence, fut) for index, sentence, _, fut in clips))
+    ok = [i for i, p in enumerate(prepared) if p is not None]
+    for i, p in enumerate(prepared):
+        if p is None:
+            report_progress(progress_queue, "clip", clips[i][0], False, time.monotonic())
+    if not ok:
+        return results
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+    frame_counts = [clip_frame_count(prepared[i][2], fps) for i in ok]
+    rate, channels = next(
+        (fmt for fmt in (wav_format(prepared[i][1]) for i in ok) if fmt), (DEFAULT_PCM_RATE, DEFAULT_PCM_CHANNELS)
+    )
+    scale = height / 720.0
+    sub_margin = int(30 * scale)
+    bitrate_total = sum(r.get("bitrate") or 4000000 for r in renditions) if renditions else 4000000
+    temp_outs = {}
+    for i in ok:
+        index, duration = clips[i][0], prepared[i][2]
+        expected_size = int(duration * bitrate_total / 8 * 1.2) + 256 * 1024
+        temp_outs[i] = (scratch.path_for(f"temp_{index}.mp4", expected_size) if scratch
+                        else os.path.join(output_temp_dir, f"temp_{index}.mp4"))
+    pattern = os.path.join(os.path.dirname(temp_outs[ok[0]]), f"compose_{shard_id}_{worker_no}_%04d.mp4")
+
+    def segment_paths():
+        return [rendition_path(pattern, r["name"] if r else None, renditions) % k
+                for r in renditions or [None] for k in range(len(ok))]
+
+    def remove_segments():
+        for path in segment_paths():
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def video_frames():
+        # Chạy trong thread ghi pipe: ảnh nền chỉ mở khi tới clip đó, giữ lại cho các clip liền sau cùng nền
+        backgrounds = {}
+        for k, i in enumerate(ok):
+            img_path = clips[i][2]
+            if img_path not in backgrounds:
+                backgrounds.clear()
+                try:
+                    backgrounds[img_path] = load_background(img_path, effect, width, height)
+                except OSError as e:
+                    print(f"❌ Cannot open background {img_path}: {e}")
+                    backgrounds[img_path] = ("still", Image.new("RGB", (width, height), (0, 0, 0)))
+            yield from clip_frames(backgrounds[img_path], effect, width, height, frame_counts[k],
+                                   prepared[i][2], prepared[i][3], sub_margin)
+
+    def audio_chunks():
+        for k, i in enumerate(ok):
+            audio_bytes = prepared[i][1]
+            if wav_format(audio_bytes) == (rate, channels):
+                pcm = wav_pcm(audio_bytes)
+            else:
+                pcm = decode_pcm_from_bytes(audio_bytes, rate, channels) or b""
+            yield fit_pcm(pcm, frame_counts[k], fps, rate, channels)
+
+    si = None
+    fd_inputs = {}
+    if sys.platform == "win32":
+        si = subprocess.STARTUPINFO()
+        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        si.wShowWindow = subprocess.SW_HIDE
+        # Windows không truyền thêm fd cho process con được -> PCM đi qua file tạm
+        audio_path = _write_scratch(scratch, f"compose_{shard_id}_{worker_no}.pcm", b"".join(audio_chunks()))
+        audio_input = normalize_path_for_ffmpeg(audio_path)
+    else:
+        fd_inputs[AUDIO_FD_PLACEHOLDER] = audio_chunks()
+        audio_input = f'pipe:{AUDIO_FD_PLACEHOLDER}'
+
+    cmd = [
+        get_ffmpeg_path(), '-y',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-framerate', str(fps), '-i', 'pipe:0',
+        '-f', 's16le', '-ar', str(rate), '-ac', str(channels), '-i', audio_input
+    ]
+    filter_complex = "[0:v]setsar=1,format=yuv420p[v]"
+    has_overlay = False
+    if overlay_effect in ["snow", "sakura"]:
+        overlay_mov = os.path.join(os.path.join(BASE_DIR, "effects") if effects_dir is None else effects_dir,
+                                   f"{overlay_effect}_alpha.mov")
+        if os.path.exists(overlay_mov):
+            # Hiệu ứng lặp liên tục suốt luồng của worker thay vì bắt đầu lại ở mỗi clip
+            cmd += ['-stream_loop', '-1', '-i', normalize_path_for_ffmpeg(overlay_mov)]
+            filter_complex = "[0:v][2:v]overlay=0:0:shortest=1,setsar=1,format=yuv420p[v]"
+            has_overlay = True
+        else:
+            print(f"[⚠️] Không tìm thấy file hiệu ứng: {overlay_mov}")
+    filter_complex += f";[1:a]volume={volume_factor}[a]"
+
+    encoder_preset_option = [] if encoder in ["h264_nvenc", "h264_amf", "h264_qsv"] else ["-preset", preset]
+    boundaries = segment_times(frame_counts, fps)
+    encoder_args = ['-c:v', encoder, '-r', str(fps)] + encoder_preset_option + ['-threads', str(os.cpu_count())]
+    if boundaries:
+        encoder_args += ['-force_key_frames', boundaries, '-f', 'segment', '-segment_times', boundaries]
+    else:
+        encoder_args += ['-f', 'segment', '-segment_time', str(10 ** 6)]
+    encoder_args += ['-segment_format', 'mp4', '-reset_timestamps', '1']
+    extra_filter, output_args = _build_outputs(renditions, pattern, width, height, encoder_args)
+    cmd += ['-filter_complex', filter_complex + extra_filter] + output_args
+
+    # Nguồn là frame RGB đúng kích thước đầu ra; ảnh nền (Ken Burns) nằm ở process Python
+    memory_estimate = estimate_clip_memory(
+        width, height, motion=effect in MOTION_EFFECTS, overlay=has_overlay, renditions=renditions
+    )
+    def segment_closed(k):
+        return all(os.path.exists(rendition_path(pattern, r["name"] if r else None, renditions) % k)
+                   for r in renditions or [None])
+
+    closed = []   # k của các segment đã đóng (đã báo "clip" xong)
+
+    def report_closed(k):
+        closed.append(k)
+        report_progress(progress_queue, "clip", clips[ok[k]][0], True, time.monotonic())
+
+    async def watch_segments():
+        while len(closed) < len(ok) - 1:
+            if segment_closed(len(closed) + 1):
+                report_closed(len(closed))
+                continue
+            await asyncio.sleep(SEGMENT_POLL_INTERVAL)
+
+    def collect(ks):
+        for k in ks:
+            i = ok[k]
+            for r in renditions or [None]:
+                name = r["name"] if r else None
+                shutil.move(rendition_path(pattern, name, renditions) % k, rendition_path(temp_outs[i], name, renditions))
+            if scratch:
+                scratch.account(temp_outs[i])
+            if recorder is not None:
+                recorder.add_clip(prepared[i][2], output_bytes(temp_outs[i], renditions),
+                                  tts_key=(voice_source, voice, voice_speed, prepared[i][0]))
+            results[i] = temp_outs[i]
+
+    def fail_rest():
+        # Segment đã đóng trước khi ffmpeg lỗi vẫn là clip hoàn chỉnh: giữ lại, phần còn lại báo lỗi
+        collect(list(closed))
+        remove_segments()
+        for k in range(len(closed), len(ok)):
+            report_progress(progress_queue, "clip", clips[ok[k]][0], False, time.monotonic())
+        return results
+
+    remove_segments()
+    async with sem:
+        watcher = asyncio.ensure_future(watch_segments())
+        try:
+            await run_clip_ffmpeg(cmd, si, video_frames(), fd_inputs, cancel_token, memory_estimate, recorder)
+        except (RenderCancelled, asyncio.CancelledError):
+            remove_segments()
+            raise
+        except subprocess.CalledProcessError as e:
+            print(f"❌ FFmpeg error in compositor worker {shard_id}/{worker_no}:\nCommand: {' '.join(e.cmd)}\nReturn Code: {e.returncode}\nSTDERR:\n{e.stderr}")
+            return fail_rest()
+        finally:
+            watcher.cancel()
+    if not all(os.path.exists(path) for path in segment_paths()):
+        print(f"❌ Compositor worker {shard_id}/{worker_no}: thiếu segment clip, bỏ qua {len(ok) - len(closed)} clip.")
+        return fail_rest()
+
+    for k in range(len(closed), len(ok)):
+        report_closed(k)
+    collect(range(len(ok)))
+    return results
+
+def build_clip_specs(shard_id, texts, image_or_video_paths, offset_in_all=0, global_indices=None):
+    """Danh sách clip của một shard: (index, câu, ảnh/video nền, chỉ số câu gốc).
+    Nền được xoay vòng theo chỉ số câu gốc nên bản nháp/shard luôn cùng nền với bản đầy đủ."""
+    num_files = len(image_or_video_paths)
+    clip_specs = []
+    global_sentence_idx = offset_in_all
+    for idx_text, text_block in enumerate(texts):
+        if global_indices is not None:
+            global_sentence_idx = global_indices[idx_text]
+        sentences_in_block = split_sentences(text_block)
+        for sentence_idx_in_block, sentence in enumerate(sentences_in_block):
+            if not sentence:
+                continue
+            file_index = global_sentence_idx % num_files
+            clip_specs.append((
+                f"{shard_id}_{idx_text}_{sentence_idx_in_block}", sentence,
+                image_or_video_paths[file_index], global_sentence_idx
+            ))
+            global_sentence_idx += 1
+    return clip_specs
+
+def find_reused_clips(clip_specs):
+    """{vị trí clip đại diện: [vị trí các clip trùng]}.
+    Câu trùng (cùng nội dung + cùng ảnh/video nền; giọng, kiểu chữ, hiệu ứng là chung cho cả shard)
+    chỉ render một lần, clip được dùng lại ở mọi vị trí. Trùng câu khác nền vẫn dùng chung TTS + phụ đề."""
+    first_of_clip = {}
+    reused_at = {}
+    for i, (_, sentence, file_path, _) in enumerate(clip_specs):
+        first = first_of_clip.setdefault((_sentence_key(sentence), file_path), i)
+        reused_at.setdefault(first, [])
+        if first != i:
+            reused_at[first].append(i)
+    return reused_at
+
+def _clip_artifact_keys(store, clip_specs, positions, font_path, effects_dir, overlay_effect, **settings):
+    """{vị trí clip: khóa artifact}: nội dung câu + file nền + font/overlay + mọi tham số ảnh hưởng tới clip."""
+    overlay_path = None
+    if overlay_effect in ("snow", "sakura"):
+        overlay_path = os.path.join(EFFECTS_DIR if effects_dir is None else effects_dir, f"{overlay_effect}_alpha.mov")
+    common = dict(settings, overlay_effect=overlay_effect, font=store.file_digest(font_path),
+                  overlay=store.file_digest(overlay_path))
+    return {
+        i: store.key_for("clip", common, _sentence_key(clip_specs[i][1]), store.file_digest(clip_specs[i][2]))
+        for i in positions
+    }
+
+def _clip_artifact_name(rendition_name, renditions):
+    return rendition_path("clip.mp4", rendition_name, renditions)
+
+def _materialize_clip(entry, index, duration_key, scratch, renditions):
+    """Copy clip (mọi rendition) từ kho ra chỗ render_sentence sẽ ghi temp_{index}.mp4.
+    Độ dài clip luôn có trong _tts_duration_cache sau khi gọi (entry cũ thiếu meta thì đo lại bằng ffprobe)."""
+    size = entry.meta.get("size", 0)
+    dest = (scratch.path_for(f"temp_{index}.mp4", size) if scratch
+            else os.path.join(output_temp_dir, f"temp_{index}.mp4"))
+    for r in renditions or [None]:
+        name = r["name"] if r else None
+        entry.materialize(_clip_artifact_name(name, renditions), rendition_path(dest, name, renditions))
+    if scratch:
+        scratch.account(dest)
+    duration = entry.meta.get("duration")
+    if duration is None:
+        duration = probe_duration(dest)
+    if duration is not None:
+        _tts_duration_cache[duration_key] = duration
+    return dest
+
+def _store_clip(entry, clip_path, duration_key, renditions):
+    duration = _tts_duration_cache.get(duration_key)
+    if duration is None:
+        duration = probe_duration(clip_path)
+        if duration is not None:
+            _tts_duration_cache[duration_key] = duration
+    try:
+        entry.put({
+            _clip_artifact_name(r["name"] if r else None, renditions): rendition_path(clip_path, r["name"] if r else None, renditions)
+            for r in renditions or [None]
+        }, {"duration": duration})
+    except OSError as e:
+        print(f"[⚠️] Không ghi được clip vào kho artifact: {e}")
+
+def _record_cached_clip(recorder, clip_path, duration_key, renditions):
+    """Ghi clip lấy từ kho vào lịch sử render (đếm riêng, xem RunRecorder)."""
+    if recorder is not None:
+        recorder.add_clip(_tts_duration_cache.get(duration_key, 0.0), output_bytes(clip_path, renditions),
+                          tts_key=duration_key if duration_key in _tts_duration_cache else None, cached=True)
+
+async def _cached_clip(store, key, render_coro, index, duration_key, scratch, renditions, progress_queue, cancel_token,
+                       recorder=None):
+    """Clip có sẵn trong kho thì copy ra (bỏ qua TTS/phụ đề/encode); không thì render rồi lưu vào kho.
+    Giữ khóa trong lúc render nên job khác cần cùng clip sẽ chờ và dùng lại thay vì render lần nữa."""
+    async with store.entry(key, cancel_token) as entry:
+        if entry.exists:
+            render_coro.close()
+            clip_path = await asyncio.to_thread(_materialize_clip, entry, index, duration_key, scratch, renditions)
+            _record_cached_clip(recorder, clip_path, duration_key, renditions)
+            report_progress(progress_queue, "duration", index, _tts_duration_cache.get(duration_key, 0.0))
+            return clip_path
+        clip_path = await render_coro
+        if clip_path is not None:
+            await asyncio.to_thread(_store_clip, entry, clip_path, duration_key, renditions)
+        return clip_path
+
+async def _lookup_clip(store, key, index, duration_key, scratch, renditions, cancel_token):
+    async with store.entry(key, cancel_token) as entry:
+        if not entry.exists:
+            return None
+        return await asyncio.to_thread(_materialize_clip, entry, index, duration_key, scratch, renditions)
+
+async def _put_clip(store, key, clip_path, duration_key, renditions, cancel_token):
+    async with store.entry(key, cancel_token) as entry:
+        await asyncio.to_thread(_store_clip, entry, clip_path, duration_key, renditions)
+
 async def render_shard(
     shard_id, texts, voice, image_or_video_paths, font_path,
     subtitle_color, stroke_color, bg_color, effect,
@@ -379,10 +1279,33 @@ async def render_shard(
     volume_percent=100, bg_opacity=255, voice_speed=1.0,
     stroke_width=1, sem=None, video_speed=1.0, is_video_input=False,
     offset_in_all=0, voice_source="Voicevox", effects_dir=None,
-    overlay_effect="none"
+    overlay_effect="none", on_clip_done=None,
+    width=1280, height=720, fps=25, preset="fast", global_indices=None,
+    renditions=None, use_pipes=False, scratch=None, cancel_token=None,
+    order="longest_first", workers=None, recorder=None, engine=None, clip_records=None
 ):
+    """Render các câu của một shard rồi ghép thành output_path.
+
+    on_clip_done: coroutine (global_idx, clip_path) gọi ngay khi từng clip xong (xuất dần).
+    output_path=None: không ghép shard, chỉ trả về danh sách clip theo thứ tự.
+    global_indices: chỉ số gốc của từng câu trong texts (bản nháp lấy mẫu), mặc định liên tiếp từ offset_in_all.
+    renditions: danh sách từ parse_renditions; mỗi rendition được ghép shard riêng (xem rendition_path).
+    use_pipes/scratch: TTS + phụ đề đi qua pipe, clip tạm ghi vào ScratchSpace (RAM nếu được);
+    clip trên RAM được xóa ngay sau khi ghép shard.
+    cancel_token (CancelToken): hủy thì giết mọi ffmpeg của shard, xóa clip/shard dở dang và ném RenderCancelled.
+    order: "longest_first" (mặc định) hoặc "index" (theo thứ tự câu, hợp với xuất dần);
+    workers: số clip render song song (mặc định os.cpu_count()). Kết quả luôn theo thứ tự câu.
+    recorder: RunRecorder của render_history (None = không ghi lịch sử).
+    engine: "ffmpeg" (mỗi câu một lần chạy ffmpeg) hoặc "compositor" (mỗi worker một ffmpeg thường trú,
+    frame ghép bằng Python; video nền vẫn dùng engine ffmpeg). Mặc định theo RENDER_ENGINE.
+    clip_records: list nhận (chỉ số câu gốc, câu, nền, clip hoặc None) của mọi câu theo thứ tự (cho manifest).
+    """
+    engine = engine or default_engine()
+    if engine == "compositor" and is_video_input:
+        print("[DEBUG] Engine compositor chỉ hỗ trợ ảnh nền, video nền dùng engine ffmpeg.")
+        engine = "ffmpeg"
     ffmpeg_path = get_ffmpeg_path()
-    font = ImageFont.truetype(font_path, 48)
+    font = load_font(font_path, subtitle_layout(width, height, renditions)[0])
     draw = ImageDraw.Draw(Image.new("RGBA", (10, 10)))
     volume_factor = float(volume_percent) / 100.0
     tasks = []
@@ -390,58 +1313,260 @@ async def render_shard(
     if num_files == 0:
         print("[⚠️] No images/videos selected. Video will only have a black background.")
         temp_black_image = os.path.join(output_temp_dir, "black_placeholder.png")
-        Image.new("RGB", (1280, 720), (0, 0, 0)).save(temp_black_image)
+        Image.new("RGB", (width, height), (0, 0, 0)).save(temp_black_image)
         image_or_video_paths = [temp_black_image]
         num_files = 1
 
-    global_sentence_idx = offset_in_all
-    for idx_text, text_block in enumerate(texts):
-        sentences_in_block = split_sentences(text_block)
-        for sentence_idx_in_block, sentence in enumerate(sentences_in_block):
-            if not sentence:
+    clip_specs = build_clip_specs(shard_id, texts, image_or_video_paths, offset_in_all, global_indices)
+    reused_at = find_reused_clips(clip_specs)
+    unique_clips = sorted(reused_at)
+    if len(unique_clips) < len(clip_specs):
+        print(f"[DEBUG] Shard {shard_id}: {len(clip_specs) - len(unique_clips)} clip trùng được dùng lại.")
+    shared_tts = {}
+
+    report_progress(progress_queue, "planned", len(unique_clips))
+
+    own_scratch = None
+    if use_pipes and scratch is None and output_path is not None:
+        scratch = own_scratch = ScratchSpace()
+
+    if order == "longest_first":
+        clip_order = sorted(
+            unique_clips, reverse=True,
+            key=lambda i: estimate_clip_seconds(clip_specs[i][1], voice, voice_speed, voice_source)
+        )
+    else:
+        clip_order = unique_clips
+    workers = workers or os.cpu_count() or 1
+    if sem is None:
+        sem = asyncio.Semaphore(workers)
+
+    # Vẽ trước toàn bộ phụ đề của shard trong process pool (theo thứ tự sẽ render), song song với TTS/encode
+    subtitle_path_of = {}
+    for i in clip_order:
+        subtitle_path_of.setdefault(
+            _sentence_key(clip_specs[i][1]), os.path.join(output_temp_dir, f"subtitle_{clip_specs[i][0]}.png")
+        )
+    subtitle_futures = submit_subtitle_batch(
+        [(sub_path, sentence) for sentence, sub_path in subtitle_path_of.items()],
+        font_path, width, height, renditions, subtitle_color, stroke_color, bg_color, bg_opacity, stroke_width,
+        raw=use_pipes or engine == "compositor"
+    )
+    # Kho artifact: clip đã encode với cùng đầu vào (kể cả bởi job/process khác) được copy ra thay vì render lại
+    store = get_artifact_store()
+    clip_key_of = {}
+    if store is not None:
+        clip_key_of = await asyncio.to_thread(
+            _clip_artifact_keys, store, clip_specs, unique_clips, font_path, effects_dir, overlay_effect,
+            voice=voice, voice_source=voice_source, voice_speed=voice_speed, volume_factor=volume_factor,
+            subtitle_color=subtitle_color, stroke_color=stroke_color, bg_color=bg_color, bg_opacity=bg_opacity,
+            stroke_width=stroke_width, effect=effect, video_speed=video_speed, is_video_input=is_video_input,
+            width=width, height=height, fps=fps, encoder=encoder, preset=preset, renditions=renditions, engine=engine
+        )
+
+    def duration_key_of(spec_pos):
+        return (voice_source, voice, voice_speed, _sentence_key(clip_specs[spec_pos][1]))
+
+    profile_stage(f"plan shard {shard_id}")
+
+    def make_clip(spec_pos):
+        index, sentence, file_path, clip_global_idx = clip_specs[spec_pos]
+        # Truyền riêng effect (zoom/pan/zoom+pan/none) và overlay_effect (snow/sakura/none) xuống render_sentence
+        coro = render_sentence(
+            index=index,
+            sentence=sentence,
+            voice=voice,
+            img_or_video=file_path,
+            font=font,
+            draw=draw,
+            ffmpeg_path=ffmpeg_path,
+            font_path=font_path,
+            subtitle_color=subtitle_color,
+            stroke_color=stroke_color,
+            bg_color=bg_color,
+            effect=effect,
+            encoder=encoder,
+            volume_factor=volume_factor,
+            bg_opacity=bg_opacity,
+            voice_speed=voice_speed,
+            stroke_width=stroke_width,
+            sem=sem,
+            video_speed=video_speed,
+            is_video_input=is_video_input,
+            voice_source=voice_source,
+            effects_dir=effects_dir,  # EFFECTS_DIR sẽ mặc định là BASE_DIR/effects nếu None
+            overlay_effect=overlay_effect,
+            width=width,
+            height=height,
+            fps=fps,
+            preset=preset,
+            renditions=renditions,
+            subtitle_future=subtitle_futures.get(subtitle_path_of[_sentence_key(sentence)]),
+            use_pipes=use_pipes,
+            scratch=scratch,
+            cancel_token=cancel_token,
+            progress_queue=progress_queue,
+            shared_tts=shared_tts,
+            recorder=recorder
+        )
+        if spec_pos in clip_key_of:
+            coro = _cached_clip(store, clip_key_of[spec_pos], coro, index, duration_key_of(spec_pos), scratch,
+                                renditions, progress_queue, cancel_token, recorder)
+        coro = _track_clip(index, coro, progress_queue)
+        if on_clip_done is not None:
+            global_idxs = [clip_global_idx] + [clip_specs[j][3] for j in reused_at[spec_pos]]
+            coro = _report_clip(global_idxs, coro, on_clip_done)
+        return coro
+
+    # Hàng đợi chung: mỗi worker lấy clip tiếp theo khi rảnh. Câu dài nhất (theo độ dài TTS đã biết
+    # hoặc ước lượng theo số ký tự) được render trước để cuối lượt không còn clip dài chạy một mình.
+    work_queue = asyncio.Queue()
+    for i in clip_order:
+        work_queue.put_nowait(i)
+    results = [None] * len(clip_specs)
+
+    async def clip_worker():
+        while True:
+            try:
+                i = work_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results[i] = await make_clip(i)
+            for j in reused_at[i]:
+                results[j] = results[i]
+
+    async def compositor_worker(worker_no, positions):
+        paths = await render_worker_clips(
+            shard_id, worker_no,
+            [(clip_specs[i][0], clip_specs[i][1], clip_specs[i][2],
+              subtitle_futures.get(subtitle_path_of[_sentence_key(clip_specs[i][1])])) for i in positions],
+            voice, font_path, subtitle_color, stroke_color, bg_color, effect, encoder, volume_factor,
+            bg_opacity, voice_speed, stroke_width, sem, voice_source=voice_source, effects_dir=effects_dir,
+            overlay_effect=overlay_effect, width=width, height=height, fps=fps, preset=preset,
+            renditions=renditions, scratch=scratch, cancel_token=cancel_token, progress_queue=progress_queue,
+            shared_tts=shared_tts, recorder=recorder
+        )
+        for i, clip_path in zip(positions, paths):
+            if clip_path is not None and i in clip_key_of:
+                await _put_clip(store, clip_key_of[i], clip_path, duration_key_of(i), renditions, cancel_token)
+            # render_worker_clips đã báo "clip" ở từng ranh giới segment
+            await finish_compositor_clip(i, clip_path, report=False)
+
+    async def finish_compositor_clip(i, clip_path, report=True):
+        results[i] = clip_path
+        for j in reused_at[i]:
+            results[j] = clip_path
+        if report:
+            report_progress(progress_queue, "clip", clip_specs[i][0], clip_path is not None, time.monotonic())
+        if on_clip_done is not None:
+            for global_idx in [clip_specs[i][3]] + [clip_specs[j][3] for j in reused_at[i]]:
+                await on_clip_done(global_idx, clip_path)
+
+    if engine == "compositor":
+        # Clip đã có trong kho artifact không cần đưa vào worker nào
+        pending = []
+        for i in unique_clips:
+            clip_path = None
+            if i in clip_key_of:
+                clip_path = await _lookup_clip(store, clip_key_of[i], clip_specs[i][0], duration_key_of(i), scratch,
+                                               renditions, cancel_token)
+            if clip_path is None:
+                pending.append(i)
                 continue
-            file_index = global_sentence_idx % num_files
-            file_path = image_or_video_paths[file_index]
-
-            # Truyền riêng effect (zoom/pan/zoom+pan/none) và overlay_effect (snow/sakura/none) xuống render_sentence
-            task = render_sentence(
-                index=f"{shard_id}_{idx_text}_{sentence_idx_in_block}",
-                sentence=sentence,
-                voice=voice,
-                img_or_video=file_path,
-                font=font,
-                draw=draw,
-                ffmpeg_path=ffmpeg_path,
-                font_path=font_path,
-                subtitle_color=subtitle_color,
-                stroke_color=stroke_color,
-                bg_color=bg_color,
-                effect=effect,
-                encoder=encoder,
-                volume_factor=volume_factor,
-                bg_opacity=bg_opacity,
-                voice_speed=voice_speed,
-                stroke_width=stroke_width,
-                sem=sem,
-                video_speed=video_speed,
-                is_video_input=is_video_input,
-                voice_source=voice_source,
-                effects_dir=effects_dir,  # EFFECTS_DIR sẽ mặc định là BASE_DIR/effects nếu None
-                overlay_effect=overlay_effect
-            )
-            tasks.append(task)
-            global_sentence_idx += 1
+            _record_cached_clip(recorder, clip_path, duration_key_of(i), renditions)
+            report_progress(progress_queue, "duration", clip_specs[i][0], _tts_duration_cache.get(duration_key_of(i), 0.0))
+            await finish_compositor_clip(i, clip_path)
+        # Cân bằng tổng độ dài (ước lượng) giữa các worker; mỗi worker giữ thứ tự câu trong phần của nó
+        groups = assign_to_workers(
+            pending, workers,
+            weight=lambda i: estimate_clip_seconds(clip_specs[i][1], voice, voice_speed, voice_source)
+        )
+        for worker_no, positions in enumerate(groups):
+            tasks.append(compositor_worker(worker_no, positions))
+    else:
+        for _ in range(min(workers, len(clip_specs))):
+            tasks.append(clip_worker())
 
-    results = await asyncio.gather(*tasks)
+    tasks = [asyncio.ensure_future(t) for t in tasks]
+    try:
+        await asyncio.gather(*tasks)
+    except (RenderCancelled, asyncio.CancelledError):
+        # gather không tự hủy các task còn lại khi một task ném lỗi
+        for t in tasks:
+            t.cancel()
+        for fut in list(subtitle_futures.values()) + list(shared_tts.values()):
+            fut.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if own_scratch is not None:
+            own_scratch.cleanup()
+        raise
     valid_videos = [r for r in results if r is not None]
+    profile_stage(f"clips shard {shard_id}")
+    if clip_records is not None:
+        clip_records.extend((spec[3], spec[1], spec[2], results[i]) for i, spec in enumerate(clip_specs))
+
+    if output_path is None:
+        return valid_videos
 
     if not valid_videos:
         print(f"[⚠️] No valid videos were created for shard {shard_id}. Skipping concatenation.")
-        return
+        if own_scratch is not None:
+            own_scratch.cleanup()
+        return valid_videos
+
+    stage_started = time.monotonic()
+    try:
+        for r in renditions or [None]:
+            name = r["name"] if r else None
+            concat_txt = rendition_path(os.path.join(output_temp_dir, f"shard_{shard_id}_concat.txt"), name, renditions)
+            await run_cancellable(
+                concat_videos, [rendition_path(v, name, renditions) for v in valid_videos],
+                rendition_path(output_path, name, renditions), concat_txt, cancel_token=cancel_token
+            )
+    except (RenderCancelled, asyncio.CancelledError):
+        remove_partial_outputs(output_path, renditions)
+        raise
+    except subprocess.CalledProcessError as e:
+        print(f"❌ FFmpeg error concatenating shard {shard_id}:\nCommand: {' '.join(e.cmd) if isinstance(e.cmd, list) else e.cmd}\nReturn Code: {e.returncode}\nSTDOUT:\n{e.stdout}\nSTDERR:\n{e.stderr}")
+        raise
+    finally:
+        _record_stage(recorder, "concat", stage_started)
+        if scratch is not None:
+            release_scratch_clips(scratch, valid_videos, renditions)
+            if own_scratch is not None:
+                own_scratch.cleanup()
+    profile_stage(f"concat shard {shard_id}")
+    return valid_videos
 
-    concat_txt = os.path.join(output_temp_dir, f"shard_{shard_id}_concat.txt")
+def release_scratch_clips(scratch, clip_paths, renditions=None):
+    """Trả hạn mức RAM: xóa clip tạm (mọi rendition) đã được ghép xong."""
+    paths = []
+    for clip in clip_paths:
+        for r in renditions or [None]:
+            paths.append(rendition_path(clip, r["name"] if r else None, renditions))
+    scratch.release(paths)
+    for path in paths:
+        if scratch.is_ram(path) and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+async def _track_clip(index, render_coro, progress_queue):
+    clip_path = await render_coro
+    report_progress(progress_queue, "clip", index, clip_path is not None, time.monotonic())
+    return clip_path
+
+async def _report_clip(global_idxs, render_coro, on_clip_done):
+    clip_path = await render_coro
+    for global_idx in global_idxs:
+        await on_clip_done(global_idx, clip_path)
+    return clip_path
+
+def concat_videos(video_paths, output_path, concat_txt, cancel_token=None):
+    """Ghép các clip/shard theo đúng thứ tự bằng concat demuxer (-c copy)."""
     with open(concat_txt, "w", encoding="utf-8") as f:
-        for v in valid_videos:
+        for v in video_paths:
             f.write(f"file '{normalize_path_for_ffmpeg(v)}'\n")
 
     norm_ffmpeg_path = get_ffmpeg_path()
@@ -459,8 +1584,4 @@ async def render_shard(
         '-i', norm_concat_txt, '-c', 'copy', norm_output_path
     ]
     concat_cmd = [arg.strip() for arg in concat_cmd if arg.strip()]
-    try:
-        subprocess.run(concat_cmd, check=True, stderr=subprocess.PIPE, text=True, startupinfo=si)
-    except subprocess.CalledProcessError as e:
-        print(f"❌ FFmpeg error concatenating shard {shard_id}:\nCommand: {' '.join(e.cmd) if isinstance(e.cmd, list) else e.cmd}\nReturn Code: {e.returncode}\nSTDOUT:\n{e.stdout}\nSTDERR:\n{e.stderr}")
-        raise
\ No newline at end of file
+    run_ffmpeg_blocking(concat_cmd, si, cancel_token=cancel_token)
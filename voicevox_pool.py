@@ -0,0 +1,202 @@
+"""Pool nhiều Voicevox Engine: chọn engine ít request đang chạy nhất (hòa thì xoay vòng),
+kiểm tra sức khỏe định kỳ, tạm loại engine lỗi và thử lại trên engine khác.
+
+Không bao giờ loại engine khả dụng cuối cùng; nếu mọi engine đều đang bị loại thì vẫn thử engine
+sắp hết hạn loại sớm nhất thay vì bỏ câu. Timeout/5xx chỉ loại engine khi /version cũng lỗi
+(một câu làm engine trả 500 hoặc tổng hợp chậm không có nghĩa là engine hỏng).
+
+Cấu hình qua biến môi trường VOICEVOX_ENDPOINTS, ví dụ:
+    VOICEVOX_ENDPOINTS=http://127.0.0.1:50021,http://127.0.0.1:50022
+"""
+import os
+import time
+import threading
+import requests
+
+DEFAULT_VOICEVOX_ENDPOINT = "http://127.0.0.1:50021"
+HEALTH_CHECK_INTERVAL = 10.0
+EJECT_SECONDS = 30.0
+
+
+class VoicevoxEndpoint:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.ejected_until = 0.0
+        self.failures = 0
+        self.completed = 0
+
+    @property
+    def available(self):
+        return time.time() >= self.ejected_until
+
+    def __repr__(self):
+        state = "ok" if self.available else "ejected"
+        return f"<VoicevoxEndpoint {self.url} {state} outstanding={self.outstanding}>"
+
+
+class VoicevoxPool:
+    def __init__(self, endpoints, health_interval=HEALTH_CHECK_INTERVAL, eject_seconds=EJECT_SECONDS):
+        if not endpoints:
+            endpoints = [DEFAULT_VOICEVOX_ENDPOINT]
+        self.endpoints = [VoicevoxEndpoint(u) for u in endpoints]
+        self.health_interval = health_interval
+        self.eject_seconds = eject_seconds
+        self._lock = threading.Lock()
+        self._rr = 0
+        self._health_thread = None
+        self._stop = threading.Event()
+
+    # --- Chọn engine ---
+    def acquire(self, exclude=()):
+        """Chọn engine khả dụng có ít request đang chạy nhất; hòa thì xoay vòng.
+        Mọi engine còn lại đều đang bị loại thì lấy engine có ejected_until sớm nhất; None khi đã thử hết."""
+        with self._lock:
+            remaining = [ep for ep in self.endpoints if ep not in exclude]
+            if not remaining:
+                return None
+            candidates = [ep for ep in remaining if ep.available]
+            if not candidates:
+                ep = min(remaining, key=lambda e: e.ejected_until)
+                ep.outstanding += 1
+                return ep
+            n = len(self.endpoints)
+            order = {id(ep): (i - self._rr) % n for i, ep in enumerate(self.endpoints)}
+            ep = min(candidates, key=lambda e: (e.outstanding, order[id(e)]))
+            self._rr = (self.endpoints.index(ep) + 1) % n
+            ep.outstanding += 1
+            return ep
+
+    def release(self, ep, ok=True):
+        with self._lock:
+            ep.outstanding = max(0, ep.outstanding - 1)
+            if ok:
+                ep.failures = 0
+                ep.completed += 1
+
+    def _eject_locked(self, ep):
+        """Loại ep nếu còn engine khả dụng khác. Trả về False nếu ep là engine khả dụng cuối cùng."""
+        if not any(other.available for other in self.endpoints if other is not ep):
+            return False
+        ep.ejected_until = time.time() + self.eject_seconds
+        return True
+
+    def eject(self, ep, reason=""):
+        with self._lock:
+            ep.failures += 1
+            ejected = self._eject_locked(ep)
+        if ejected:
+            print(f"[⚠️] Tạm loại Voicevox Engine {ep.url} trong {self.eject_seconds:.0f}s: {reason}")
+        else:
+            print(f"[⚠️] Voicevox Engine {ep.url} lỗi nhưng là engine khả dụng cuối cùng, vẫn giữ lại: {reason}")
+        return ejected
+
+    # --- Health check ---
+    def check_health(self, ep, timeout=2):
+        try:
+            requests.get(f"{ep.url}/version", timeout=timeout).raise_for_status()
+            return True
+        except requests.exceptions.RequestException:
+            return False
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            for ep in self.endpoints:
+                healthy = self.check_health(ep)
+                with self._lock:
+                    if healthy and not ep.available:
+                        ep.ejected_until = 0.0
+                        print(f"[DEBUG] Voicevox Engine {ep.url} hoạt động trở lại.")
+                    elif not healthy and ep.available and self._eject_locked(ep):
+                        print(f"[⚠️] Voicevox Engine {ep.url} không trả lời /version, tạm loại.")
+
+    def start_health_checks(self):
+        if self._health_thread and self._health_thread.is_alive():
+            return
+        self._stop.clear()
+        self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self):
+        self._stop.set()
+
+    # --- Gọi API ---
+    def call(self, fn):
+        """Chạy fn(base_url) trên một engine; lỗi kết nối/timeout/5xx thì thử engine khác.
+        Lỗi kết nối thì loại engine; timeout/5xx chỉ loại khi engine cũng không trả lời /version."""
+        self.start_health_checks()
+        tried = []
+        last_error = None
+        while True:
+            ep = self.acquire(exclude=tried)
+            if ep is None:
+                break
+            tried.append(ep)
+            try:
+                result = fn(ep.url)
+            except requests.exceptions.Timeout as e:
+                self.release(ep, ok=False)
+                if isinstance(e, requests.exceptions.ConnectTimeout) or not self.check_health(ep):
+                    self.eject(ep, str(e))
+                last_error = e
+                continue
+            except requests.exceptions.ConnectionError as e:
+                self.release(ep, ok=False)
+                self.eject(ep, str(e))
+                last_error = e
+                continue
+            except requests.exceptions.HTTPError as e:
+                self.release(ep, ok=False)
+                status = e.response.status_code if e.response is not None else 0
+                if status >= 500:
+                    if not self.check_health(ep):
+                        self.eject(ep, f"HTTP {status}")
+                    last_error = e
+                    continue
+                raise
+            except Exception:
+                self.release(ep, ok=False)
+                raise
+            self.release(ep, ok=True)
+            return result
+        if last_error is not None:
+            raise last_error
+        raise requests.exceptions.ConnectionError(
+            "Không có Voicevox Engine nào khả dụng: " + ", ".join(ep.url for ep in self.endpoints)
+        )
+
+    def stats(self):
+        with self._lock:
+            return [
+                {"url": ep.url, "available": ep.available, "outstanding": ep.outstanding,
+                 "completed": ep.completed, "failures": ep.failures}
+                for ep in self.endpoints
+            ]
+
+
+def parse_endpoints(value):
+    return [u.strip() for u in (value or "").split(",") if u.strip()]
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_voicevox_pool():
+    """Pool dùng chung cho cả process, đọc cấu hình từ VOICEVOX_ENDPOINTS."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            endpoints = parse_endpoints(os.environ.get("VOICEVOX_ENDPOINTS")) or [DEFAULT_VOICEVOX_ENDPOINT]
+            _default_pool = VoicevoxPool(endpoints)
+        return _default_pool
+
+
+def set_voicevox_endpoints(endpoints):
+    """Thay pool dùng chung (ví dụ khi người dùng đổi danh sách engine trên GUI)."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is not None:
+            _default_pool.stop_health_checks()
+        _default_pool = VoicevoxPool(endpoints or [DEFAULT_VOICEVOX_ENDPOINT])
+        return _default_pool